@@ -0,0 +1,87 @@
+"""LangChain callback measuring the latency and token use of answering a question."""
+import time
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from quke.request_coalescer import COALESCED
+
+
+class QuestionMetrics(BaseCallbackHandler):
+    """Collects the metrics of a single question; use one instance per question.
+
+    Latency is the wall time of the outermost chain, including retrieval and waiting for
+    the rate limiter. Tokens are summed over all LLM calls, as reported by the LLM (None
+    if the LLM does not report usage). Answers shared by the request coalescer are not
+    counted, their tokens were spent by another request.
+    """
+
+    def __init__(self) -> None:
+        """Creates an empty set of metrics."""
+        self._start: float | None = None
+        self.latency: float | None = None
+        self.input_tokens: int | None = None
+        self.output_tokens: int | None = None
+
+    def on_chain_start(
+        self,
+        serialized: dict[str, Any],  # noqa: ARG002
+        inputs: dict[str, Any],  # noqa: ARG002
+        *,
+        run_id: UUID,  # noqa: ARG002
+        parent_run_id: UUID | None = None,
+        **kwargs: object,  # noqa: ARG002
+    ) -> None:
+        """Starts the clock when the outermost chain starts."""
+        if parent_run_id is None:
+            self._start = time.perf_counter()
+
+    def on_chain_end(
+        self,
+        outputs: dict[str, Any],  # noqa: ARG002
+        *,
+        run_id: UUID,  # noqa: ARG002
+        parent_run_id: UUID | None = None,
+        **kwargs: object,  # noqa: ARG002
+    ) -> None:
+        """Records the latency when the outermost chain ends."""
+        if parent_run_id is None and self._start is not None:
+            self.latency = time.perf_counter() - self._start
+
+    def on_llm_end(self, response: LLMResult, **kwargs: object) -> None:  # noqa: ARG002
+        """Adds the token usage of an LLM call."""
+        generations = [
+            generation
+            for generations in response.generations
+            for generation in generations
+            if not (generation.generation_info or {}).get(COALESCED)
+        ]
+        if not generations:
+            return
+        usages = [
+            usage
+            for generation in generations
+            if (usage := getattr(getattr(generation, "message", None), "usage_metadata", None))
+        ]
+        if usages:
+            input_tokens = sum(u.get("input_tokens", 0) for u in usages)
+            output_tokens = sum(u.get("output_tokens", 0) for u in usages)
+        else:  # LLMs reporting OpenAI style usage only
+            token_usage = (response.llm_output or {}).get("token_usage") or {}
+            if not token_usage:
+                return
+            input_tokens = token_usage.get("prompt_tokens", 0)
+            output_tokens = token_usage.get("completion_tokens", 0)
+
+        self.input_tokens = (self.input_tokens or 0) + input_tokens
+        self.output_tokens = (self.output_tokens or 0) + output_tokens
+
+    def metrics(self) -> dict:
+        """Returns latency, input_tokens and output_tokens, as accepted by ChatResults.add."""
+        return {
+            "latency": self.latency,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+        }
@@ -0,0 +1,258 @@
+"""Removes exact and near-duplicate chunks before embedding.
+
+Annual reports and similar documents repeat headers, legal boilerplate and whole sections.
+Chunks with the same (normalized) text are exact duplicates. Near-duplicates are found with
+MinHash signatures of word shingles and locality-sensitive hashing (LSH): chunks sharing a
+band of their signature with the first chunk of a group are candidates, and join that group if
+their estimated Jaccard similarity with its first chunk reaches the threshold. Similarity is
+not transitive: if A~B and B~C but not A~C, C is not merged into the group of A and B.
+
+Only one chunk per group - the first - is embedded. The source and page of the other
+members are kept in its metadata (as a json string under DUPLICATES_KEY, as vector stores
+generally only accept scalar metadata values), so reports still list all sources. When the
+source of a representative chunk is removed from the vector store (by the ingester), one of its
+duplicates in another source takes its place, see promote_duplicate.
+"""
+import hashlib
+import json
+import logging  # functionality managed by Hydra
+import re
+from collections import defaultdict
+
+DUPLICATES_KEY = "duplicates"
+"""Metadata key holding the source/page of the chunks a chunk represents."""
+
+DUPLICATE_METADATA = ("source", "page", "row")
+"""Metadata of duplicate chunks kept with the representative chunk."""
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def deduplicate_chunks(
+    chunks: list,
+    threshold: float = 0.9,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+    seed: int = 1,
+) -> list:
+    """Returns one representative chunk per group of exact and near-duplicate chunks.
+
+    Args:
+        chunks: List of LangChain Documents.
+        threshold: Minimum estimated Jaccard similarity of the word shingles of two chunks
+        to consider them near-duplicates. 1 for exact duplicates only.
+        num_perm: Number of hash functions in a MinHash signature.
+        shingle_size: Number of words per shingle.
+        seed: Seed for the hash functions.
+
+    Returns:
+        The representative chunks, in their original order. Metadata of the other members of
+        their group is added under DUPLICATES_KEY.
+    """
+    if len(chunks) < 2:
+        return chunks
+
+    groups = _UnionFind(len(chunks))
+
+    # exact duplicates, on normalized text
+    first_by_text = {}
+    for i, chunk in enumerate(chunks):
+        key = hashlib.sha1(_normalize(chunk.page_content).encode()).digest()  # noqa: S324
+        groups.union(first_by_text.setdefault(key, i), i)
+    exact_duplicates = len(chunks) - len(first_by_text)
+
+    if threshold < 1:
+        _group_near_duplicates(
+            chunks,
+            sorted(first_by_text.values()),
+            groups,
+            threshold,
+            num_perm,
+            shingle_size,
+            seed,
+        )
+
+    members = defaultdict(list)
+    for i in range(len(chunks)):
+        members[groups.find(i)].append(i)
+
+    representatives = [
+        _representative(chunks[first], [chunks[i] for i in others])
+        for first, (_, *others) in sorted(members.items())
+    ]
+
+    logging.info(
+        f"Chunk dedup: {len(chunks) - len(representatives)} of {len(chunks)} chunks are duplicates "
+        f"({exact_duplicates} exact, {len(first_by_text) - len(representatives)} near-duplicates)."
+    )
+    return representatives
+
+
+def expand_duplicates(metadata: dict) -> list[dict]:
+    """Returns the metadata of a chunk followed by the metadata of the duplicates it represents."""
+    return [metadata, *json.loads(metadata.get(DUPLICATES_KEY, "[]"))]
+
+
+def promote_duplicate(metadata: dict, removed_source: str) -> dict | None:
+    """Returns the metadata of a chunk standing in for the duplicates of a removed representative.
+
+    Args:
+        metadata: Metadata of the representative chunk being removed.
+        removed_source: Source document of the representative chunk.
+
+    Returns:
+        The metadata of the first duplicate in another source, with the remaining duplicates
+        under DUPLICATES_KEY. None if no duplicate in another source is left.
+    """
+    duplicates = [
+        d for d in expand_duplicates(metadata)[1:] if d.get("source") != removed_source
+    ]
+    if not duplicates:
+        return None
+
+    first, *others = duplicates
+    promoted = {
+        k: v
+        for k, v in metadata.items()
+        if k not in DUPLICATE_METADATA and k != DUPLICATES_KEY
+    }
+    promoted.update(first)
+    if others:
+        promoted[DUPLICATES_KEY] = json.dumps(others)
+    return promoted
+
+
+def _group_near_duplicates(
+    chunks: list,
+    candidates: list[int],
+    groups: "_UnionFind",
+    threshold: float,
+    num_perm: int,
+    shingle_size: int,
+    seed: int,
+) -> None:
+    """Adds each candidate to the group of the first earlier representative it is similar enough to.
+
+    A candidate is compared with the first chunk (representative) of the groups only, not with
+    the other members, so groups do not grow by chains of similar chunks.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+    signatures = np.vstack(
+        [
+            _minhash(_shingles(chunks[i].page_content, shingle_size), a, b)
+            for i in candidates
+        ]
+    )
+
+    bands, rows = _lsh_bands(num_perm, threshold)
+    # per band, the signature band of the first chunk (representative) of every group
+    buckets = [defaultdict(list) for _ in range(bands)]
+    for idx, signature in enumerate(signatures):
+        keys = [signature[band * rows : (band + 1) * rows].tobytes() for band in range(bands)]
+        representative = _similar_representative(
+            signatures, signature, buckets, keys, threshold
+        )
+        if representative is None:  # first chunk of a new group
+            for band, key in enumerate(keys):
+                buckets[band][key].append(idx)
+        else:
+            groups.union(candidates[representative], candidates[idx])
+
+
+def _similar_representative(
+    signatures: object, signature: object, buckets: list, keys: list[bytes], threshold: float
+) -> int | None:
+    """Returns the first representative sharing a band with the signature and similar enough to it."""
+    import numpy as np
+
+    compared = set()
+    for band, key in enumerate(keys):
+        for representative in buckets[band].get(key, []):
+            if representative in compared:
+                continue
+            compared.add(representative)
+            if np.mean(signatures[representative] == signature) >= threshold:
+                return representative
+    return None
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _shingles(text: str, shingle_size: int) -> set[str]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= shingle_size:
+        return {" ".join(words)}
+    return {
+        " ".join(words[i : i + shingle_size])
+        for i in range(len(words) - shingle_size + 1)
+    }
+
+
+def _minhash(shingles: set[str], a: object, b: object) -> object:
+    """MinHash signature: per hash function (a * x + b) mod p, the minimum over all shingles."""
+    import numpy as np
+
+    hashes = np.fromiter(
+        (
+            int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little")
+            for s in shingles
+        ),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # the products wrap around at 2**64. With a below 2**32 they would not, but then the hash
+    # values follow the order of the shingle hashes and the minimum is mostly the same shingle.
+    return ((np.outer(a, hashes) + b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+
+def _lsh_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """Returns (bands, rows per band) with the LSH threshold (1/bands)**(1/rows) just below threshold.
+
+    A lower LSH threshold finds more candidates; each candidate is verified against threshold.
+    """
+    options = [
+        (num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0
+    ]
+    below = [(bands, rows) for bands, rows in options if (1 / bands) ** (1 / rows) < threshold]
+    return max(below, key=lambda o: (1 / o[0]) ** (1 / o[1])) if below else options[0]
+
+
+def _representative(chunk: object, duplicates: list) -> object:
+    if not duplicates:
+        return chunk
+
+    from langchain_core.documents import Document
+
+    duplicate_metadata = [
+        {k: d.metadata[k] for k in DUPLICATE_METADATA if k in d.metadata}
+        for d in duplicates
+    ]
+    return Document(
+        page_content=chunk.page_content,
+        metadata={**chunk.metadata, DUPLICATES_KEY: json.dumps(duplicate_metadata)},
+    )
+
+
+class _UnionFind:
+    """Disjoint sets of chunk indexes; the smallest index of a set is its root."""
+
+    def __init__(self, size: int) -> None:
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
@@ -1,90 +1,289 @@
-"""Reads documents from a provided directory, performs embedding and captures the embeddings in a vector store."""
+"""Reads documents from a provided directory, performs embedding and captures the embeddings in a vector store.
+
+Document loaders, splitters, embedding models and vector stores are all imported when
+used, so importing this module does not pull in LangChain.
+"""
 import importlib
 import logging  # functionality managed by Hydra
 import os
 import shutil
 import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, field
+from fnmatch import fnmatch
 from pathlib import Path
-from typing import Iterator
+from typing import Iterator, Literal
 
-# [ ] TODO: PyMU is faster, PyPDF more accurate: https://github.com/py-pdf/benchmarks
-from langchain_community.document_loaders import CSVLoader, PyMuPDFLoader, TextLoader
+from quke import ClassImportDefinition, ClassRateLimit, DatabaseAction, profiling
+from quke.page_cache import PageCache
 
-from quke import ClassImportDefinition, ClassRateLimit, DatabaseAction
+# [ ] TODO: PyMU is faster, PyPDF more accurate: https://github.com/py-pdf/benchmarks
+LOADER_MODULE = "langchain_community.document_loaders"
 
 
 @dataclass
 class DocumentLoaderDef:
-    """Definition for LangChain document loaders."""
+    """Definition for LangChain document loaders.
+
+    The loader class is referenced by module and class name and only imported
+    when a file with a matching extension is found.
+
+    Several loaders can be defined for the same extension, for example a different
+    pdf engine for large files. The first definition whose file size range
+    (min_file_size <= size < max_file_size, in bytes) contains the file is used.
+
+    parallel: 'thread' to parse files in a thread pool, 'none' to parse one by one, or
+    'process' for a pool of worker processes. Every worker process imports the loader
+    (and LangChain) again, so 'process' only pays off for many large, CPU bound documents
+    whose parsing takes far longer than that start-up.
+    """
 
     ext: str = "pdf"
-    loader: object = PyMuPDFLoader
+    loader: ClassImportDefinition = field(
+        default_factory=lambda: ClassImportDefinition(LOADER_MODULE, "PyMuPDFLoader")
+    )
     # TODO: Remove this - kwargs: defaultdict[dict] = field(default_factory=dict)  # empty dict
     kwargs: dict[str, str] = field(
         default_factory=lambda: defaultdict(dict)
     )  # empty dict
+    min_file_size: int = 0
+    max_file_size: int | None = None
+    parallel: Literal["process", "thread", "none"] = "none"
+
+    def accepts(self, file_size: int) -> bool:
+        """Whether files of the provided size (in bytes) are handled by this loader."""
+        return self.min_file_size <= file_size and (
+            self.max_file_size is None or file_size < self.max_file_size
+        )
 
 
 DOC_LOADERS = [
-    DocumentLoaderDef(ext="pdf", loader=PyMuPDFLoader),
-    DocumentLoaderDef(ext="txt", loader=TextLoader, kwargs={"encoding": "utf8"}),
-    DocumentLoaderDef(ext="csv", loader=CSVLoader),
+    DocumentLoaderDef(
+        ext="pdf",
+        loader=ClassImportDefinition(LOADER_MODULE, "PyMuPDFLoader"),
+        parallel="thread",
+    ),
+    DocumentLoaderDef(
+        ext="txt",
+        loader=ClassImportDefinition(LOADER_MODULE, "TextLoader"),
+        kwargs={"encoding": "utf8"},
+    ),
+    DocumentLoaderDef(
+        ext="md",
+        loader=ClassImportDefinition(LOADER_MODULE, "TextLoader"),
+        kwargs={"encoding": "utf8"},
+    ),
+    DocumentLoaderDef(
+        ext="html",
+        loader=ClassImportDefinition(LOADER_MODULE, "BSHTMLLoader"),
+        kwargs={"open_encoding": "utf8"},
+    ),
+    DocumentLoaderDef(
+        ext="docx",
+        loader=ClassImportDefinition(LOADER_MODULE, "Docx2txtLoader"),
+    ),
+    DocumentLoaderDef(
+        ext="csv",
+        loader=ClassImportDefinition(LOADER_MODULE, "CSVLoader"),
+        max_file_size=10_000_000,
+    ),
+    DocumentLoaderDef(
+        ext="csv",
+        loader=ClassImportDefinition("quke.loaders", "ChunkedCSVLoader"),
+        kwargs={"rows_per_document": 1000},
+    ),
 ]
-"""Defines the kind of source documents to be searched (specifically to be embedded into the vector store)."""
+"""Defines the kind of source documents to be searched (specifically to be embedded into the vector store).
 
+Used when no document_loaders are configured; the same loaders as the default config.
+"""
 
-def get_loaders(src_doc_folder: str, loader: DocumentLoaderDef) -> list:
-    """Returns loaders for each relevant file in the provided folder.
 
-    LangChain loaders are used to load various types of documents in preparation
-    of embedding and persisting in vector stores.
+def scan_source_files(
+    src_doc_folder: str,
+    document_loaders: list[DocumentLoaderDef],
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    max_file_size: int | None = None,
+) -> list[tuple[Path, DocumentLoaderDef]]:
+    """Walks the source folder once and returns each relevant file with the loader to use.
+
+    Include and exclude patterns are fnmatch style and matched against the path relative
+    to src_doc_folder (using '/'), for example 'reports/*' or '*.csv'. Folders matching an
+    exclude pattern are not walked into.
 
     Args:
         src_doc_folder: The folder of the source files.
-        loader: Definition of the loader. Loaders exist for example for
-        pdf, text and csv files.
+        document_loaders: Loader definitions, see DocumentLoaderDef.
+        include: Only files matching at least one of these patterns are loaded. All files if empty.
+        exclude: Files and folders matching any of these patterns are skipped.
+        max_file_size: Files larger than this (in bytes) are skipped. No limit if None.
 
     Returns:
-        A list of loaders to be used to read the text from source documents.
+        A list of (path, loader definition) tuples, sorted by path.
     """
-    ext = loader.ext
+    loaders_by_ext = defaultdict(list)
+    for loader in document_loaders:
+        loaders_by_ext[loader.ext.lower().lstrip(".")].append(loader)
+
+    def matches(rel_path: str, patterns: list[str] | None) -> bool:
+        return any(fnmatch(rel_path, pattern) for pattern in patterns or [])
+
+    root = Path(src_doc_folder)
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = Path(dirpath).relative_to(root)
+        dirnames[:] = sorted(
+            d for d in dirnames if not matches((rel_dir / d).as_posix(), exclude)
+        )
 
-    # to make ext case insensitive
-    ext = "".join([f"[{ch}{ch.swapcase()}]" for ch in ext])
+        for filename in sorted(filenames):
+            # the cheap extension check first; most files of a large tree have no loader
+            candidates = loaders_by_ext.get(Path(filename).suffix[1:].lower())
+            if not candidates:
+                continue
+            rel_path = (rel_dir / filename).as_posix()
+            if (include and not matches(rel_path, include)) or matches(
+                rel_path, exclude
+            ):
+                continue
+
+            file_name = Path(dirpath) / filename
+            loader = _select_loader(file_name, candidates, max_file_size)
+            if loader is not None:
+                found.append((file_name, loader))
+
+    return found
+
+
+def _select_loader(
+    file_name: Path,
+    candidates: list[DocumentLoaderDef],
+    max_file_size: int | None,
+) -> DocumentLoaderDef | None:
+    """Returns the first of the loaders for the extension of the file that accepts its size; None to skip the file."""
+    try:
+        file_size = file_name.stat().st_size
+    except OSError:
+        logging.warning(f"Skipping unreadable source document {file_name}.")
+        return None
 
-    src_file_names = Path(src_doc_folder).rglob(f"**/*.{ext}")
+    if max_file_size is not None and file_size > max_file_size:
+        logging.info(f"Skipping {file_name}: {file_size} bytes exceeds max_file_size.")
+        return None
 
-    # TODO: Problem with embedding more than 2 files at once, or some number of pages/chunks (using HF)?
-    # Error message does not really help. Appending in steps does work.
-    return [
-        loader.loader(str(pdf_name), **loader.kwargs) for pdf_name in src_file_names
-    ]
+    return next((d for d in candidates if d.accepts(file_size)), None)
+
+
+def parse_document(file_name: Path, loader: DocumentLoaderDef) -> list:
+    """Extracts the pages of a single source document with the provided loader.
 
+    Errors are logged rather than raised, a single broken file should not stop the run.
 
-def get_pages_from_document(src_doc_folder: str) -> list:
+    Args:
+        file_name: Path of the source document.
+        loader: Definition of the loader to extract the pages with.
+
+    Returns:
+        List containing one page per list item. Empty if the document could not be read.
+    """
+    try:
+        return load_document(file_name, loader)
+    except Exception as e:
+        logging.error(  # noqa: TRY400
+            f"Could not load {file_name} with {loader.loader.class_name}: {e!r}"
+        )
+        return []
+
+
+def load_document(file_name: Path, loader: DocumentLoaderDef) -> list:
+    """Extracts the pages of a single source document; like parse_document, but raises errors."""
+    module = importlib.import_module(loader.loader.module_name)
+    class_ = getattr(module, loader.loader.class_name)
+    return list(class_(str(file_name), **loader.kwargs).lazy_load())
+
+
+def _loader_name(loader: DocumentLoaderDef) -> str:
+    return f"{loader.loader.module_name}.{loader.loader.class_name}"
+
+
+def get_pages_from_document(
+    src_doc_folder: str,
+    page_cache_location: str | None = None,
+    loader_params: dict | None = None,
+) -> list:
     """Reads documents from the directory/folder provided and returns a list of pages and metadata.
 
     Args:
         src_doc_folder: Folder containing the source documents.
+        page_cache_location: Folder of the page cache. Unchanged documents are read from
+        the cache instead of being parsed again. None to disable the cache.
+        loader_params: Dictionary with optional keys document_loaders (list of
+        DocumentLoaderDef, DOC_LOADERS if absent), include, exclude, max_file_size (see
+        scan_source_files) and workers (size of the parser pools, number of CPUs if None).
 
     Returns:
         List containing one page per list item, as text.
     """
-    pages = []
-    for docloader in DOC_LOADERS:
-        for loader in get_loaders(src_doc_folder, docloader):
-            pages.extend(loader.load())
+    loader_params = loader_params or {}
+    document_loaders = loader_params.get("document_loaders") or DOC_LOADERS
+    page_cache = PageCache(page_cache_location) if page_cache_location else None
+
+    source_files = scan_source_files(
+        src_doc_folder,
+        document_loaders,
+        include=loader_params.get("include"),
+        exclude=loader_params.get("exclude"),
+        max_file_size=loader_params.get("max_file_size"),
+    )
+
+    # pages per source file, in order of source_files; parsed files are filled in below
+    pages_per_file = [
+        page_cache.get(str(file_name), _loader_name(loader)) if page_cache else None
+        for file_name, loader in source_files
+    ]
+    to_parse = defaultdict(list)
+    for i, (_, loader) in enumerate(source_files):
+        if pages_per_file[i] is None:
+            to_parse[loader.parallel].append(i)
+
+    workers = loader_params.get("workers")
+    for parallel, indexes in to_parse.items():
+        files = [source_files[i][0] for i in indexes]
+        loaders = [source_files[i][1] for i in indexes]
+        if parallel == "none" or len(indexes) < 2:
+            parsed = map(parse_document, files, loaders)
+        else:
+            executor_class = (
+                ProcessPoolExecutor if parallel == "process" else ThreadPoolExecutor
+            )
+            with executor_class(max_workers=workers) as executor:
+                parsed = list(executor.map(parse_document, files, loaders))
+
+        for i, pages in zip(indexes, parsed, strict=True):
+            pages_per_file[i] = pages
+            if page_cache is not None and pages:
+                file_name, loader = source_files[i]
+                page_cache.put(str(file_name), _loader_name(loader), pages)
+
+    pages = [page for file_pages in pages_per_file for page in file_pages]
+
+    if page_cache is not None:
+        logging.info(
+            f"Page cache: {page_cache.hits} documents read from cache, "
+            f"{page_cache.misses} documents parsed."
+        )
 
     try:
         logging.info(
             f"Document loaded: {len(pages)} pages, last one {pages[-1].metadata}"
         )
     except Exception:
+        extensions = sorted({f".{loader.ext}" for loader in document_loaders})
         logging.warning(
             f"No source documents loaded. No valid files found in {src_doc_folder}. "
-            "Must be .pdf, .txt or .csv."
+            f"Must be one of {', '.join(extensions)}."
         )
 
     return pages
@@ -137,6 +336,10 @@ def embed(
     rate_limit: ClassRateLimit,
     splitter_params: dict,
     write_mode: DatabaseAction = DatabaseAction.NO_OVERWRITE,
+    page_cache_location: str | None = None,
+    loader_params: dict | None = None,
+    dedup_params: dict | None = None,
+    shard_params: dict | None = None,
 ) -> int:
     """Reads documents from a provided directory, performs embedding and captures the embeddings in a vector store.
 
@@ -150,46 +353,80 @@ def embed(
         splitter_params: Specifications for text splitting logic.
         write_mode: Wether to OVERWRITE, APPEND or NO_OVERWRITE the vector store. NO_OVERWRITE will
         not embed anything if a vector store exists at the vectordb_location.
+        page_cache_location: Folder of the cache of extracted pages. None to disable the cache.
+        loader_params: Document loader registry and source file filters, see get_pages_from_document.
+        dedup_params: Settings for removing duplicate chunks before embedding; key 'enabled' and
+        the keyword arguments of quke.dedup.deduplicate_chunks. None to embed all chunks.
+        shard_params: Settings for a sharded vector store, see embed_shards. None for a single store.
 
     Returns:
         The number of text chunks embedded.
     """
     logging.info(f"Starting to embed into VectorDB: {vectordb_location}")
 
-    # if folder does not exist, or write_mode is APPEND no need to do anything here.
-    if (
-        Path(vectordb_location).exists()
-        and (not Path(vectordb_location).is_file())
-        and os.listdir(vectordb_location)
-    ):
-        # path exists and is not empty - assumed to contain vectordb
-        if write_mode == DatabaseAction.NO_OVERWRITE:  # skip embedding
-            logging.info(
-                f"No new embeddings created. Embedding database already exists at "
-                f"{vectordb_location!r}. Remove database folder, or change embedding config "
-                "vectorstore_write_mode to OVERWRITE or APPEND."
-            )
-            return 0
-        if (
-            write_mode == DatabaseAction.OVERWRITE
-        ):  # remove exising database before embedding
-            # TODO: Is this too harsh to delete the full folder? At least create a backup?
-            logging.warning(
-                f"The folder containing the embedding database ({vectordb_location}) and all its contents "
-                "about to be overwritten."
-            )
-            shutil.rmtree(vectordb_location)
+    if not prepare_vectordb_location(vectordb_location, write_mode):
+        return 0
 
     # get bite sized chunks from source documents
-    chunks = get_chunks_from_pages(
-        get_pages_from_document(src_doc_folder), splitter_params
-    )
+    with profiling.stage("embed.load"):
+        pages = get_pages_from_document(src_doc_folder, page_cache_location, loader_params)
+    with profiling.stage("embed.split"):
+        chunks = get_chunks_from_pages(pages, splitter_params)
+
+    if dedup_params and dedup_params.get("enabled"):
+        with profiling.stage("embed.dedup"):
+            chunks = deduplicate(chunks, dedup_params, rate_limit)
 
     logging.warning(
         "CAUTION: This function uses external compute services (like OpenAI or HuggingFace). "
         "This is likely to cost money."
     )
 
+    with profiling.stage("embed.vectorstore"):
+        if shard_params:
+            return embed_shards(
+                chunks,
+                src_doc_folder,
+                vectordb_location,
+                embedding_import,
+                embedding_kwargs,
+                vectordb_import,
+                rate_limit,
+                shard_params,
+            )
+
+        return embed_in_batches(
+            chunks,
+            vectordb_location,
+            embedding_import,
+            embedding_kwargs,
+            vectordb_import,
+            rate_limit,
+        )
+
+
+def embed_in_batches(
+    chunks: list,
+    vectordb_location: str,
+    embedding_import: ClassImportDefinition,
+    embedding_kwargs: dict,
+    vectordb_import: ClassImportDefinition,
+    rate_limit: ClassRateLimit,
+) -> int:
+    """Embeds the chunks in batches of rate_limit.count_limit, waiting rate_limit.delay in between.
+
+    Args:
+        chunks: List of text chunks to be embedded.
+        vectordb_location: Location of the folder containing the embedding database.
+        embedding_import: Definition of embedding model.
+        embedding_kwargs: **kwargs to be provided to embedding class.
+        vectordb_import: Definition of vector store.
+        rate_limit: Rate limiting info.
+
+    Returns:
+        Number of chunks embedded and captured in vector store.
+    """
+
     # Use chunker to embed in chunks with a wait time in between. As a basic way to deal with some rate limiting.
     def chunker(seq: list, size: int) -> Iterator[list]:
         return (seq[pos : pos + size] for pos in range(0, len(seq), size))
@@ -212,6 +449,126 @@ def embed(
     return c
 
 
+def embed_shards(
+    chunks: list,
+    src_doc_folder: str,
+    vectordb_location: str,
+    embedding_import: ClassImportDefinition,
+    embedding_kwargs: dict,
+    vectordb_import: ClassImportDefinition,
+    rate_limit: ClassRateLimit,
+    shard_params: dict,
+) -> int:
+    """Partitions the chunks into shards and builds the shards in parallel.
+
+    Each shard is a vector store in a subfolder of vectordb_location. Note that the rate
+    limit applies to each shard separately.
+
+    Args:
+        chunks: List of text chunks to be embedded.
+        src_doc_folder: Folder containing the source documents.
+        vectordb_location: Location of the folder containing the shards.
+        embedding_import: Definition of embedding model.
+        embedding_kwargs: **kwargs to be provided to embedding class.
+        vectordb_import: Definition of vector store.
+        rate_limit: Rate limiting info, per shard.
+        shard_params: Keys shard_by ('hash' or 'folder'), num_shards (for 'hash') and
+        workers (number of shards built at the same time).
+
+    Returns:
+        Number of chunks embedded and captured in the shards.
+    """
+    from quke import shards
+
+    shard_by = shard_params.get("shard_by", "hash")
+    partitions = shards.partition_chunks(
+        chunks, src_doc_folder, shard_by, shard_params.get("num_shards", 4)
+    )
+    logging.info(
+        f"Embedding into {len(partitions)} shards: "
+        + ", ".join(f"{name} ({len(c)} chunks)" for name, c in partitions.items())
+    )
+
+    def embed_shard(name: str) -> int:
+        return embed_in_batches(
+            partitions[name],
+            str(Path(vectordb_location) / name),
+            embedding_import,
+            embedding_kwargs,
+            vectordb_import,
+            rate_limit,
+        )
+
+    with ThreadPoolExecutor(max_workers=shard_params.get("workers")) as executor:
+        c = sum(executor.map(embed_shard, partitions))
+
+    shards.write_manifest(vectordb_location, list(partitions), shard_by)
+    return c
+
+
+def prepare_vectordb_location(vectordb_location: str, write_mode: DatabaseAction) -> bool:
+    """Applies the write mode to an existing vector store before new embeddings are added.
+
+    Args:
+        vectordb_location: Folder of vector store database.
+        write_mode: Wether to OVERWRITE, APPEND or NO_OVERWRITE the vector store.
+
+    Returns:
+        False if nothing should be written (NO_OVERWRITE and a vector store exists), else True.
+    """
+    # if folder does not exist, or write_mode is APPEND no need to do anything here.
+    if (
+        Path(vectordb_location).exists()
+        and (not Path(vectordb_location).is_file())
+        and os.listdir(vectordb_location)
+    ):
+        # path exists and is not empty - assumed to contain vectordb
+        if write_mode == DatabaseAction.NO_OVERWRITE:  # skip embedding
+            logging.info(
+                f"No new embeddings created. Embedding database already exists at "
+                f"{vectordb_location!r}. Remove database folder, or change embedding config "
+                "vectorstore_write_mode to OVERWRITE or APPEND."
+            )
+            return False
+        if (
+            write_mode == DatabaseAction.OVERWRITE
+        ):  # remove exising database before embedding
+            # TODO: Is this too harsh to delete the full folder? At least create a backup?
+            logging.warning(
+                f"The folder containing the embedding database ({vectordb_location}) and all its contents "
+                "about to be overwritten."
+            )
+            shutil.rmtree(vectordb_location)
+
+    return True
+
+
+def deduplicate(chunks: list, dedup_params: dict, rate_limit: ClassRateLimit) -> list:
+    """Removes duplicate chunks and logs the embedding work avoided.
+
+    Args:
+        chunks: List of text chunks.
+        dedup_params: Keyword arguments for quke.dedup.deduplicate_chunks (and 'enabled').
+        rate_limit: Rate limiting info, to report the embedding batches avoided.
+
+    Returns:
+        The chunks to embed.
+    """
+    from quke.dedup import deduplicate_chunks
+
+    kwargs = {k: v for k, v in dedup_params.items() if k != "enabled"}
+    unique_chunks = deduplicate_chunks(chunks, **kwargs)
+
+    def batches(count: int) -> int:
+        return -(-count // rate_limit.count_limit)
+
+    logging.info(
+        f"Embedding calls avoided: {len(chunks) - len(unique_chunks)} chunks, "
+        f"{batches(len(chunks)) - batches(len(unique_chunks))} rate limited batches."
+    )
+    return unique_chunks
+
+
 def embed_these_chunks(
     chunks: list,
     vectordb_location: str,
@@ -236,8 +593,9 @@ def embed_these_chunks(
     embedding = class_(**embedding_kwargs)
 
     module = importlib.import_module(vectordb_import.module_name)
-    class_ = getattr(module, vectordb_import.class_name)
-    vectordb_type = class_()
+    # from_documents is a class method; an instance (for Chroma an in-memory client shared
+    # by all threads) is not needed
+    vectordb_type = getattr(module, vectordb_import.class_name)
 
     _ = vectordb_type.from_documents(
         documents=chunks, embedding=embedding, persist_directory=vectordb_location
@@ -0,0 +1,453 @@
+"""Long-running ingest mode: embeds documents as they land in the source document folder.
+
+The Ingester loads the embedding model and opens the vector store once, then watches
+source_document_folder. File system events (through watchdog, inotify on Linux) trigger a
+scan of the folder; without watchdog the folder is scanned every poll_interval seconds.
+A scan compares the size and modification time of every source document (as selected by the
+document loaders and source_document_filter) with the recorded state:
+
+- New and changed files are embedded once unchanged for debounce seconds (so files still being
+  copied are not read), in batches of at most max_batch_files. The chunks of a file get ids
+  derived from its path, so a changed file replaces its chunks; chunks it no longer has are
+  deleted once the new ones are stored.
+- The chunks of deleted files are deleted from the vector store.
+
+A file that cannot be read, or whose chunks cannot be stored (for example as the embedding
+service is rate limited), keeps its previous chunks and is retried after a delay that doubles
+with every failure, up to MAX_RETRY_DELAY seconds.
+
+Files are read, split and embedded with the same loaders, splitter and (sharded) vector store
+as embed(). Chunk deduplication does not apply, as duplicates may span files that change
+independently. Chunks embedded by embed() may represent duplicates in other files, though;
+when such a chunk is deleted, a duplicate in another file takes its place. The state is saved
+in a json file after every batch, so a restarted ingester only embeds what changed in between.
+If there is no state file yet, the documents with chunks in an existing vector store (as
+recorded in their source metadata) are taken as embedded; the other documents in the folder
+are embedded on the first scan.
+
+SIGINT and SIGTERM stop the ingester after the file in progress, without waiting out the
+rate limit delay.
+
+Deleting chunks requires a vector store with a Chroma style get(where=...) and delete(ids).
+"""
+import hashlib
+import importlib
+import json
+import logging  # functionality managed by Hydra
+import signal
+import threading
+import time
+from pathlib import Path
+
+from quke import ClassImportDefinition, ClassRateLimit
+from quke.dedup import expand_duplicates, promote_duplicate
+from quke.embed import (
+    DOC_LOADERS,
+    _loader_name,
+    get_chunks_from_pages,
+    load_document,
+    scan_source_files,
+)
+from quke.page_cache import PageCache
+
+STATE_VERSION = 1
+
+READ_BATCH_SIZE = 5000
+"""Number of chunks read at once from the vector store to find the documents it holds."""
+
+MAX_RETRY_DELAY = 600
+"""Maximum number of seconds before a file that failed to ingest is tried again."""
+
+
+class Ingester:
+    """Keeps the embedding model and vector store open and embeds new or changed documents."""
+
+    def __init__(
+        self,
+        src_doc_folder: str,
+        vectordb_location: str,
+        embedding_import: ClassImportDefinition,
+        embedding_kwargs: dict,
+        vectordb_import: ClassImportDefinition,
+        rate_limit: ClassRateLimit,
+        splitter_params: dict,
+        state_file: str,
+        page_cache_location: str | None = None,
+        loader_params: dict | None = None,
+        shard_params: dict | None = None,
+        poll_interval: float = 5,
+        debounce: float = 2,
+        max_batch_files: int = 50,
+        use_watchdog: bool = True,
+    ) -> None:
+        """Loads the embedding model and prepares the vector store.
+
+        Args:
+            src_doc_folder: Folder containing the source documents.
+            vectordb_location: Folder of vector store database.
+            embedding_import: Definition for embedding model.
+            embedding_kwargs: **kwargs to be provided to embedding class.
+            vectordb_import: Definition of vector store.
+            rate_limit: Rate limiting info. At most count_limit chunks are embedded at once,
+            waiting delay seconds in between.
+            splitter_params: Specifications for text splitting logic.
+            state_file: Path of the json file recording the embedded documents.
+            page_cache_location: Folder of the cache of extracted pages. None to disable the cache.
+            loader_params: Document loader registry and source file filters, see
+            quke.embed.get_pages_from_document.
+            shard_params: Settings for a sharded vector store, see quke.embed.embed_shards.
+            None for a single store.
+            poll_interval: Seconds between scans of the folder, if no file system events arrive.
+            debounce: Seconds a new or changed file must be unchanged before it is embedded.
+            max_batch_files: Maximum number of files embedded in a single batch.
+            use_watchdog: Whether to use file system events (if watchdog is installed).
+        """
+        self.src_doc_folder = src_doc_folder
+        self.vectordb_location = vectordb_location
+        self.vectordb_import = vectordb_import
+        self.rate_limit = rate_limit
+        self.splitter_params = splitter_params
+        self.state_file = Path(state_file)
+        self.page_cache = PageCache(page_cache_location) if page_cache_location else None
+        self.loader_params = loader_params or {}
+        self.shard_params = shard_params or {}
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_batch_files = max_batch_files
+        self.use_watchdog = use_watchdog
+
+        self.stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._vectordbs: dict[str, object] = {}
+        self._pending: dict[str, tuple[list[int], float]] = {}
+        self._failures: dict[str, tuple[list[int], int, float]] = {}
+
+        module = importlib.import_module(embedding_import.module_name)
+        class_ = getattr(module, embedding_import.class_name)
+        self.embedding = class_(**embedding_kwargs)
+
+        self.state = self._load_state()
+
+    def run(self) -> None:
+        """Watches the source folder and embeds documents until stopped (SIGINT/SIGTERM or stop())."""
+        observer = self._start_observer() if self.use_watchdog else None
+        if observer is None:
+            logging.info(f"Scanning {self.src_doc_folder} every {self.poll_interval} seconds.")
+
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():  # signals need the main thread
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[sig] = signal.signal(sig, self._handle_signal)
+
+        logging.info(f"Ingesting documents from {self.src_doc_folder} into {self.vectordb_location}.")
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.ingest_changes()
+                except Exception:
+                    logging.exception("Ingesting changes failed; trying again.")
+                # pending files are checked again after the debounce period
+                self._wake_event.wait(
+                    min(self.debounce, self.poll_interval) if self._pending else self.poll_interval
+                )
+                self._wake_event.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+            logging.info("Ingester stopped.")
+
+    def stop(self) -> None:
+        """Stops run() after the batch in progress."""
+        self.stop_event.set()
+        self._wake_event.set()
+
+    def ingest_changes(self) -> int:
+        """Scans the folder once; embeds the files that are ready and removes deleted files.
+
+        Returns:
+            The number of chunks embedded.
+        """
+        files = self._scan()
+        now = time.monotonic()
+
+        deleted = [source for source in self.state if source not in files]
+        for source in deleted:
+            self._delete_chunks(source)
+            del self.state[source]
+        if deleted:
+            logging.info(f"Removed {len(deleted)} deleted documents from the vector store.")
+            self._save_state()
+
+        ready = []
+        for source, (signature, loader) in files.items():
+            if self.state.get(source) == signature:
+                self._pending.pop(source, None)
+                continue
+            seen_signature, since = self._pending.get(source, (None, now))
+            if seen_signature != signature:
+                self._pending[source] = (signature, now)  # new or still changing
+            elif now - since >= self.debounce and not self._retry_later(source, signature, now):
+                ready.append((source, signature, loader))
+        self._pending = {s: p for s, p in self._pending.items() if s in files}
+        self._failures = {s: f for s, f in self._failures.items() if s in files}
+
+        c = 0
+        for start in range(0, len(ready), self.max_batch_files):
+            if self.stop_event.is_set():
+                break
+            c += self._ingest_batch(ready[start : start + self.max_batch_files])
+        return c
+
+    def _ingest_batch(self, batch: list) -> int:
+        started = time.perf_counter()
+        c = 0
+        ingested = []
+        for source, signature, loader in batch:
+            if self.stop_event.is_set():
+                break
+            try:
+                # parse before touching the vector store, the previous chunks are kept on errors
+                chunks = get_chunks_from_pages(self._pages(source, loader), self.splitter_params)
+                ids = [_chunk_id(source, i) for i in range(len(chunks))]
+                for start in range(0, len(chunks), self.rate_limit.count_limit):
+                    if (c > 0 or start > 0) and self.stop_event.wait(self.rate_limit.delay):
+                        break
+                    end = start + self.rate_limit.count_limit
+                    c += self._add_chunks(source, chunks[start:end], ids[start:end])
+                if self.stop_event.is_set():  # not recorded, so ingested again after a restart
+                    break
+                if source in self.state:  # changed; remove the chunks it no longer has
+                    self._delete_chunks(source, keep=set(ids))
+            except Exception as e:
+                self._failed(source, signature, e)
+                continue
+
+            self.state[source] = signature
+            self._pending.pop(source, None)
+            self._failures.pop(source, None)
+            ingested.append(source)
+        self._save_state()
+
+        if ingested:
+            logging.info(
+                f"Ingested {len(ingested)} documents ({c} chunks) "
+                f"in {time.perf_counter() - started:.1f} seconds: "
+                + ", ".join(Path(source).name for source in ingested)
+            )
+        return c
+
+    def _retry_later(self, source: str, signature: list[int], now: float) -> bool:
+        """Whether a file that failed to ingest (and did not change since) is still waiting to retry."""
+        failed_signature, _, retry_at = self._failures.get(source, (None, 0, 0.0))
+        return failed_signature == signature and now < retry_at
+
+    def _failed(self, source: str, signature: list[int], error: Exception) -> None:
+        failed_signature, failures, _ = self._failures.get(source, (None, 0, 0.0))
+        failures = failures + 1 if failed_signature == signature else 1
+        delay = min(self.poll_interval * 2 ** (failures - 1), MAX_RETRY_DELAY)
+        self._failures[source] = (signature, failures, time.monotonic() + delay)
+        logging.error(
+            f"Could not ingest {source} (attempt {failures}): {error!r}. "
+            f"Trying again in {delay:.0f} seconds."
+        )
+
+    def _scan(self) -> dict[str, tuple[list[int], object]]:
+        """Returns the signature (size, modification time) and loader per source document."""
+        files = {}
+        for file_name, loader in scan_source_files(
+            self.src_doc_folder,
+            self.loader_params.get("document_loaders") or DOC_LOADERS,
+            include=self.loader_params.get("include"),
+            exclude=self.loader_params.get("exclude"),
+            max_file_size=self.loader_params.get("max_file_size"),
+        ):
+            try:
+                stat = file_name.stat()
+            except OSError:  # deleted since the scan
+                continue
+            files[str(file_name)] = ([stat.st_size, stat.st_mtime_ns], loader)
+        return files
+
+    def _pages(self, source: str, loader: object) -> list:
+        if self.page_cache is not None:
+            pages = self.page_cache.get(source, _loader_name(loader))
+            if pages is not None:
+                return pages
+        pages = load_document(Path(source), loader)
+        if self.page_cache is not None and pages:
+            self.page_cache.put(source, _loader_name(loader), pages)
+        return pages
+
+    def _add_chunks(self, source: str, chunks: list, ids: list[str]) -> int:
+        if chunks:
+            self._vectordb(self._location(source)).add_documents(chunks, ids=ids)
+        return len(chunks)
+
+    def _delete_chunks(self, source: str, keep: set[str] | None = None) -> None:
+        """Deletes the chunks of a source document, except the ids in keep."""
+        location = self._location(source)
+        if not Path(location).exists():
+            return
+        vectordb = self._vectordb(location)
+        res = vectordb.get(where={"source": source}, include=["documents", "metadatas"])
+        chunks = [
+            (id_, text, metadata)
+            for id_, text, metadata in zip(res["ids"], res["documents"], res["metadatas"], strict=True)
+            if id_ not in (keep or ())
+        ]
+        if not chunks:
+            return
+
+        self._promote_duplicates(source, chunks)
+        vectordb.delete([id_ for id_, _, _ in chunks])
+        logging.info(f"Deleted {len(chunks)} chunks of {source} from the vector store.")
+
+    def _promote_duplicates(self, source: str, chunks: list[tuple[str, str, dict]]) -> None:
+        """Adds a duplicate in another document for every chunk (embedded deduplicated) deleted."""
+        promoted = 0
+        for id_, text, metadata in chunks:
+            new_metadata = promote_duplicate(metadata or {}, source)
+            if new_metadata is None:
+                continue
+            new_source = str(new_metadata.get("source", ""))
+            self._vectordb(self._location(new_source)).add_texts(
+                [text], [new_metadata], ids=[_chunk_id(new_source, id_)]
+            )
+            promoted += 1
+        if promoted:
+            logging.info(f"{promoted} chunks of {source} replaced by their duplicates in other documents.")
+
+    def _location(self, source: str) -> str:
+        """Returns the folder of the vector store (shard) holding the chunks of a source document."""
+        if not self.shard_params:
+            return self.vectordb_location
+
+        from quke import shards
+
+        shard_by = self.shard_params.get("shard_by", "hash")
+        name = shards.shard_name(
+            source, self.src_doc_folder, shard_by, self.shard_params.get("num_shards", 4)
+        )
+        if name not in (shards.read_manifest(self.vectordb_location) or []):
+            shards.write_manifest(self.vectordb_location, [name], shard_by)
+        return str(Path(self.vectordb_location) / name)
+
+    def _vectordb(self, location: str) -> object:
+        if location not in self._vectordbs:
+            module = importlib.import_module(self.vectordb_import.module_name)
+            class_ = getattr(module, self.vectordb_import.class_name)
+            self._vectordbs[location] = class_(
+                embedding_function=self.embedding, persist_directory=location
+            )
+        return self._vectordbs[location]
+
+    def _load_state(self) -> dict[str, list[int]]:
+        if self.state_file.is_file():
+            state = json.loads(self.state_file.read_text())
+            if (
+                state.get("version") == STATE_VERSION
+                and state.get("vectordb_location") == self.vectordb_location
+            ):
+                return state["files"]
+            logging.warning(
+                f"Ignoring ingest state {self.state_file}; it belongs to another vector store."
+            )
+
+        if Path(self.vectordb_location).exists():
+            stored = self._stored_sources()
+            files = self._scan()
+            self.state = {
+                source: signature for source, (signature, _) in files.items() if source in stored
+            }
+            logging.info(
+                f"No ingest state found. {len(self.state)} documents in {self.src_doc_folder} "
+                f"already have chunks in {self.vectordb_location}."
+            )
+            if len(files) > len(self.state):
+                logging.warning(
+                    f"{len(files) - len(self.state)} documents in {self.src_doc_folder} are not in "
+                    f"{self.vectordb_location} and will be embedded."
+                )
+            self._save_state()
+            return self.state
+        return {}
+
+    def _stored_sources(self) -> set[str]:
+        """Returns the source documents with chunks in the vector store, including duplicates."""
+        from quke import shards
+
+        names = shards.read_manifest(self.vectordb_location)
+        locations = (
+            [str(Path(self.vectordb_location) / name) for name in names]
+            if names
+            else [self.vectordb_location]
+        )
+        sources = set()
+        for location in locations:
+            if not Path(location).exists():
+                continue
+            vectordb = self._vectordb(location)
+            offset = 0
+            while True:
+                res = vectordb.get(include=["metadatas"], limit=READ_BATCH_SIZE, offset=offset)
+                if not res["ids"]:
+                    break
+                sources.update(
+                    str(m.get("source"))
+                    for metadata in res["metadatas"]
+                    for m in expand_duplicates(metadata or {})
+                )
+                offset += len(res["ids"])
+        return sources
+
+    def _save_state(self) -> None:
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_file.with_suffix(".tmp")
+        tmp_file.write_text(
+            json.dumps(
+                {
+                    "version": STATE_VERSION,
+                    "vectordb_location": self.vectordb_location,
+                    "files": self.state,
+                }
+            )
+        )
+        tmp_file.replace(self.state_file)
+
+    def _start_observer(self) -> object | None:
+        """Starts a watchdog observer waking up the ingester on file system events."""
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            logging.info("watchdog is not installed; polling for new documents instead.")
+            return None
+
+        wake_event = self._wake_event
+
+        class WakeUp(FileSystemEventHandler):
+            def on_any_event(self, event: object) -> None:  # noqa: ARG002
+                wake_event.set()
+
+        observer = Observer()
+        observer.schedule(WakeUp(), self.src_doc_folder, recursive=True)
+        observer.start()
+        logging.info(f"Watching {self.src_doc_folder} for new documents.")
+        return observer
+
+    def _handle_signal(self, signum: int, frame: object) -> None:  # noqa: ARG002
+        logging.info(f"Received {signal.Signals(signum).name}; stopping after the current batch.")
+        self.stop()
+
+
+def _chunk_id(source: str, key: object) -> str:
+    """Returns the id of a chunk of a source document; the same for every run."""
+    return hashlib.sha256(f"{source}\n{key}".encode()).hexdigest()
+
+
+def ingest(**ingest_params: object) -> None:
+    """Runs an Ingester until stopped; see Ingester for the parameters."""
+    Ingester(**ingest_params).run()
@@ -1,4 +1,7 @@
-"""Sets up all elements required for a chat session."""
+"""Sets up all elements required for a chat session.
+
+LangChain chains and Jinja are imported when a chat is started or a report is written.
+"""
 
 import importlib
 import logging  # functionality managed by Hydra
@@ -7,12 +10,9 @@ from datetime import datetime
 from pathlib import Path
 from typing import Literal
 
-from jinja2 import Environment, PackageLoader, select_autoescape
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import ChatPromptTemplate
-
-from quke import ClassImportDefinition
+from quke import ClassImportDefinition, profiling
+from quke.dedup import expand_duplicates
+from quke.results import ChatResults
 
 
 def chat(
@@ -23,7 +23,11 @@ def chat(
     llm_parameters: dict,
     prompt_parameters: dict,
     output_file: dict,
-) -> object:
+    max_concurrency: int = 1,
+    results_database: str | None = None,
+    run_info: dict | None = None,
+    embedding_kwargs: dict | None = None,
+) -> ChatResults:
     """Initiates a chat with an LLM.
 
     Sets up all components required for the chat including the LLM,
@@ -38,21 +42,94 @@ def chat(
         llm_parameters: dict provided as **kwargs to LLM model class.
         prompt_parameters: List of questions to ask the LLM.
         output_file: Folder where result file will be saved.
+        max_concurrency: Number of questions asked at the same time; 1 to ask them one by one.
+        results_database: Path of the SQLite database collecting the results of all runs.
+        None to not store the results.
+        run_info: Settings of the run stored with the results, see quke.results_db.write_run.
+        embedding_kwargs: **kwargs to be provided to embedding class.
 
     Returns:
-        Object containing chat history.
+        ChatResults with the question, answer and IDs of the retrieved chunks per question.
     """
+    with profiling.stage("chat.build_chain"):
+        chain = build_chain(
+            vectordb_location,
+            embedding_import,
+            vectordb_import,
+            llm_import,
+            llm_parameters,
+            embedding_kwargs,
+        )
+
+    # NOTE: trial API keys may have very restrictive rules. It is plausible that you run into
+    # constraints after the 2nd question.
+    with profiling.stage("chat.ask"):
+        results = ask(chain, prompt_parameters, max_concurrency)
+
+    coalescer = llm_parameters.get("cache")
+    if getattr(coalescer, "coalesced", 0):
+        logging.info(
+            f"{coalescer.coalesced} LLM requests shared an identical in-flight request."
+        )
+
+    # results = [qa({"question": question}) for question in prompt_parameters]
+    with profiling.stage("chat.report"):
+        chat_output_to_html(
+            results, output_file
+        )  # TODO: infer output from output file name in cfg?
+        chat_output_to_html(results, output_file, output_extension=".md")
+        chat_output_to_html(results, output_file, output_extension="logging")
+
+    if results_database:
+        from quke.results_db import write_run
+
+        with profiling.stage("chat.results_db"):
+            run_id = write_run(results_database, run_info or {}, results)
+        logging.info(f"Results stored as run {run_id} in: {results_database}")
+
+    logging.info("=======================")
+
+    return results
+
+
+def build_chain(
+    vectordb_location: str,
+    embedding_import: ClassImportDefinition,
+    vectordb_import: ClassImportDefinition,
+    llm_import: ClassImportDefinition,
+    llm_parameters: dict,
+    embedding_kwargs: dict | None = None,
+) -> object:
+    """Sets up the embedding model, vector store, retriever, LLM and question answering chain.
+
+    The chain can be reused for any number of questions, see ask().
+
+    Args:
+        vectordb_location: Folder of vector store.
+        embedding_import: Definition of embedding model.
+        vectordb_import: Definition of vector store.
+        llm_import: Definition of LLM.
+        llm_parameters: dict provided as **kwargs to LLM model class.
+        embedding_kwargs: **kwargs to be provided to embedding class.
+
+    Returns:
+        LangChain retrieval chain taking 'input' and 'chat_history'.
+    """
+    from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.prompts import ChatPromptTemplate
+
+    from quke.shards import get_retriever
+
     module = importlib.import_module(embedding_import.module_name)
     class_ = getattr(module, embedding_import.class_name)
-    embedding = class_()
+    embedding = class_(**(embedding_kwargs or {}))
 
     logging.warning(
         "CAUTION: This function uses external compute services "
         "(like OpenAI or HuggingFace). This is likely to cost money."
     )
-    module = importlib.import_module(vectordb_import.module_name)
-    class_ = getattr(module, vectordb_import.class_name)
-    vectordb = class_(embedding_function=embedding, persist_directory=vectordb_location)
+    retriever = get_retriever(vectordb_location, vectordb_import, embedding)
 
     module = importlib.import_module(llm_import.module_name)
     class_ = getattr(module, llm_import.class_name)
@@ -79,7 +156,7 @@ def chat(
         ]
     )
     history_aware_retriever = create_history_aware_retriever(
-        llm, vectordb.as_retriever(), condense_question_prompt
+        llm, retriever, condense_question_prompt
     )
 
     system_prompt = (
@@ -101,46 +178,61 @@ def chat(
     )
     qa_chain = create_stuff_documents_chain(llm, qa_prompt)
 
-    convo_qa_chain = create_retrieval_chain(history_aware_retriever, qa_chain)
+    return create_retrieval_chain(history_aware_retriever, qa_chain)
 
-    # NOTE: trial API keys may have very restrictive rules. It is plausible that you run into
-    # constraints after the 2nd question.
 
-    results = [
-        convo_qa_chain.invoke(
-            {
-                "input": question,
-                "chat_history": [],
-            }
-        )
-        for question in prompt_parameters
-    ]
+def ask(chain: object, questions: list[str], max_concurrency: int = 1) -> ChatResults:
+    """Asks the questions using a chain from build_chain().
 
-    # results = [qa({"question": question}) for question in prompt_parameters]
-    chat_output_to_html(
-        results, output_file
-    )  # TODO: infer output from output file name in cfg?
-    chat_output_to_html(results, output_file, output_extension=".md")
-    chat_output_to_html(results, output_file, output_extension="logging")
+    Args:
+        chain: Question answering chain.
+        questions: Questions to ask.
+        max_concurrency: Number of questions asked at the same time; 1 to ask them one by one.
 
-    logging.info("=======================")
+    Returns:
+        ChatResults with the question, answer, IDs of the retrieved chunks, latency and
+        tokens per question.
+    """
+    from quke.chat_metrics import QuestionMetrics
+
+    # Results are made compact as soon as a question is answered: retrieved chunks are
+    # stored once and referenced by ID. Answers are added in the order of the questions.
+    results = ChatResults()
+    metrics = [QuestionMetrics() for _ in questions]
+    outputs = {}
+    for index, output in chain.batch_as_completed(
+        [{"input": question, "chat_history": []} for question in questions],
+        config=[
+            {"max_concurrency": max_concurrency, "callbacks": [question_metrics]}
+            for question_metrics in metrics
+        ],
+    ):
+        outputs[index] = output["answer"], results.add_context(output["context"])
+    for index, question in enumerate(questions):
+        answer, chunk_ids = outputs[index]
+        results.add(question, answer, chunk_ids, **metrics[index].metrics())
+    logging.info(
+        f"{len(results)} answers reference {len(results.chunks)} unique retrieved chunks."
+    )
 
     return results
 
 
 def chat_output_to_html(
-    results: list[dict],
+    results: ChatResults,
     output_file: dict,
     output_extension: Literal[".html", ".md", "logging"] = ".html",
 ) -> None:
     """Write summary of chat experiment into HTML file.
 
     Args:
-        results: list of dicts with the answer from the LLM. Expects 'question', 'answer'
-        and 'source' keys; 'page' key optionally.
+        results: ChatResults with the answers from the LLM. The templates resolve the
+        chunk IDs of each result with context().
         output_file: path and other information regarding the output file.
         output_extension: .html or .md. Alteratively logging for python logging.
     """
+    from jinja2 import Environment, PackageLoader, select_autoescape
+
     env = Environment(loader=PackageLoader("quke"), autoescape=select_autoescape())
 
     if output_extension.lower() == ".html":
@@ -153,7 +245,7 @@ def chat_output_to_html(
         template_name = "chat_session.html.jinja"
 
     template = env.get_template(template_name)
-    func_dict = {"dict_crosstab": _dict_crosstab_for_jinja}
+    func_dict = {"dict_crosstab": _dict_crosstab_for_jinja, "context": results.context}
     template.globals.update(func_dict)
 
     output = template.render(
@@ -173,13 +265,17 @@ def chat_output_to_html(
 def _dict_crosstab_for_jinja(sources: list) -> dict:
     """Wrapper around dict_crostab for use from within Jinja.
 
+    Includes the sources of the duplicate chunks a retrieved chunk represents.
+
     Args:
         sources (list): _description_
 
     Returns:
         dict: _description_
     """
-    src_docs = [doc.metadata for doc in sources]
+    src_docs = [
+        metadata for doc in sources for metadata in expand_duplicates(doc.metadata)
+    ]
     return dict_crosstab(src_docs, "source", "page")
 
 
@@ -0,0 +1,71 @@
+"""Document loaders provided by quke, complementing the LangChain community loaders.
+
+Referenced from the document loader registry (see quke.embed.DocumentLoaderDef and the
+document_loaders section of config.yaml) by module and class name.
+"""
+import csv
+from pathlib import Path
+from typing import Iterator
+
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+
+
+class ChunkedCSVLoader(BaseLoader):
+    """Streams a (large) csv file, combining a number of rows into each Document.
+
+    LangChain's CSVLoader creates one Document per row, which for large files means
+    millions of small Documents held in memory at once. This loader reads the file
+    row by row and yields a Document per rows_per_document rows. Each row is formatted
+    as CSVLoader does ('column: value' lines), rows are separated by an empty line.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        rows_per_document: int = 1000,
+        encoding: str | None = "utf8",
+        csv_args: dict | None = None,
+    ) -> None:
+        """Initializes the loader.
+
+        Args:
+            file_path: Path of the csv file.
+            rows_per_document: Number of rows combined into a single Document.
+            encoding: Encoding of the csv file.
+            csv_args: Provided as **kwargs to csv.DictReader.
+        """
+        self.file_path = file_path
+        self.rows_per_document = rows_per_document
+        self.encoding = encoding
+        self.csv_args = csv_args or {}
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yields a Document per rows_per_document rows of the csv file."""
+        with Path(self.file_path).open(newline="", encoding=self.encoding) as fp:
+            reader = csv.DictReader(fp, **self.csv_args)
+            rows = []
+            first_row = 0
+            for i, row in enumerate(reader):
+                rows.append(
+                    "\n".join(
+                        f"{k.strip() if k is not None else k}: {v.strip() if isinstance(v, str) else v}"
+                        for k, v in row.items()
+                    )
+                )
+                if len(rows) == self.rows_per_document:
+                    yield self._document(rows, first_row)
+                    rows = []
+                    first_row = i + 1
+            if rows:
+                yield self._document(rows, first_row)
+
+    def _document(self, rows: list[str], first_row: int) -> Document:
+        return Document(
+            page_content="\n\n".join(rows),
+            metadata={
+                "source": str(self.file_path),
+                "row": first_row,
+                "rows": len(rows),
+            },
+        )
@@ -0,0 +1,192 @@
+"""Load test driver: runs embed() and a large number of questions, and reports throughput.
+
+Meant for the stand-in models of quke.standin (llm=standin embedding=standin), so that the
+limits of quke itself - concurrency, rate limiters, vector store - can be measured without
+provider costs, but works with any configured models.
+
+The embedding phase embeds the source documents into a separate vector store (loadtest
+folder within internal_data_folder, overwritten every run). The chat phase asks the
+configured questions, repeated with a number appended until the requested number of
+(unique) questions is reached, max_concurrency at a time. Failed questions, like injected
+429 errors, are counted rather than stopping the test.
+
+The report - throughput, latency percentiles, errors, tokens and the time spent waiting for
+the LLM rate limiter - is logged, printed and written to loadtest.json in the output folder.
+"""
+import json
+import logging  # functionality managed by Hydra
+import math
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+from quke import DatabaseAction
+from quke.server import LatencyStats
+
+
+class TimedRateLimiter(BaseRateLimiter):
+    """Wraps a rate limiter, measuring the time spent waiting for it."""
+
+    def __init__(self, rate_limiter: BaseRateLimiter) -> None:
+        """Wraps the rate limiter."""
+        self.rate_limiter = rate_limiter
+        self.waits = LatencyStats(window=1_000_000)
+        self.total_wait = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        """Acquires from the wrapped rate limiter, recording the wait."""
+        started = time.perf_counter()
+        acquired = self.rate_limiter.acquire(blocking=blocking)
+        self._record(time.perf_counter() - started)
+        return acquired
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        """Acquires from the wrapped rate limiter, recording the wait."""
+        started = time.perf_counter()
+        acquired = await self.rate_limiter.aacquire(blocking=blocking)
+        self._record(time.perf_counter() - started)
+        return acquired
+
+    def _record(self, wait: float) -> None:
+        self.waits.add(wait)
+        with self._lock:
+            self.total_wait += wait
+
+    def summary(self) -> dict:
+        """Returns the number of acquisitions, total wait and wait percentiles in seconds."""
+        return {**self.waits.summary(), "total": round(self.total_wait, 2)}
+
+
+def run_loadtest(
+    embed_params: dict,
+    chain_params: dict,
+    questions: list[str],
+    num_questions: int = 100,
+    max_concurrency: int = 4,
+    embed: bool = True,
+    chat: bool = True,
+    report_file: str | None = None,
+) -> dict:
+    """Runs the load test and returns the report.
+
+    Args:
+        embed_params: Parameters of quke.embed.embed. vectordb_location is the folder of the
+        load test vector store; write_mode is set to OVERWRITE.
+        chain_params: Parameters of quke.llm_chat.build_chain. Questions are asked using
+        the load test vector store if embed is True.
+        questions: Questions to ask; repeated with a number appended up to num_questions.
+        num_questions: Number of questions asked.
+        max_concurrency: Number of questions asked at the same time.
+        embed: Whether to run the embedding phase.
+        chat: Whether to run the chat phase.
+        report_file: Path of the json report; None to not write it.
+
+    Returns:
+        The report: a dict with the results of each phase.
+    """
+    report = {}
+    if embed:
+        report["embed"] = _embed_phase(embed_params)
+        chain_params = {**chain_params, "vectordb_location": embed_params["vectordb_location"]}
+    if chat:
+        report["chat"] = _chat_phase(chain_params, questions, num_questions, max_concurrency)
+
+    logging.info(f"Load test report: {json.dumps(report)}")
+    if report_file:
+        Path(report_file).write_text(json.dumps(report, indent=2))
+    print_report(report)
+    return report
+
+
+def _embed_phase(embed_params: dict) -> dict:
+    from quke.embed import embed
+
+    started = time.perf_counter()
+    chunks = embed(**{**embed_params, "write_mode": DatabaseAction.OVERWRITE})
+    seconds = time.perf_counter() - started
+
+    rate_limit = embed_params["rate_limit"]
+    batches = math.ceil(chunks / rate_limit.count_limit) if chunks else 0
+    return {
+        "chunks": chunks,
+        "seconds": round(seconds, 2),
+        "chunks_per_second": round(chunks / seconds, 2) if seconds else None,
+        "batches": batches,
+        # embed_in_batches sleeps rate_limit.delay between batches (per shard if sharded)
+        "rate_limit_sleep": (batches - 1) * rate_limit.delay if batches else 0,
+    }
+
+
+def _chat_phase(
+    chain_params: dict, questions: list[str], num_questions: int, max_concurrency: int
+) -> dict:
+    from quke.chat_metrics import QuestionMetrics
+    from quke.llm_chat import build_chain
+
+    llm_parameters = dict(chain_params["llm_parameters"])
+    rate_limiter = None
+    if llm_parameters.get("rate_limiter") is not None:
+        rate_limiter = llm_parameters["rate_limiter"] = TimedRateLimiter(
+            llm_parameters["rate_limiter"]
+        )
+    chain = build_chain(**{**chain_params, "llm_parameters": llm_parameters})
+
+    asked = [
+        questions[i % len(questions)]
+        + (f" ({i // len(questions)})" if i >= len(questions) else "")
+        for i in range(num_questions)
+    ]
+    metrics = [QuestionMetrics() for _ in asked]
+    latencies = LatencyStats(window=num_questions)
+    errors = Counter()
+
+    started = time.perf_counter()
+    for index, output in chain.batch_as_completed(
+        [{"input": question, "chat_history": []} for question in asked],
+        config=[
+            {"max_concurrency": max_concurrency, "callbacks": [question_metrics]}
+            for question_metrics in metrics
+        ],
+        return_exceptions=True,
+    ):
+        if isinstance(output, Exception):
+            errors[type(output).__name__] += 1
+        elif metrics[index].latency is not None:
+            latencies.add(metrics[index].latency)
+    seconds = time.perf_counter() - started
+    answers = num_questions - sum(errors.values())
+
+    output_tokens = sum(m.output_tokens or 0 for m in metrics)
+    return {
+        "questions": num_questions,
+        "answers": answers,
+        "errors": dict(errors),
+        "max_concurrency": max_concurrency,
+        "seconds": round(seconds, 2),
+        "answers_per_second": round(answers / seconds, 2) if seconds else None,
+        "output_tokens_per_second": round(output_tokens / seconds, 1) if seconds else None,
+        "latency": latencies.summary(),
+        "rate_limiter_wait": rate_limiter.summary() if rate_limiter else None,
+    }
+
+
+def print_report(report: dict) -> None:
+    """Prints the report as a table per phase."""
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+    for phase, results in report.items():
+        table = Table(title=f"Load test: {phase}")
+        table.add_column("Metric")
+        table.add_column("Value")
+        for metric, value in results.items():
+            if isinstance(value, dict):
+                value = ", ".join(f"{k}: {v}" for k, v in value.items()) or "-"
+            table.add_row(metric, str(value))
+        console.print(table)
+
@@ -0,0 +1,164 @@
+"""Persistent cache of the pages extracted from source documents.
+
+Extracting text from (pdf) documents is the most expensive CPU step of embedding. The
+pages extracted from a source document are stored in a compressed Parquet file, keyed
+by the path, size, modification time and content hash of the source document and the
+loader used. Runs that only change, for example, the splitter arguments read unchanged
+documents from this cache instead of parsing them again.
+
+pyarrow and LangChain are imported when the cache is first read or written.
+"""
+import hashlib
+import json
+import logging  # functionality managed by Hydra
+import os
+from pathlib import Path
+
+CACHE_FORMAT_VERSION = "1"
+"""Increase when the layout of a cache entry changes; older entries are then ignored."""
+
+
+class PageCache:
+    """Folder with one Parquet file of extracted pages per source document.
+
+    A cache entry is used when the source document has the same size and modification
+    time as when it was cached. If only the modification time differs the content hash
+    decides; a matching hash refreshes the stored modification time.
+    """
+
+    def __init__(self, cache_location: str) -> None:
+        """Creates the cache folder if it does not exist yet."""
+        self.cache_location = Path(cache_location)
+        self.cache_location.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_path: str, loader_name: str) -> list | None:
+        """Returns the cached pages of a source document, or None if not cached or stale.
+
+        Args:
+            file_path: Path of the source document.
+            loader_name: Name of the loader the pages should have been extracted with.
+
+        Returns:
+            List of LangChain Documents, one per page. None if there is no valid entry.
+        """
+        import pyarrow.parquet as pq
+
+        entry = self._entry_path(file_path)
+        if not entry.is_file():
+            self.misses += 1
+            return None
+
+        try:
+            table = pq.read_table(entry)
+        except Exception:
+            logging.warning(f"Ignoring unreadable page cache entry {entry}.")
+            self.misses += 1
+            return None
+
+        key = _decode_key(table.schema.metadata)
+        stat = Path(file_path).stat()
+        if (
+            key.get("version") != CACHE_FORMAT_VERSION
+            or key.get("loader") != loader_name
+            or key.get("size") != str(stat.st_size)
+        ):
+            self.misses += 1
+            return None
+
+        if key.get("mtime_ns") != str(stat.st_mtime_ns):
+            if key.get("sha256") != file_sha256(file_path):
+                self.misses += 1
+                return None
+            # content unchanged (for example a fresh copy); avoid hashing again next time
+            self._write(entry, table, file_path, loader_name, key["sha256"])
+
+        self.hits += 1
+        return _pages_from_table(table)
+
+    def put(self, file_path: str, loader_name: str, pages: list) -> None:
+        """Stores the pages extracted from a source document.
+
+        Args:
+            file_path: Path of the source document.
+            loader_name: Name of the loader used to extract the pages.
+            pages: List of LangChain Documents, one per page.
+        """
+        import pyarrow as pa
+
+        table = pa.table(
+            {
+                "page_content": pa.array(
+                    [page.page_content for page in pages], pa.large_string()
+                ),
+                "metadata": pa.array(
+                    [json.dumps(page.metadata, default=str) for page in pages],
+                    pa.string(),
+                ),
+            }
+        )
+        self._write(
+            self._entry_path(file_path),
+            table,
+            file_path,
+            loader_name,
+            file_sha256(file_path),
+        )
+
+    def _entry_path(self, file_path: str) -> Path:
+        name = hashlib.sha256(str(Path(file_path).resolve()).encode()).hexdigest()
+        return self.cache_location / f"{name}.parquet"
+
+    def _write(
+        self, entry: Path, table: object, file_path: str, loader_name: str, sha256: str
+    ) -> None:
+        import pyarrow.parquet as pq
+
+        stat = Path(file_path).stat()
+        key = {
+            "version": CACHE_FORMAT_VERSION,
+            "path": str(Path(file_path).resolve()),
+            "loader": loader_name,
+            "size": str(stat.st_size),
+            "mtime_ns": str(stat.st_mtime_ns),
+            "sha256": sha256,
+        }
+        table = table.replace_schema_metadata({f"quke.{k}": v for k, v in key.items()})
+
+        # write to a temporary file first; parallel jobs may share the cache folder
+        tmp_entry = entry.with_suffix(f".{os.getpid()}.tmp")
+        pq.write_table(table, tmp_entry, compression="zstd")
+        tmp_entry.replace(entry)
+
+
+def file_sha256(file_path: str) -> str:
+    """Returns the SHA-256 hex digest of the contents of a file."""
+    digest = hashlib.sha256()
+    with Path(file_path).open("rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _decode_key(metadata: dict | None) -> dict:
+    """Returns the quke cache key stored in Parquet schema metadata."""
+    prefix = b"quke."
+    return {
+        k[len(prefix) :].decode(): v.decode()
+        for k, v in (metadata or {}).items()
+        if k.startswith(prefix)
+    }
+
+
+def _pages_from_table(table: object) -> list:
+    from langchain_core.documents import Document
+
+    return [
+        Document(page_content=content, metadata=json.loads(metadata))
+        for content, metadata in zip(
+            table.column("page_content").to_pylist(),
+            table.column("metadata").to_pylist(),
+            strict=True,
+        )
+    ]
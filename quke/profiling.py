@@ -0,0 +1,260 @@
+"""Built-in profiling of a run: where the time and memory of each stage goes.
+
+With profile=True (see config.yaml) a sampling thread records the call stacks of all threads
+every interval seconds, and tracemalloc traces memory allocations. embed() and chat() mark
+their stages - loading documents, splitting, embedding, building the chain, asking,
+rendering reports - with stage(); samples and allocations are attributed to the stage that is
+running. At the end of the run the following files are written to the output folder, next to
+chat_session.md:
+
+- profile.speedscope.json: a flame graph per stage, to open in https://www.speedscope.app
+- profile.folded.txt: the same stacks in folded format (stage;thread;frame;... count), for
+  flamegraph.pl and similar tools
+- profile_memory.md: wall time, peak memory and memory growth per stage, and the lines
+  holding most of the memory allocated during the run
+
+Time spent waiting - on providers, rate limiters or worker processes - shows as stacks
+ending in socket reads, sleeps or waits. Work done in worker processes (like parsing pdfs in a
+process pool) is not sampled.
+
+Peak and growth per stage are cheap to measure; the lines holding most memory are taken from
+a single snapshot at the end of the run, as comparing snapshots at every stage takes seconds
+once LangChain and the vector store are loaded. Tracing memory does slow down the run
+(imports in particular); set profiling.memory=False to profile time only.
+
+When profiling is disabled stage() returns a shared no-op context manager, so the stages cost
+a function call and a global lookup.
+"""
+import contextlib
+import json
+import logging  # functionality managed by Hydra
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Iterator
+
+_NO_STAGE = contextlib.nullcontext()
+_profiler: "Profiler | None" = None
+
+
+class Profiler:
+    """Samples the stacks of all threads and traces memory, per stage."""
+
+    def __init__(self, interval: float = 0.005, memory: bool = True, top: int = 25) -> None:
+        """Configures the profiler.
+
+        Args:
+            interval: Seconds between stack samples.
+            memory: Whether to trace memory allocations (tracemalloc); slows down the run.
+            top: Number of lines holding most memory reported.
+        """
+        self.interval = interval
+        self.memory = memory
+        self.top = top
+
+        self.stages: list[str] = ["other"]
+        self.samples: dict[str, Counter] = {}
+        self.timings: dict[str, float] = Counter()
+        self.allocations: list[tracemalloc.Statistic] = []
+        self.peaks: dict[str, int] = Counter()
+        self.growth: dict[str, int] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="quke-profiler", daemon=True)
+
+    def start(self) -> None:
+        """Starts sampling (and tracing memory)."""
+        if self.memory:
+            tracemalloc.start()
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling and tracing."""
+        self._stop.set()
+        self._thread.join()
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            tracemalloc.stop()
+            self.allocations = snapshot.statistics("lineno")[: self.top]
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Attributes samples, time and memory while the block runs to the stage."""
+        name = f"{self.stages[-1]}/{name}" if len(self.stages) > 1 else name
+        before = 0
+        if self.memory:
+            self._record_peak()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        self.stages.append(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - started
+            if self.memory:
+                self._record_peak()
+                self.growth[name] += tracemalloc.get_traced_memory()[0] - before
+            self.stages.pop()
+
+    def _record_peak(self) -> None:
+        """Records the peak since the last reset for all running (nested) stages."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for name in self.stages[1:]:
+            self.peaks[name] = max(self.peaks[name], peak)
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stage = self.stages[-1]
+            names = {t.ident: t.name for t in threading.enumerate()}
+            counter = self.samples.setdefault(stage, Counter())
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                    frame = frame.f_back
+                counter[(names.get(thread_id, str(thread_id)), tuple(reversed(stack)))] += 1
+
+    def write(self, output_folder: str) -> list[Path]:
+        """Writes the speedscope, folded stacks and memory reports; returns their paths."""
+        folder = Path(output_folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        paths = [
+            folder / "profile.speedscope.json",
+            folder / "profile.folded.txt",
+            folder / "profile_memory.md",
+        ]
+        paths[0].write_text(json.dumps(self.speedscope()))
+        paths[1].write_text(
+            "".join(
+                f"{stage};{thread};{';'.join(_frame_name(f) for f in stack)} {count}\n"
+                for stage, counter in self.samples.items()
+                for (thread, stack), count in counter.items()
+            )
+        )
+        paths[2].write_text(self.memory_report())
+        return paths
+
+    def speedscope(self) -> dict:
+        """Returns the samples in speedscope file format, a sampled profile per stage."""
+        frames: list[dict] = []
+        frame_index: dict[tuple, int] = {}
+
+        def index(frame: tuple) -> int:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                name, file, line = frame
+                frames.append({"name": name, "file": file, "line": line})
+            return frame_index[frame]
+
+        profiles = []
+        for stage, counter in self.samples.items():
+            samples, weights = [], []
+            for (thread, stack), count in counter.items():
+                samples.append([index((f"thread {thread}", "", 0)), *map(index, stack)])
+                weights.append(count * self.interval)
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": stage,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            )
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": "quke",
+            "activeProfileIndex": 0,
+            "exporter": "quke",
+        }
+
+    def memory_report(self) -> str:
+        """Returns a markdown report with time and memory per stage, and top allocations."""
+        lines = [
+            "# quke profile",
+            "",
+            "| Stage | Seconds | Peak memory (MB) | Memory growth (MB) |",
+            "| --- | ---: | ---: | ---: |",
+        ]
+        lines += [
+            f"| {stage} | {seconds:.2f} | "
+            + (
+                f"{self.peaks[stage] / 1e6:.1f} | {self.growth[stage] / 1e6:.1f} |"
+                if self.memory
+                else "- | - |"
+            )
+            for stage, seconds in self.timings.items()
+        ]
+        if self.allocations:
+            lines += [
+                "",
+                "## Lines holding most memory at the end of the run",
+                "",
+                "| Location | Size (KB) | Blocks |",
+                "| --- | ---: | ---: |",
+            ]
+            lines += [
+                f"| {s.traceback[0].filename}:{s.traceback[0].lineno} | "
+                f"{s.size / 1024:.1f} | {s.count} |"
+                for s in self.allocations
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def _frame_name(frame: tuple) -> str:
+    name, file, line = frame
+    return f"{name} ({Path(file).name}:{line})"
+
+
+def stage(name: str) -> contextlib.AbstractContextManager:
+    """Marks a stage of the run for the active profiler; a no-op if profiling is disabled."""
+    if _profiler is None:
+        return _NO_STAGE
+    return _profiler.stage(name)
+
+
+@contextlib.contextmanager
+def profile(
+    enabled: bool,
+    output_folder: str,
+    interval: float = 0.005,
+    memory: bool = True,
+    top: int = 25,
+) -> Iterator["Profiler | None"]:
+    """Profiles the block if enabled, writing the reports to output_folder at the end.
+
+    See Profiler for the other arguments.
+    """
+    global _profiler
+    if not enabled:
+        yield None
+        return
+
+    _profiler = Profiler(interval, memory, top)
+    _profiler.start()
+    logging.info(f"Profiling with a sample every {interval} seconds (memory: {memory}).")
+    try:
+        yield _profiler
+    finally:
+        profiler, _profiler = _profiler, None
+        profiler.stop()
+        paths = profiler.write(output_folder)
+        logging.info(
+            "Profile per stage (seconds): "
+            + ", ".join(f"{s}: {t:.2f}" for s, t in profiler.timings.items())
+        )
+        logging.info(f"Profile written to: {', '.join(str(p) for p in paths)}")
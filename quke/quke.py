@@ -1,19 +1,32 @@
 """Main module to initiate quke, to compare chat results.
 
 LLMs, embedding model, vector store and other components can be congfigured.
+
+Only light-weight dependencies are imported at module level. The embedding, chat
+and rate limiter modules (and with them LangChain, Jinja and Rich) are imported
+on the code paths that need them, keeping start-up fast for runs that, for
+example, only verify an existing vector store.
 """
 
+from __future__ import annotations
+
+import hashlib
+import json
 import logging  # functionality managed by Hydra
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import hydra
 from dotenv import find_dotenv, load_dotenv
 from hydra.utils import to_absolute_path
 from omegaconf import DictConfig, OmegaConf
-from rich.console import Console
 
-from quke import ClassImportDefinition, ClassRateLimit, DatabaseAction, embed, llm_chat
-from quke import rate_limiter as qrate_limiter
+from quke import ClassImportDefinition, ClassRateLimit, DatabaseAction
+from quke.embed import DocumentLoaderDef
+
+if TYPE_CHECKING:
+    from langchain_core.rate_limiters import BaseRateLimiter
+    from rich.console import Console
 
 _ = load_dotenv(find_dotenv())
 
@@ -72,6 +85,27 @@ class ConfigParser:
             )
             self.write_mode = DatabaseAction.NO_OVERWRITE
 
+        try:
+            self.page_cache_location = (
+                str(Path.cwd() / cfg.internal_data_folder / cfg.page_cache_folder)
+                if cfg.page_cache_folder
+                else None
+            )
+        except Exception:
+            self.page_cache_location = None
+
+        self.loader_params = self.get_loader_params(cfg)
+
+        try:
+            self.dedup_params = self.get_args_dict(cfg.chunk_dedup)
+        except Exception:
+            self.dedup_params = {}
+
+        try:
+            self.shard_params = self.get_args_dict(cfg.embedding.vectordb.shards)
+        except Exception:
+            self.shard_params = {}
+
         self.questions = cfg.question.questions
 
         try:
@@ -82,6 +116,13 @@ class ConfigParser:
         except Exception:
             self.embed_only = False
 
+        try:
+            self.command = cfg.command or "chat"
+        except Exception:
+            self.command = "chat"
+
+        self.transfer_file = self.get_transfer_file(cfg)
+
         # TODO: need something better for output folder
         # https://hydra.cc/docs/tutorials/basic/running_your_app/working_directory/
         try:  # try statement done for testing suite
@@ -94,6 +135,31 @@ class ConfigParser:
 
         self.llm_rate_limiter_name = getattr(cfg.llm, "rate_limiter", None)
 
+        try:
+            self.max_concurrency = cfg.max_concurrency or 1
+        except Exception:
+            self.max_concurrency = 1
+
+        self.results_database = self.get_results_database(cfg)
+
+    def get_request_coalescer_kwargs(self) -> dict:
+        """Based on the config files returns the set of parameters needed to setup a request coalescer.
+
+        Returns an empty dict if request coalescing is not configured or not enabled.
+        """
+        try:
+            coalescing = self.get_args_dict(self.cfg.request_coalescing)
+        except Exception:
+            return {}
+        if not coalescing.pop("enabled", False):
+            return {}
+
+        if coalescing.get("lock_folder"):
+            coalescing["lock_folder"] = str(
+                Path.cwd() / self.cfg.internal_data_folder / coalescing["lock_folder"]
+            )
+        return coalescing
+
     def get_rate_limiter_kwargs(self) -> dict:
         """Based on the config files returns the set of parameters needed to setup a rate limiter."""
         if not self.llm_rate_limiter_name:
@@ -116,6 +182,14 @@ class ConfigParser:
             )
             rate_limiter_config = {}
 
+        if rate_limiter_config.get("backend") == "sqlite":
+            # shared by all processes using the same internal_data_folder
+            rate_limiter_config["database"] = str(
+                Path.cwd()
+                / self.cfg.internal_data_folder
+                / rate_limiter_config.get("database", "rate_limiters.sqlite")
+            )
+
         return rate_limiter_config
 
     def get_embed_params(self) -> dict:
@@ -129,18 +203,147 @@ class ConfigParser:
             "rate_limit": self.embedding_rate_limit,
             "splitter_params": self.get_splitter_params(),
             "write_mode": self.write_mode,
+            "page_cache_location": self.page_cache_location,
+            "loader_params": self.loader_params,
+            "dedup_params": self.dedup_params,
+            "shard_params": self.shard_params,
         }
 
-    def get_chat_params(self) -> dict:
-        """Based on the config files returns the set of parameters need to start a chat."""
+    def get_chain_params(self) -> dict:
+        """Based on the config files returns the set of parameters needed to build a question answering chain."""
         return {
             "vectordb_location": self.vectordb_location,
             "embedding_import": self.embedding_import,
             "vectordb_import": self.vectordb_import,
             "llm_import": self.llm_import,
             "llm_parameters": self.get_llm_parameters(),
+            "embedding_kwargs": self.embedding_kwargs,
+        }
+
+    def get_chain_key(self) -> str:
+        """Identifies the (embedding, vector store, LLM) combination of the config."""
+        llm_args = json.dumps(
+            OmegaConf.to_container(self.cfg.llm.llm_args, resolve=True),
+            sort_keys=True,
+            default=str,
+        )
+        return (
+            f"{self.llm_import.class_name}({getattr(self.cfg.llm, 'name', None)}, "
+            f"{hashlib.sha1(llm_args.encode()).hexdigest()[:8]}) | "  # noqa: S324
+            f"{self.embedding_import.class_name} | {self.vectordb_location}"
+        )
+
+    def get_chat_params(self) -> dict:
+        """Based on the config files returns the set of parameters need to start a chat."""
+        return {
+            **self.get_chain_params(),
             "prompt_parameters": self.questions,
             "output_file": self.get_chat_session_file_parameters(self.cfg),
+            "max_concurrency": self.max_concurrency,
+            "results_database": self.results_database,
+            "run_info": self.get_run_info(),
+        }
+
+    def get_run_info(self) -> dict:
+        """Based on the config files returns the settings of a run stored in the results database."""
+        try:
+            question_set = hydra.core.hydra_config.HydraConfig.get()["runtime"]["choices"][
+                "question"
+            ]
+        except Exception:
+            question_set = None
+
+        return {
+            "output_dir": str(Path(self.output_file).parent),
+            "llm_class": f"{self.llm_import.module_name}.{self.llm_import.class_name}",
+            "llm_model": getattr(self.cfg.llm, "name", None),
+            "embedding_class": f"{self.embedding_import.module_name}.{self.embedding_import.class_name}",
+            "vectordb_class": f"{self.vectordb_import.module_name}.{self.vectordb_import.class_name}",
+            "splitter_class": f"{self.splitter_import.module_name}.{self.splitter_import.class_name}",
+            "splitter_args": self.splitter_args,
+            "question_set": question_set,
+            "config_yaml": OmegaConf.to_yaml(self.cfg),
+        }
+
+    def get_export_params(self) -> dict:
+        """Based on the config files returns the set of parameters needed to export a vector store."""
+        return {
+            "vectordb_location": self.vectordb_location,
+            "vectordb_import": self.vectordb_import,
+            "embedding_import": self.embedding_import,
+            "transfer_file": self.transfer_file,
+        }
+
+    def get_import_params(self) -> dict:
+        """Based on the config files returns the set of parameters needed to import into a vector store."""
+        return {
+            "transfer_file": self.transfer_file,
+            "vectordb_location": self.vectordb_location,
+            "vectordb_import": self.vectordb_import,
+            "embedding_import": self.embedding_import,
+            "embedding_kwargs": self.embedding_kwargs,
+            "write_mode": self.write_mode,
+            "src_doc_folder": self.src_doc_folder,
+            "shard_params": self.shard_params,
+        }
+
+    def get_ingest_params(self) -> dict:
+        """Based on the config files returns the set of parameters needed to run the ingester."""
+        params = {
+            key: value
+            for key, value in self.get_embed_params().items()
+            if key not in ("write_mode", "dedup_params")
+        }
+        try:
+            ingest_args = self.get_args_dict(self.cfg.ingest)
+        except Exception:
+            ingest_args = {}
+        params.update(ingest_args)
+        params["state_file"] = str(
+            Path.cwd()
+            / self.cfg.internal_data_folder
+            / ingest_args.get("state_file", "ingest_state.json")
+        )
+        return params
+
+    def get_loadtest_params(self) -> dict:
+        """Based on the config files returns the set of parameters needed to run a load test."""
+        try:
+            loadtest_args = self.get_args_dict(self.cfg.loadtest)
+        except Exception:
+            loadtest_args = {}
+
+        vectordb_location = str(
+            Path.cwd()
+            / self.cfg.internal_data_folder
+            / loadtest_args.pop("vectorstore_location", "loadtest/vector_store")
+        )
+        return {
+            "embed_params": {
+                **self.get_embed_params(),
+                "vectordb_location": vectordb_location,
+            },
+            "chain_params": self.get_chain_params(),
+            "questions": list(self.questions),
+            "max_concurrency": self.max_concurrency,
+            "report_file": str(Path(self.output_file).parent / "loadtest.json"),
+            **loadtest_args,
+        }
+
+    def get_profile_params(self) -> dict:
+        """Based on the config files returns the set of parameters needed to profile a run."""
+        try:
+            enabled = bool(self.cfg.profile)
+        except Exception:
+            enabled = False
+        try:
+            profiling_args = self.get_args_dict(self.cfg.profiling)
+        except Exception:
+            profiling_args = {}
+        return {
+            "enabled": enabled,
+            "output_folder": str(Path(self.output_file).parent),
+            **profiling_args,
         }
 
     def get_splitter_params(self) -> dict:
@@ -150,16 +353,53 @@ class ConfigParser:
             "splitter_args": self.splitter_args,
         }
 
+    def get_loader_params(self, cfg: DictConfig) -> dict:
+        """Based on the config files returns the document loader registry and source file filters.
+
+        Without document_loaders in the config the default loaders of quke.embed are used.
+        """
+        res = {}
+        try:
+            res["document_loaders"] = [
+                DocumentLoaderDef(
+                    ext=loader["ext"],
+                    loader=ClassImportDefinition(
+                        loader["module_name"], loader["class_name"]
+                    ),
+                    kwargs=loader.get("kwargs") or {},
+                    min_file_size=loader.get("min_file_size") or 0,
+                    max_file_size=loader.get("max_file_size"),
+                    parallel=loader.get("parallel") or "none",
+                )
+                for loader in OmegaConf.to_container(cfg.document_loaders, resolve=True)
+            ]
+        except Exception:
+            logging.info("No document_loaders configured. Using default loaders.")
+
+        try:
+            res.update(self.get_args_dict(cfg.source_document_filter))
+        except Exception:
+            res.update({"include": None, "exclude": None, "max_file_size": None})
+
+        try:
+            res["workers"] = cfg.loader_workers
+        except Exception:
+            res["workers"] = None
+
+        return res
+
     def get_args_dict(self, cfg_sub: dict) -> dict:
         """Takes a subset of the Hydra configs and returns the same as a dict."""
         res = OmegaConf.to_container(cfg_sub, resolve=True)
         return res if isinstance(res, dict) else {}
 
-    def create_rate_limiter(self) -> qrate_limiter.InMemoryRateLimiter:
+    def create_rate_limiter(self) -> BaseRateLimiter | None:
         """Create a new rate limiter and add it to the global dictionary."""
         limiter_kwargs = self.get_rate_limiter_kwargs()
 
         if limiter_kwargs:
+            from quke import rate_limiter as qrate_limiter
+
             rate_limiter = qrate_limiter.get_rate_limiter(
                 self.llm_rate_limiter_name, **limiter_kwargs
             )
@@ -175,6 +415,13 @@ class ConfigParser:
         if rate_limiter:
             res["rate_limiter"] = rate_limiter
 
+        coalescer_kwargs = self.get_request_coalescer_kwargs()
+        if coalescer_kwargs:
+            from quke.request_coalescer import get_request_coalescer
+
+            res["cache"] = get_request_coalescer(**coalescer_kwargs)
+            res["callbacks"] = [res["cache"].failure_handler]
+
         return res if isinstance(res, dict) else {}
 
     def get_chat_session_file_parameters(self, cfg: DictConfig) -> dict:
@@ -184,6 +431,32 @@ class ConfigParser:
             "conf_yaml": OmegaConf.to_yaml(cfg),
         }
 
+    def get_results_database(self, cfg: DictConfig) -> str | None:
+        """Based on the config files returns the path of the results database; None if not configured."""
+        try:
+            return (
+                str(Path.cwd() / cfg.internal_data_folder / cfg.results_database)
+                if cfg.results_database
+                else None
+            )
+        except Exception:
+            return None
+
+    def get_transfer_file(self, cfg: DictConfig) -> str:
+        """Based on the config files returns the path of the file to export to or import from."""
+        try:
+            transfer_file = to_absolute_path(cfg.transfer_file) if cfg.transfer_file else None
+        except Exception:
+            transfer_file = None
+        if not transfer_file:
+            transfer_file = str(
+                Path.cwd()
+                / cfg.internal_data_folder
+                / "exports"
+                / f"{Path(cfg.embedding.vectordb.vectorstore_location).name}.parquet"
+            )
+        return transfer_file
+
     def get_embedding_kwargs(self, cfg: DictConfig) -> dict:
         """Based on the config files returns the set of parameters needed for embedding."""
         try:
@@ -202,9 +475,58 @@ def quke(cfg: DictConfig) -> None:
     Including the embedding of the provided source documents.
 
     Questions, LLM, embedding model, vectordb are specified in config files (using Hydra).
+    With command=export or command=import the vector store is exported to or imported from
+    a Parquet file instead. command=compare prints LLM versus LLM tables of the runs in the
+    results database. command=ingest keeps running, embedding documents as they are added to
+    the source document folder. command=serve answers questions over local HTTP until stopped.
+    command=loadtest reports the throughput and latency of embedding and chatting.
+
+    With profile=True the run is profiled, see quke.profiling.
     """
-    console = Console()
+    from quke import profiling
+
     config_parser = ConfigParser(cfg)
+    with profiling.profile(**config_parser.get_profile_params()):
+        run_command(cfg, config_parser)
+
+
+def run_command(cfg: DictConfig, config_parser: ConfigParser) -> None:
+    """Runs the configured command; chat (embed and ask the questions) by default."""
+    from rich.console import Console
+
+    from quke import embed
+
+    console = Console()
+
+    if config_parser.command in ("export", "import"):
+        transfer(config_parser, console)
+        return
+    if config_parser.command == "ingest":
+        from quke.ingest import ingest
+
+        ingest(**config_parser.get_ingest_params())
+        return
+    if config_parser.command == "serve":
+        serve(cfg, config_parser)
+        return
+    if config_parser.command == "loadtest":
+        from quke.loadtest import run_loadtest
+
+        run_loadtest(**config_parser.get_loadtest_params())
+        return
+    if config_parser.command == "compare":
+        from quke.results_db import print_comparison
+
+        if not config_parser.results_database:
+            logging.error("No results_database configured to compare runs from.")
+            return
+        print_comparison(config_parser.results_database, cfg.get("compare_question"))
+        return
+    if config_parser.command != "chat":
+        logging.error(
+            f"Unknown command: {config_parser.command}. Use chat, export, import, compare, ingest, serve or loadtest."
+        )
+        return
 
     embed_parameters = config_parser.get_embed_params()
 
@@ -214,6 +536,8 @@ def quke(cfg: DictConfig) -> None:
         # Used to log config here: logging.info("\n" + OmegaConf.to_yaml(cfg))
 
     if not config_parser.embed_only:
+        from quke import llm_chat
+
         with console.status("Chatting...", spinner="aesthetic"):
             chat_parameters = config_parser.get_chat_params()
             llm_chat.chat(**chat_parameters)
@@ -227,5 +551,42 @@ def quke(cfg: DictConfig) -> None:
     logging.info(f"Results captured in: {to_absolute_path(config_parser.output_file)}")
 
 
+def transfer(config_parser: ConfigParser, console: Console) -> None:
+    """Exports the configured vector store to, or imports it from, the transfer file."""
+    from quke import transfer as qtransfer
+
+    if config_parser.command == "export":
+        with console.status("Exporting...", spinner="aesthetic"):
+            qtransfer.export_vectordb(**config_parser.get_export_params())
+        logging.info(
+            f"Vector store {config_parser.vectordb_location} exported to: {config_parser.transfer_file}"
+        )
+    else:
+        with console.status("Importing...", spinner="aesthetic"):
+            qtransfer.import_vectordb(**config_parser.get_import_params())
+        logging.info(
+            f"{config_parser.transfer_file} imported into vector store: {config_parser.vectordb_location}"
+        )
+
+
+def serve(cfg: DictConfig, config_parser: ConfigParser) -> None:
+    """Runs the query server with the settings of the serve config."""
+    from quke import server
+
+    try:
+        overrides = list(hydra.core.hydra_config.HydraConfig.get().overrides.task)
+    except Exception:
+        overrides = []
+    # the server itself is started with command=serve; chains are built for chats
+    overrides = [o for o in overrides if not o.startswith("command=")]
+
+    serve_args = config_parser.get_args_dict(cfg.serve) if "serve" in cfg else {}
+    socket_path = serve_args.pop("socket", None)
+    if socket_path:
+        socket_path = str(Path.cwd() / cfg.internal_data_folder / socket_path)
+
+    server.serve(cfg, overrides, socket_path=socket_path, **serve_args)
+
+
 if __name__ == "__main__":
     quke()
@@ -8,10 +8,14 @@ It uses an in-memory rate limiter implementation provided by the `langchain_core
 module. The rate limiters are stored in a global dictionary and can be retrieved or created
 using their names.
 
+An in-memory rate limiter limits the requests of a single process. With `backend='sqlite'` a
+quke.sqlite_rate_limiter.SQLiteRateLimiter is created instead, which shares its budget with
+all processes using the same `database` file (for example parallel Hydra multirun jobs).
+
 Functions:
 - create_rate_limiter(name: str, **kwargs): Creates a new rate limiter and adds it to the global
   dictionary if it does not already exist.
-- get_rate_limiter(name: str, **kwargs) -> InMemoryRateLimiter: Retrieves a rate limiter by name
+- get_rate_limiter(name: str, **kwargs) -> BaseRateLimiter: Retrieves a rate limiter by name
   from the global dictionary. If it does not exist, it creates a new one using the provided
   parameters.
 
@@ -22,27 +26,36 @@ Example usage:
         print(limiter)
 
 Global Variables:
-- rate_limiters (Dict[str, InMemoryRateLimiter]): A global dictionary that stores rate limiters
+- rate_limiters (Dict[str, BaseRateLimiter]): A global dictionary that stores rate limiters
   by their names.
 
 Dependencies:
 - langchain_core.rate_limiters.InMemoryRateLimiter: The in-memory rate limiter class used to
   instantiate rate limiters.
+- quke.sqlite_rate_limiter.SQLiteRateLimiter: The rate limiter shared between processes.
+
+The `langchain_core.rate_limiters` module is imported when the first limiter is created, not
+when this module is imported.
 
 This module is designed to be flexible and can be extended or modified to support additional
 features or different types of rate limiters as needed.
 """
 
+from __future__ import annotations
+
 import logging  # functionality managed by Hydra
-from typing import Dict
+from typing import TYPE_CHECKING
 
-from langchain_core.rate_limiters import InMemoryRateLimiter
+if TYPE_CHECKING:
+    from langchain_core.rate_limiters import BaseRateLimiter
 
 # Global dictionary to store rate limiters by name
-rate_limiters: Dict[str, InMemoryRateLimiter] = {}
+rate_limiters: dict[str, BaseRateLimiter] = {}
 
 
-def create_rate_limiter(name: str, **kwargs):
+def create_rate_limiter(
+    name: str, backend: str = "memory", database: str | None = None, **kwargs
+):
     """
     Create a new rate limiter and add it to the global dictionary.
 
@@ -50,7 +63,10 @@ def create_rate_limiter(name: str, **kwargs):
 
     Parameters:
     - name (str): The name to key the rate limiter in the global dictionary.
-    - **kwargs: Arbitrary keyword arguments to pass to the InMemoryRateLimiter constructor.
+    - backend (str): 'memory' (default) for an InMemoryRateLimiter, 'sqlite' for a
+      SQLiteRateLimiter shared between processes.
+    - database (str): The SQLite database file. Only used, and required, for the sqlite backend.
+    - **kwargs: Arbitrary keyword arguments to pass to the rate limiter constructor.
 
     Returns:
     - None
@@ -59,25 +75,38 @@ def create_rate_limiter(name: str, **kwargs):
     if name in rate_limiters:
         return
 
-    rate_limiter = InMemoryRateLimiter(**kwargs)
+    if backend == "sqlite":
+        from quke.sqlite_rate_limiter import SQLiteRateLimiter
+
+        rate_limiter = SQLiteRateLimiter(name=name, database=database, **kwargs)
+    else:
+        from langchain_core.rate_limiters import InMemoryRateLimiter
+
+        if backend != "memory":
+            logging.warning(
+                f"Unknown rate limiter backend {backend!r} for '{name}'. Using memory instead."
+            )
+        rate_limiter = InMemoryRateLimiter(**kwargs)
 
     # Add the new rate limiter to the global dictionary
     rate_limiters[name] = rate_limiter
 
-    logging.info(f"Rate limiter '{name}' created with parameters: {kwargs}.")
+    logging.info(
+        f"Rate limiter '{name}' ({backend}) created with parameters: {kwargs}."
+    )
 
 
-def get_rate_limiter(name: str, **kwargs) -> InMemoryRateLimiter:
+def get_rate_limiter(name: str, **kwargs) -> BaseRateLimiter:
     """
-    Retrieve an InMemoryRateLimiter from the global dictionary by name. If it does not
+    Retrieve a rate limiter from the global dictionary by name. If it does not
     exist, create it using the create_rate_limiter function.
 
     Parameters:
     - name (str): The name to key the rate limiter in the global dictionary.
-    - **kwargs: Arbitrary keyword arguments to pass to the InMemoryRateLimiter constructor.
+    - **kwargs: Arbitrary keyword arguments to pass to create_rate_limiter.
 
     Returns:
-    - InMemoryRateLimiter: The retrieved or newly created rate limiter.
+    - BaseRateLimiter: The retrieved or newly created rate limiter.
     """
     if name not in rate_limiters:
         create_rate_limiter(name, **kwargs)
@@ -0,0 +1,335 @@
+"""Shares a single LLM request between identical requests that are in flight at the same time.
+
+Identical requests - the same model, model arguments and prompt - are common in Hydra sweeps
+and question files: questions shared between question files, or the same question asked of
+the same model in several experiments running at once. The RequestCoalescer makes the first
+of these requests the 'owner'; identical requests made while the owner is waiting for the
+provider wait for, and reuse, its answer instead of making a network request of their own.
+
+The coalescer plugs into the LLM as a LangChain cache (the `cache` argument of LangChain
+language models). Unlike a cache, answers are only shared with requests that were waiting
+for them; once a request completes the next identical request goes to the provider again.
+
+With a lock folder, requests are coalesced across processes on the same machine as well. The
+owner holds an exclusive file lock (fcntl) per request; other processes wait for the lock and
+read the answer the owner writes next to it. Lock files are not available on Windows, where
+requests are only coalesced within a process.
+
+The owner removes the lock file once the answer is published; answer files are removed once
+they are older than the timeout, checked at most every PRUNE_INTERVAL seconds.
+
+If the LLM call of the owner fails (like a 429 or a timeout of the provider), waiters are woken
+at once and retry: one of them becomes the new owner. This requires the failure_handler of the
+coalescer in the callbacks of the LLM, next to the coalescer as its cache. Waiting is bounded by
+a timeout as well; after the timeout waiters make their own request.
+
+Answers shared with waiters are flagged with generation_info[COALESCED], so that token counts
+can skip them.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import logging  # functionality managed by Hydra
+import os
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import IO, Any, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.load import dumps, loads
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+POLL_INTERVAL = 0.05
+"""Seconds between attempts to acquire a lock held by another process."""
+
+PRUNE_INTERVAL = 60
+"""Minimum number of seconds between removals of old answer and lock files."""
+
+COALESCED = "coalesced"
+"""Key in the generation_info of generations shared from the request of another caller."""
+
+# Keys of the requests owned by the LLM call running in this context, see _FailureHandler
+_owned_keys: ContextVar[list[str] | None] = ContextVar("quke_owned_keys", default=None)
+
+
+class _InFlightRequest:
+    """A request to the LLM provider, with the answer once available."""
+
+    __slots__ = ("started", "done", "result", "lock_file")
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.lock_file = None
+
+
+class RequestCoalescer(BaseCache):
+    """LangChain cache which shares answers between identical concurrent LLM requests."""
+
+    def __init__(self, lock_folder: str | None = None, timeout: float = 300) -> None:
+        """Initializes the coalescer.
+
+        Args:
+            lock_folder: Folder for lock and answer files shared by processes on this machine.
+            None to only coalesce requests within this process.
+            timeout: Maximum number of seconds to wait for an identical request to complete.
+        """
+        self.timeout = timeout
+        self.coalesced = 0
+        self.failure_handler = _FailureHandler(self)
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, _InFlightRequest] = {}
+        self._pruned = 0.0
+
+        self.lock_folder = None
+        if lock_folder and fcntl is None:
+            logging.warning(
+                "File locks not available on this platform. LLM requests are only "
+                "coalesced within a process."
+            )
+        elif lock_folder:
+            self.lock_folder = Path(lock_folder)
+            self.lock_folder.mkdir(parents=True, exist_ok=True)
+            self._remove_old_files()
+
+    def lookup(self, prompt: str, llm_string: str) -> Sequence[Any] | None:
+        """Waits for an identical in-flight request and returns its answer.
+
+        Returns None if there is no identical request in flight (the caller becomes the
+        owner and makes the request) or if waiting for it timed out.
+        """
+        key = _request_key(prompt, llm_string)
+        while True:
+            with self._lock:
+                request = self._in_flight.get(key)
+                owner = request is None
+                if owner:
+                    request = self._in_flight[key] = _InFlightRequest()
+            if owner:
+                break
+
+            if self._remaining(request) <= 0:
+                self._abandon(key, request)  # owner failed silently; become the owner
+                continue
+            if not request.done.wait(self._remaining(request)):
+                self._abandon(key, request)
+                return None
+            if request.result:
+                self._count_coalesced()
+                return _flag_coalesced(request.result)
+            # the request of the owner failed; retry as the owner or wait for the new owner
+
+        if self.lock_folder is not None:
+            result = self._acquire_process_lock(key, request)
+            if result is not None:
+                # another process made the request while we were waiting for the lock
+                self._finish(key, request, result)
+                self._count_coalesced()
+                return _flag_coalesced(result)
+
+        owned = _owned_keys.get()
+        if owned is not None:
+            owned.append(key)
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Any]) -> None:
+        """Shares the answer of a completed request with requests waiting for it."""
+        key = _request_key(prompt, llm_string)
+        owned = _owned_keys.get()
+        if owned is not None and key in owned:
+            owned.remove(key)
+        with self._lock:
+            request = self._in_flight.get(key)
+        if request is None:
+            return
+
+        if request.lock_file is not None:
+            answer_file = self.lock_folder / f"{key}.json"
+            tmp_file = answer_file.with_suffix(f".{os.getpid()}.tmp")
+            tmp_file.write_text(json.dumps([dumps(gen) for gen in return_val]))
+            tmp_file.replace(answer_file)
+
+        self._finish(key, request, return_val)
+        if self.lock_folder is not None and time.time() - self._pruned > PRUNE_INTERVAL:
+            self._remove_old_files()
+
+    def fail(self, key: str) -> None:
+        """Ends a request whose LLM call failed; waiters retry instead of waiting for the timeout."""
+        with self._lock:
+            request = self._in_flight.get(key)
+        if request is not None:
+            self._finish(key, request, None)
+
+    def clear(self, **kwargs: object) -> None:  # noqa: ARG002
+        """Stops waiting for all in-flight requests."""
+        with self._lock:
+            in_flight = list(self._in_flight.items())
+        for key, request in in_flight:
+            self._finish(key, request, None)
+
+    def _acquire_process_lock(
+        self, key: str, request: _InFlightRequest
+    ) -> Sequence[Any] | None:
+        """Takes the file lock for the request; returns the answer of another process if it had it."""
+        lock_path = self.lock_folder / f"{key}.lock"
+        waited = False
+        while True:
+            lock_file = lock_path.open("a")
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if self._remaining(request) <= 0:
+                        lock_file.close()
+                        return None
+                    waited = True
+                    time.sleep(POLL_INTERVAL)
+
+            answer = self._read_answer(key, request) if waited else None
+            if answer is not None or not _is_current(lock_file, lock_path):
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+                if answer is not None:
+                    return answer
+                continue  # the owner removed the lock file; lock the new one
+
+            request.lock_file = lock_file
+            return None
+
+    def _read_answer(self, key: str, request: _InFlightRequest) -> Sequence[Any] | None:
+        """Returns the answer written by another process while the request was waiting."""
+        answer_file = self.lock_folder / f"{key}.json"
+        try:
+            # only answers written while we were waiting count; older ones would make this a cache
+            if answer_file.stat().st_mtime < request.started:
+                return None
+            return [loads(gen) for gen in json.loads(answer_file.read_text())]
+        except (OSError, ValueError):
+            return None
+
+    def _finish(
+        self, key: str, request: _InFlightRequest, result: Sequence[Any] | None
+    ) -> None:
+        with self._lock:
+            if self._in_flight.get(key) is request:
+                del self._in_flight[key]
+        if request.lock_file is not None:
+            # removed while locked: processes waiting for it find the answer, new ones a new lock
+            with contextlib.suppress(OSError):
+                Path(request.lock_file.name).unlink()
+            fcntl.flock(request.lock_file, fcntl.LOCK_UN)
+            request.lock_file.close()
+            request.lock_file = None
+        request.result = result
+        request.done.set()
+
+    def _abandon(self, key: str, request: _InFlightRequest) -> None:
+        """Gives up on a request that did not complete in time, so new requests do not wait for it."""
+        if self._remaining(request) <= 0:
+            logging.warning(
+                f"Identical LLM request did not complete within {self.timeout} seconds. "
+                "Making a new request."
+            )
+            self._finish(key, request, None)
+
+    def _remaining(self, request: _InFlightRequest) -> float:
+        return max(0.0, self.timeout - (time.time() - request.started))
+
+    def _count_coalesced(self) -> None:
+        with self._lock:
+            self.coalesced += 1
+
+    def _remove_old_files(self) -> None:
+        """Removes answer files older than the timeout, and lock files left by failed processes."""
+        self._pruned = time.time()
+        cutoff = self._pruned - self.timeout
+        for answer_file in self.lock_folder.glob("*.json"):
+            with contextlib.suppress(OSError):  # removed by another process
+                if answer_file.stat().st_mtime < cutoff:
+                    answer_file.unlink()
+        for lock_path in self.lock_folder.glob("*.lock"):
+            with contextlib.suppress(OSError):  # in use, or removed by another process
+                if lock_path.stat().st_mtime >= cutoff:
+                    continue
+                with lock_path.open("a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    if _is_current(lock_file, lock_path):
+                        lock_path.unlink()
+
+
+class _FailureHandler(BaseCallbackHandler):
+    """Ends the requests owned by an LLM call when the call fails, see RequestCoalescer.fail."""
+
+    run_inline = True  # the owned keys are tracked in the context of the LLM call
+
+    def __init__(self, coalescer: RequestCoalescer) -> None:
+        self.coalescer = coalescer
+
+    def on_llm_start(self, *args: object, **kwargs: object) -> None:  # noqa: ARG002
+        """Starts tracking the requests owned by the LLM call."""
+        _owned_keys.set([])
+
+    def on_chat_model_start(self, *args: object, **kwargs: object) -> None:  # noqa: ARG002
+        """Starts tracking the requests owned by the LLM call."""
+        _owned_keys.set([])
+
+    def on_llm_error(self, error: BaseException, **kwargs: object) -> None:  # noqa: ARG002
+        """Wakes the requests waiting for the failed call."""
+        owned = _owned_keys.get() or []
+        while owned:
+            self.coalescer.fail(owned.pop())
+
+
+def _flag_coalesced(generations: Sequence[Any]) -> list[Any]:
+    return [
+        gen.copy(update={"generation_info": {**(gen.generation_info or {}), COALESCED: True}})
+        for gen in generations
+    ]
+
+
+def _is_current(lock_file: IO[str], lock_path: Path) -> bool:
+    """Whether the open lock file is still the file at lock_path (and not removed by its owner)."""
+    try:
+        return lock_path.stat().st_ino == os.fstat(lock_file.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def _request_key(prompt: str, llm_string: str) -> str:
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode()).hexdigest()
+
+
+# Global dictionary to share a coalescer between all LLMs in this process, by lock folder
+request_coalescers: dict[str | None, RequestCoalescer] = {}
+
+
+def get_request_coalescer(
+    lock_folder: str | None = None, timeout: float = 300
+) -> RequestCoalescer:
+    """Retrieve the RequestCoalescer for the lock folder, creating it if it does not exist.
+
+    Args:
+        lock_folder: Folder for lock files shared by processes. None for in-process only.
+        timeout: Maximum number of seconds to wait for an identical request to complete.
+
+    Returns:
+        RequestCoalescer: The retrieved or newly created coalescer.
+    """
+    if lock_folder not in request_coalescers:
+        request_coalescers[lock_folder] = RequestCoalescer(lock_folder, timeout)
+        logging.info(
+            f"Request coalescer created with lock folder {lock_folder!r} and timeout {timeout}."
+        )
+    return request_coalescers[lock_folder]
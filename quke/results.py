@@ -0,0 +1,111 @@
+"""Compact representation of the results of a chat session.
+
+Across many questions the retriever returns the same popular chunks again and again. Instead
+of keeping a copy of the retrieved chunks with every answer, each unique chunk is stored once
+in a ChunkTable and answers reference chunks by their (integer) ID. Memory then grows with the
+number of unique chunks rather than with questions x chunks retrieved per question.
+
+The report templates resolve the IDs to chunks when rendering.
+"""
+import json
+from typing import Iterator
+
+
+class ChunkTable:
+    """Stores each unique retrieved chunk (LangChain Document) once; the ID is its position."""
+
+    __slots__ = ("chunks", "_ids")
+
+    def __init__(self) -> None:
+        """Creates an empty chunk table."""
+        self.chunks: list = []
+        self._ids: dict[tuple[str, str], int] = {}
+
+    def add(self, chunk: object) -> int:
+        """Returns the ID of the chunk, adding the chunk if an equal chunk is not stored yet."""
+        key = (chunk.page_content, json.dumps(chunk.metadata, sort_keys=True, default=str))
+        chunk_id = self._ids.get(key)
+        if chunk_id is None:
+            chunk_id = self._ids[key] = len(self.chunks)
+            self.chunks.append(chunk)
+        return chunk_id
+
+    def resolve(self, chunk_ids: tuple[int, ...]) -> list:
+        """Returns the chunks with the given IDs."""
+        return [self.chunks[i] for i in chunk_ids]
+
+    def __len__(self) -> int:
+        """Number of unique chunks."""
+        return len(self.chunks)
+
+
+class ChatResult:
+    """Question and answer, with the IDs of the chunks retrieved to answer it.
+
+    Latency (in seconds) and token counts are None if not measured or not reported by the LLM.
+    """
+
+    __slots__ = ("question", "answer", "chunk_ids", "latency", "input_tokens", "output_tokens")
+
+    def __init__(
+        self,
+        question: str,
+        answer: str,
+        chunk_ids: tuple[int, ...],
+        latency: float | None = None,
+        input_tokens: int | None = None,
+        output_tokens: int | None = None,
+    ) -> None:
+        """Creates the result of a single question."""
+        self.question = question
+        self.answer = answer
+        self.chunk_ids = chunk_ids
+        self.latency = latency
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+
+class ChatResults:
+    """Results of a chat session, in order of the questions, sharing a single ChunkTable."""
+
+    __slots__ = ("chunks", "results")
+
+    def __init__(self) -> None:
+        """Creates an empty set of results."""
+        self.chunks = ChunkTable()
+        self.results: list[ChatResult] = []
+
+    def add(
+        self,
+        question: str,
+        answer: str,
+        chunk_ids: tuple[int, ...],
+        **metrics: float | int | None,
+    ) -> ChatResult:
+        """Adds the result of a question; chunk_ids as returned by add_context.
+
+        metrics: latency, input_tokens and/or output_tokens.
+        """
+        result = ChatResult(question, answer, chunk_ids, **metrics)
+        self.results.append(result)
+        return result
+
+    def add_context(self, context: list) -> tuple[int, ...]:
+        """Adds the chunks retrieved for a question to the chunk table and returns their IDs."""
+        return tuple(self.chunks.add(chunk) for chunk in context)
+
+    def context(self, result: ChatResult) -> list:
+        """Returns the chunks retrieved for a result."""
+        return self.chunks.resolve(result.chunk_ids)
+
+    def __iter__(self) -> Iterator[ChatResult]:
+        """Iterates over the results."""
+        return iter(self.results)
+
+    def __len__(self) -> int:
+        """Number of results."""
+        return len(self.results)
+
+    def __getitem__(self, index: int) -> ChatResult:
+        """Returns a result by position."""
+        return self.results[index]
@@ -0,0 +1,271 @@
+"""Local SQLite database collecting the results of all chat runs, to compare them quickly.
+
+Every chat run adds a row to the runs table, with the main settings of the run as separate
+(indexed) columns: LLM class and model, embedding class, vector store class, splitter class,
+chunk size and chunk overlap; any other splitter arguments are kept as JSON. The answers table holds the question, answer, latency and token counts of each
+question of the run; the sources table the source documents and pages retrieved to answer it.
+A run is written in a single transaction with bulk inserts.
+
+compare() returns configuration versus configuration tables over all runs in the database,
+print_comparison() prints them (command=compare). A configuration is the LLM together with the
+embedding, vector store and splitter settings, so runs with different embeddings are not averaged.
+"""
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+from quke.dedup import expand_duplicates
+from quke.results import ChatResults
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    started TEXT NOT NULL,
+    output_dir TEXT,
+    llm_class TEXT,
+    llm_model TEXT,
+    embedding_class TEXT,
+    vectordb_class TEXT,
+    splitter_class TEXT,
+    chunk_size INTEGER,
+    chunk_overlap INTEGER,
+    splitter_args TEXT,
+    question_set TEXT,
+    config_yaml TEXT
+);
+CREATE TABLE IF NOT EXISTS answers (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    position INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT,
+    latency REAL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    PRIMARY KEY (run_id, position)
+);
+CREATE TABLE IF NOT EXISTS sources (
+    run_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    source TEXT,
+    page TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_llm ON runs (llm_class, llm_model);
+CREATE INDEX IF NOT EXISTS runs_embedding ON runs (embedding_class, vectordb_class);
+CREATE INDEX IF NOT EXISTS runs_splitter ON runs (splitter_class, chunk_size, chunk_overlap);
+CREATE INDEX IF NOT EXISTS answers_question ON answers (question, run_id);
+CREATE INDEX IF NOT EXISTS sources_answer ON sources (run_id, position);
+"""
+
+RUN_COLUMNS = (
+    "output_dir",
+    "llm_class",
+    "llm_model",
+    "embedding_class",
+    "vectordb_class",
+    "splitter_class",
+    "chunk_size",
+    "chunk_overlap",
+    "splitter_args",
+    "question_set",
+    "config_yaml",
+)
+"""Columns of the runs table taken from the run_info of write_run."""
+
+SPLITTER_COLUMNS = ("chunk_size", "chunk_overlap")
+"""Splitter arguments stored in their own column instead of in splitter_args."""
+
+CONFIG_COLUMNS = (
+    "llm_class",
+    "llm_model",
+    "embedding_class",
+    "vectordb_class",
+    "splitter_class",
+    "chunk_size",
+    "chunk_overlap",
+)
+"""Columns of the runs table which together identify a configuration to compare."""
+
+CONFIG_HEADERS = ("LLM", "Model", "Embedding", "Vector store", "Splitter", "Chunk size", "Chunk overlap")
+
+
+def connect(database: str) -> sqlite3.Connection:
+    """Opens the results database, creating it and its tables if needed."""
+    Path(database).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(database, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")  # parallel multirun jobs write to the same database
+    conn.executescript(SCHEMA)
+    # databases created before chunk_size and chunk_overlap had their own columns
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+    for column in SPLITTER_COLUMNS:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE runs ADD COLUMN {column} INTEGER")
+    return conn
+
+
+def _name(value: object) -> str:
+    return getattr(value, "__name__", repr(value))
+
+
+def write_run(database: str, run_info: dict, results: ChatResults) -> int:
+    """Adds a chat run and its results to the results database.
+
+    Args:
+        database: Path of the SQLite database file.
+        run_info: Settings of the run, with keys from RUN_COLUMNS. splitter_args may be a dict;
+            its chunk_size and chunk_overlap are then stored in their own columns.
+        results: Results of the chat run.
+
+    Returns:
+        The run_id of the run.
+    """
+    run = {column: run_info.get(column) for column in RUN_COLUMNS}
+    if isinstance(run["splitter_args"], dict):
+        splitter_args = dict(run["splitter_args"])
+        for column in SPLITTER_COLUMNS:
+            value = splitter_args.pop(column, None)
+            if run[column] is None:
+                run[column] = value
+        # embed() replaces function names (like length_function: len) by the function itself
+        run["splitter_args"] = json.dumps(splitter_args, sort_keys=True, default=_name)
+
+    # sources per unique chunk, shared by all answers retrieving the chunk
+    chunk_sources = [
+        {(str(m.get("source")), str(m.get("page", "NA"))) for m in expand_duplicates(chunk.metadata)}
+        for chunk in results.chunks.chunks
+    ]
+
+    conn = connect(database)
+    try:
+        with conn:  # a single transaction
+            run_id = conn.execute(
+                f"INSERT INTO runs (started, {', '.join(RUN_COLUMNS)}) "  # noqa: S608
+                f"VALUES (?{', ?' * len(RUN_COLUMNS)})",
+                (datetime.now().astimezone().isoformat(), *run.values()),
+            ).lastrowid
+            conn.executemany(
+                "INSERT INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (
+                        run_id,
+                        position,
+                        r.question,
+                        r.answer,
+                        r.latency,
+                        r.input_tokens,
+                        r.output_tokens,
+                    )
+                    for position, r in enumerate(results)
+                ),
+            )
+            conn.executemany(
+                "INSERT INTO sources VALUES (?, ?, ?, ?)",
+                (
+                    (run_id, position, source, page)
+                    for position, r in enumerate(results)
+                    for source, page in sorted(
+                        set().union(*(chunk_sources[i] for i in r.chunk_ids))
+                    )
+                ),
+            )
+    finally:
+        conn.close()
+
+    return run_id
+
+
+def compare(database: str, question: str | None = None) -> dict:
+    """Compares the configurations (LLM, embedding, vector store and splitter) in the results database.
+
+    Args:
+        database: Path of the SQLite database file.
+        question: Only compare answers to questions containing this text (case insensitive).
+
+    Returns:
+        A dict with two tables, each a dict with 'columns' and 'rows':
+        summary: per configuration the number of runs and answers, mean and maximum latency and
+            mean tokens.
+        answers: per question the most recent answer of each configuration; columns are the
+            configurations, labelled by their LLM and the settings which differ between them.
+    """
+    where = "WHERE a.question LIKE ?" if question else ""
+    params = (f"%{question}%",) if question else ()
+    config = ", ".join(f"r.{column}" for column in CONFIG_COLUMNS)
+
+    conn = connect(database)
+    try:
+        summary = conn.execute(
+            f"SELECT {config}, count(DISTINCT a.run_id), count(*), "  # noqa: S608
+            "round(avg(a.latency), 2), round(max(a.latency), 2), "
+            "round(avg(a.input_tokens)), round(avg(a.output_tokens)) "
+            f"FROM answers a JOIN runs r USING (run_id) {where} "
+            f"GROUP BY {config} ORDER BY {config}",
+            params,
+        ).fetchall()
+
+        latest = conn.execute(
+            f"SELECT question, answer, {', '.join(CONFIG_COLUMNS)} FROM ("  # noqa: S608
+            f"  SELECT a.question, a.answer, {config}, row_number() OVER ("
+            f"    PARTITION BY a.question, {config}"
+            "    ORDER BY a.run_id DESC, a.position) AS n"
+            f"  FROM answers a JOIN runs r USING (run_id) {where}"
+            f") WHERE n = 1 ORDER BY question, {', '.join(CONFIG_COLUMNS)}",
+            params,
+        ).fetchall()
+    finally:
+        conn.close()
+
+    configs = [row[: len(CONFIG_COLUMNS)] for row in summary]
+    labels = _config_labels(configs)
+    answers: dict[str, dict[tuple, str]] = {}
+    for q, answer, *config_values in latest:
+        answers.setdefault(q, {})[tuple(config_values)] = answer
+
+    return {
+        "summary": {
+            "columns": [
+                *CONFIG_HEADERS,
+                "Runs",
+                "Answers",
+                "Mean latency (s)",
+                "Max latency (s)",
+                "Mean input tokens",
+                "Mean output tokens",
+            ],
+            "rows": summary,
+        },
+        "answers": {
+            "columns": ["Question", *(labels[c] for c in configs)],
+            "rows": [(q, *(a.get(c, "") for c in configs)) for q, a in answers.items()],
+        },
+    }
+
+
+def _config_labels(configs: list[tuple]) -> dict[tuple, str]:
+    """Returns a label per configuration: the LLM, followed by the settings that differ."""
+    differing = [
+        i
+        for i, column in enumerate(CONFIG_COLUMNS)
+        if column not in ("llm_class", "llm_model") and len({c[i] for c in configs}) > 1
+    ]
+    labels = {}
+    for c in configs:
+        label = c[0] if c[1] is None else f"{c[0]} ({c[1]})"
+        settings = ", ".join(f"{CONFIG_COLUMNS[i]}={c[i]}" for i in differing)
+        labels[c] = f"{label}: {settings}" if settings else label
+    return labels
+
+
+def print_comparison(database: str, question: str | None = None) -> None:
+    """Prints the comparison of the configurations in the results database as tables."""
+    from rich.console import Console
+    from rich.table import Table
+
+    console = Console()
+    for title, table in compare(database, question).items():
+        rich_table = Table(title=title.capitalize(), show_lines=title == "answers")
+        for column in table["columns"]:
+            rich_table.add_column(column)
+        for row in table["rows"]:
+            rich_table.add_row(*("" if v is None else str(v) for v in row))
+        console.print(rich_table)
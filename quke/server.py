@@ -0,0 +1,353 @@
+"""Warm query server: answers questions over local HTTP (or a Unix socket) without start-up costs.
+
+A normal run composes the config, imports LangChain, loads the embedding model, opens the
+vector store and builds the chain before the first question is asked. The server does this
+once per (embedding, vector store, LLM) combination and keeps the chains, so a question only
+costs retrieval and the LLM call. Requests are handled concurrently, each in its own thread.
+
+Endpoints (all json):
+
+- POST /ask (Content-Type: application/json) with {"question": "..."} or {"questions": [...]},
+  and optionally "overrides", a list of config group choices selecting another combination
+  (like ["llm=gpt4o"]). Only the groups in OVERRIDE_GROUPS, with a config file in CONFIG_FOLDER,
+  can be chosen; other overrides could make the server import and run any code. Returns the
+  answers with their sources, latency and tokens.
+- GET /metrics: number of requests and latency percentiles per combination.
+- GET /health
+"""
+import json
+import logging  # functionality managed by Hydra
+import re
+import signal
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from omegaconf import DictConfig
+
+LATENCY_WINDOW = 1000
+"""Number of most recent latencies per combination the metrics are calculated from."""
+
+CONFIG_FOLDER = Path(__file__).parent / "conf"
+"""Folder of the config groups requests can choose from."""
+
+OVERRIDE_GROUPS = ("llm", "embedding")
+"""Config groups a request can choose another config file of."""
+
+
+def check_overrides(overrides: object) -> tuple[str, ...]:
+    """Returns the overrides of a request; raises ValueError unless all are allowed group choices.
+
+    Args:
+        overrides: Overrides of a request, like ["llm=gpt4o"]. None for none.
+
+    Returns:
+        The overrides as a tuple.
+    """
+    if overrides is None:
+        return ()
+    if not isinstance(overrides, list):
+        msg = "overrides must be a list of config group choices, like ['llm=gpt4o']."
+        raise ValueError(msg)  # noqa: TRY004
+
+    for override in overrides:
+        match = re.fullmatch(r"(\w+)=([\w-]+)", override) if isinstance(override, str) else None
+        if (
+            match is None
+            or match[1] not in OVERRIDE_GROUPS
+            or not (CONFIG_FOLDER / match[1] / f"{match[2]}.yaml").is_file()
+        ):
+            msg = (
+                f"Override {override!r} is not allowed; only choices of the config groups "
+                f"{', '.join(OVERRIDE_GROUPS)}, like 'llm=gpt4o'."
+            )
+            raise ValueError(msg)
+    return tuple(overrides)
+
+
+class LatencyStats:
+    """Thread safe count and percentiles of the most recent latencies."""
+
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        """Keeps the latest window latencies."""
+        self.count = 0
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, latency: float) -> None:
+        """Records a latency, in seconds."""
+        with self._lock:
+            self.count += 1
+            self._latencies.append(latency)
+
+    def summary(self) -> dict:
+        """Returns count, and mean, p50, p95, p99 and max latency (seconds) of the window."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return {"count": self.count}
+
+        def percentile(p: float) -> float:
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4)
+
+        return {
+            "count": self.count,
+            "mean": round(sum(latencies) / len(latencies), 4),
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(latencies[-1], 4),
+        }
+
+
+class ChainPool:
+    """Builds the chain of an (embedding, vector store, LLM) combination once, and keeps it."""
+
+    def __init__(self, cfg: DictConfig, overrides: list[str] | None = None) -> None:
+        """Creates an empty pool.
+
+        Args:
+            cfg: Config of the server; the default combination.
+            overrides: Hydra overrides the server was started with, applied before the
+            overrides of a request.
+        """
+        self.cfg = cfg
+        self.overrides = overrides or []
+        self.chains: dict[str, object] = {}
+        self._configs: dict[tuple[str, ...], DictConfig] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def config(self, overrides: tuple[str, ...]) -> DictConfig:
+        """Returns the config of the server with the overrides of a request applied.
+
+        The overrides must be checked (see check_overrides) by the caller. The config is
+        composed once per combination of overrides.
+        """
+        if not overrides:
+            return self.cfg
+
+        from hydra import compose
+
+        with self._lock:  # composing is not thread safe
+            if overrides not in self._configs:
+                self._configs[overrides] = compose(
+                    config_name="config", overrides=[*self.overrides, *overrides]
+                )
+            return self._configs[overrides]
+
+    def get(self, overrides: tuple[str, ...] = ()) -> tuple[str, object, int]:
+        """Returns key, chain and max_concurrency of a combination, building the chain if needed."""
+        from quke.quke import ConfigParser
+
+        config_parser = ConfigParser(self.config(overrides))
+        key = config_parser.get_chain_key()
+
+        with self._lock:
+            key_lock = self._locks.setdefault(key, threading.Lock())
+        with key_lock:  # requests for the same new combination wait for a single build
+            if key not in self.chains:
+                from quke.llm_chat import build_chain
+
+                started = time.perf_counter()
+                self.chains[key] = build_chain(**config_parser.get_chain_params())
+                logging.info(
+                    f"Chain built in {time.perf_counter() - started:.1f} seconds: {key}"
+                )
+        return key, self.chains[key], config_parser.max_concurrency
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """Handles the requests of the query server."""
+
+    server: "QueryHTTPServer | QueryUnixServer"
+
+    def do_GET(self) -> None:  # noqa: N802
+        """Returns metrics or health."""
+        if self.path == "/metrics":
+            self._send(200, self.server.metrics())
+        elif self.path == "/health":
+            self._send(200, {"status": "ok", "chains": len(self.server.pool.chains)})
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:  # noqa: N802
+        """Answers the questions of an /ask request."""
+        if self.path != "/ask":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        # browsers can post plain text to localhost from any web page, but not json
+        if self.headers.get_content_type() != "application/json":
+            self._send(415, {"error": "Content-Type must be application/json."})
+            return
+
+        started = time.perf_counter()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            questions = request.get("questions") or [request["question"]]
+            overrides = check_overrides(request.get("overrides"))
+            key, chain, max_concurrency = self.server.pool.get(overrides)
+        except Exception as e:
+            self._send(400, {"error": f"Invalid request: {e!r}"})
+            return
+
+        try:
+            answers = self.server.answer(key, chain, questions, max_concurrency)
+        except Exception as e:
+            logging.exception("Failed to answer request.")
+            self._send(500, {"error": repr(e)})
+            return
+
+        latency = time.perf_counter() - started
+        self.server.request_stats[key].add(latency)
+        self._send(200, {"chain": key, "latency": round(latency, 4), "answers": answers})
+
+    def _send(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def address_string(self) -> str:
+        """Client address for the log; Unix socket clients have none."""
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        """Logs requests through logging instead of stderr."""
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class _QueryServerMixin:
+    """State shared by the HTTP and Unix socket servers."""
+
+    daemon_threads = True
+
+    def setup_pool(self, pool: ChainPool) -> None:
+        """Sets the pool of chains and empty metrics."""
+        self.pool = pool
+        self.request_stats: dict[str, LatencyStats] = _StatsDict()
+        self.question_stats: dict[str, LatencyStats] = _StatsDict()
+
+    def answer(self, key: str, chain: object, questions: list[str], max_concurrency: int) -> list:
+        """Asks the questions and returns the answers as json serializable dicts."""
+        from quke.llm_chat import _dict_crosstab_for_jinja, ask
+
+        results = ask(chain, questions, max_concurrency)
+        answers = []
+        for result in results:
+            if result.latency is not None:
+                self.question_stats[key].add(result.latency)
+            answers.append(
+                {
+                    "question": result.question,
+                    "answer": result.answer,
+                    "sources": _dict_crosstab_for_jinja(results.context(result)),
+                    "latency": result.latency,
+                    "input_tokens": result.input_tokens,
+                    "output_tokens": result.output_tokens,
+                }
+            )
+        return answers
+
+    def metrics(self) -> dict:
+        """Latency of requests (including building a chain) and questions (chain only) per chain."""
+        return {
+            key: {
+                "requests": self.request_stats[key].summary(),
+                "questions": self.question_stats[key].summary(),
+            }
+            for key in list(self.pool.chains)
+        }
+
+
+class _StatsDict(dict):
+    """LatencyStats per chain key, created on first use."""
+
+    _lock = threading.Lock()
+
+    def __missing__(self, key: str) -> LatencyStats:
+        with self._lock:
+            return self.setdefault(key, LatencyStats())
+
+
+class QueryHTTPServer(_QueryServerMixin, ThreadingHTTPServer):
+    """Query server listening on a TCP host and port."""
+
+
+class QueryUnixServer(
+    _QueryServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer
+):
+    """Query server listening on a Unix socket."""
+
+
+def create_server(
+    pool: ChainPool,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: str | None = None,
+) -> QueryHTTPServer | QueryUnixServer:
+    """Creates (but does not start) a query server.
+
+    Args:
+        pool: Pool of chains answering the questions.
+        host: Host to listen on.
+        port: Port to listen on; 0 for any free port.
+        socket_path: Path of a Unix socket to listen on instead of host and port.
+
+    Returns:
+        The server; call serve_forever() to start it.
+    """
+    if socket_path:
+        Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(socket_path).unlink(missing_ok=True)
+        server = QueryUnixServer(socket_path, QueryHandler)
+    else:
+        server = QueryHTTPServer((host, port), QueryHandler)
+    server.setup_pool(pool)
+    return server
+
+
+def serve(
+    cfg: DictConfig,
+    overrides: list[str] | None = None,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    socket_path: str | None = None,
+) -> None:
+    """Builds the chain of the configured combination and answers questions until stopped.
+
+    Args:
+        cfg: Config of the server.
+        overrides: Hydra overrides the server was started with.
+        host: Host to listen on.
+        port: Port to listen on.
+        socket_path: Path of a Unix socket to listen on instead of host and port.
+    """
+    pool = ChainPool(cfg, overrides)
+    pool.get()  # warm up the default combination
+
+    server = create_server(pool, host, port, socket_path)
+    address = socket_path or f"http://{host}:{server.server_address[1]}"
+    logging.info(f"Query server listening on {address}. POST questions to /ask.")
+
+    def shutdown(signum: int, frame: object) -> None:  # noqa: ARG001
+        logging.info(f"Received {signal.Signals(signum).name}; stopping the query server.")
+        threading.Thread(target=server.shutdown).start()  # shutdown() waits for serve_forever()
+
+    previous_handlers = {
+        sig: signal.signal(sig, shutdown) for sig in (signal.SIGINT, signal.SIGTERM)
+    }
+    try:
+        server.serve_forever()
+    finally:
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+        server.server_close()
+        if socket_path:
+            Path(socket_path).unlink(missing_ok=True)
+        logging.info(f"Query server stopped. Metrics: {json.dumps(server.metrics())}")
@@ -0,0 +1,191 @@
+"""Sharded vector stores: a vector store partitioned into independent sub-stores.
+
+With sharding the vector store at vectordb_location consists of one sub-store (shard) per
+subfolder, each a complete vector store of the configured class. Chunks are assigned to a
+shard by source document, either by hash (a fixed number of shards) or by the subfolder of
+source_document_folder the document is in. Shards are built in parallel by embed(), and
+queried concurrently by the ShardedRetriever, which merges the top k results of all shards.
+
+The shards of a vector store are listed in a manifest file in vectordb_location, which
+chat() uses to recognize a sharded store.
+"""
+import hashlib
+import importlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, List, Literal
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from quke import ClassImportDefinition
+
+SHARD_MANIFEST = "quke_shards.json"
+
+
+def shard_name(
+    source: str,
+    src_doc_folder: str,
+    shard_by: Literal["hash", "folder"] = "hash",
+    num_shards: int = 4,
+) -> str:
+    """Returns the name of the shard (and its subfolder) for chunks of a source document.
+
+    Args:
+        source: Path of the source document.
+        src_doc_folder: Folder containing the source documents.
+        shard_by: 'hash' to spread documents over num_shards shards, 'folder' for a shard per
+        subfolder of src_doc_folder.
+        num_shards: Number of shards when sharding by hash.
+
+    Returns:
+        Name of the shard.
+    """
+    if shard_by == "folder":
+        folder = os.path.relpath(Path(source).parent, src_doc_folder)
+        if folder == ".":
+            return "shard_root"
+        return "shard_" + re.sub(r"[^0-9A-Za-z_-]", "_", folder.replace(os.sep, "__"))
+
+    digest = hashlib.sha1(source.encode()).hexdigest()  # noqa: S324
+    return f"shard_{int(digest, 16) % num_shards:02d}"
+
+
+def partition_chunks(
+    chunks: list,
+    src_doc_folder: str,
+    shard_by: Literal["hash", "folder"] = "hash",
+    num_shards: int = 4,
+) -> dict[str, list]:
+    """Returns the chunks per shard name; chunks of a source document share a shard.
+
+    See shard_name for the arguments.
+    """
+    shards = defaultdict(list)
+    for chunk in chunks:
+        source = str(chunk.metadata.get("source", ""))
+        shards[shard_name(source, src_doc_folder, shard_by, num_shards)].append(chunk)
+    return dict(sorted(shards.items()))
+
+
+def read_manifest(vectordb_location: str) -> list[str] | None:
+    """Returns the shard names of a sharded vector store; None if the store is not sharded."""
+    manifest = Path(vectordb_location) / SHARD_MANIFEST
+    if not manifest.is_file():
+        return None
+    return json.loads(manifest.read_text())["shards"]
+
+
+def write_manifest(vectordb_location: str, shards: list[str], shard_by: str) -> None:
+    """Records the shards of a vector store, adding to the shards already recorded."""
+    existing = read_manifest(vectordb_location) or []
+    Path(vectordb_location).mkdir(parents=True, exist_ok=True)
+    (Path(vectordb_location) / SHARD_MANIFEST).write_text(
+        json.dumps({"shard_by": shard_by, "shards": sorted({*existing, *shards})})
+    )
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """Wraps an embedding model so that a query is embedded once, however many shards search it."""
+
+    def __init__(self, embedding: Embeddings, max_size: int = 256) -> None:
+        """Wraps the embedding model, remembering the max_size most recent queries."""
+        self.embedding = embedding
+        self.max_size = max_size
+        self._queries: OrderedDict[str, list[float]] = OrderedDict()
+        self._locks: dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embeds documents with the wrapped model."""
+        return self.embedding.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embeds a query, or returns its embedding if recently embedded."""
+        with self._lock:
+            query_lock = self._locks[text]
+        with query_lock:  # shards searching the same query wait for the first one
+            with self._lock:
+                if text in self._queries:
+                    self._queries.move_to_end(text)
+                    return self._queries[text]
+            vector = self.embedding.embed_query(text)
+            with self._lock:
+                self._queries[text] = vector
+                if len(self._queries) > self.max_size:
+                    oldest, _ = self._queries.popitem(last=False)
+                    self._locks.pop(oldest, None)
+        return vector
+
+
+class ShardedRetriever(BaseRetriever):
+    """Searches all shards concurrently and returns the overall k most relevant documents.
+
+    The results of the shards are merged on the scores of similarity_search_with_score:
+    distances (lower is more relevant) for Chroma and FAISS. All shards are vector stores of
+    the same class and distance function, so their distances are comparable. Relevance scores
+    are not used: Chroma's default L2 distance on vectors that are not normalized gives
+    relevance scores outside 0 to 1.
+    """
+
+    vectorstores: List[Any]
+    k: int = 4
+    max_workers: int | None = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun  # noqa: ARG002
+    ) -> List[Document]:
+        def search(vectorstore: VectorStore) -> list:
+            return vectorstore.similarity_search_with_score(query, k=self.k)
+
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers or len(self.vectorstores)
+        ) as executor:
+            results = [r for shard in executor.map(search, self.vectorstores) for r in shard]
+
+        results.sort(key=lambda r: r[1])
+        return [doc for doc, _ in results[: self.k]]
+
+
+def get_retriever(
+    vectordb_location: str,
+    vectordb_import: ClassImportDefinition,
+    embedding: Embeddings,
+) -> BaseRetriever:
+    """Returns a retriever for the vector store; a ShardedRetriever if the store is sharded.
+
+    Args:
+        vectordb_location: Folder of vector store.
+        vectordb_import: Definition of vector store.
+        embedding: Embedding model used to embed the queries.
+
+    Returns:
+        A LangChain retriever.
+    """
+    module = importlib.import_module(vectordb_import.module_name)
+    class_ = getattr(module, vectordb_import.class_name)
+
+    shards = read_manifest(vectordb_location)
+    if shards is None:
+        return class_(
+            embedding_function=embedding, persist_directory=vectordb_location
+        ).as_retriever()
+
+    embedding = CachedQueryEmbeddings(embedding)
+    return ShardedRetriever(
+        vectorstores=[
+            class_(
+                embedding_function=embedding,
+                persist_directory=str(Path(vectordb_location) / shard),
+            )
+            for shard in shards
+        ]
+    )
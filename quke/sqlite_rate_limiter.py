@@ -0,0 +1,129 @@
+"""Rate limiter shared by processes on the same machine, coordinated through SQLite.
+
+The LangChain InMemoryRateLimiter limits the requests of a single process. When Hydra
+multirun jobs run in parallel every job would get the full requests_per_second budget.
+The SQLiteRateLimiter keeps the token bucket in a SQLite database (in WAL mode) instead,
+so all processes using the same database and limiter name share one budget.
+
+It implements the same token bucket algorithm, and takes the same parameters, as
+InMemoryRateLimiter; and can be passed as the rate_limiter of any LangChain chat model.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+BUSY_TIMEOUT = 30
+"""Seconds to wait for a database lock held by another process."""
+
+
+class SQLiteRateLimiter(BaseRateLimiter):
+    """A token bucket rate limiter whose bucket is stored in a SQLite database."""
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        database: str,
+        requests_per_second: float = 1,
+        check_every_n_seconds: float = 0.1,
+        max_bucket_size: float = 1,
+    ) -> None:
+        """Initializes the rate limiter, creating the database if it does not exist.
+
+        Args:
+            name: Name of the token bucket. Limiters with the same name and database share it.
+            database: Path of the SQLite database file.
+            requests_per_second: The number of tokens added to the bucket per second.
+            check_every_n_seconds: Seconds between attempts to get a token.
+            max_bucket_size: The maximum number of tokens in the bucket; limits bursts.
+        """
+        self.name = name
+        self.database = database
+        self.requests_per_second = requests_per_second
+        self.check_every_n_seconds = check_every_n_seconds
+        self.max_bucket_size = max_bucket_size
+        self._local = threading.local()
+
+        Path(database).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets "
+            "(name TEXT PRIMARY KEY, tokens REAL NOT NULL, last REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread; connections cannot be shared between threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.database, timeout=BUSY_TIMEOUT, isolation_level=None
+            )
+            self._local.conn = conn
+        return conn
+
+    def _consume(self) -> bool:
+        """Try to consume a token from the shared bucket.
+
+        Returns:
+            True if a token was consumed and the caller can make the request.
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")  # takes the write lock; serializes all processes
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, last FROM token_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            # initialize on first use to avoid a burst
+            tokens, last = row if row else (0.0, now)
+
+            elapsed = now - last
+            if elapsed * self.requests_per_second >= 1:
+                tokens += elapsed * self.requests_per_second
+                last = now
+
+            tokens = min(tokens, self.max_bucket_size)
+            consumed = tokens >= 1
+            if consumed:
+                tokens -= 1
+
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (name, tokens, last) VALUES (?, ?, ?)",
+                (self.name, tokens, last),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return consumed
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        """Attempt to acquire a token; if blocking, wait until one is available.
+
+        Returns:
+            True if a token was acquired, False otherwise.
+        """
+        if not blocking:
+            return self._consume()
+        while not self._consume():
+            time.sleep(self.check_every_n_seconds)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        """Attempt to acquire a token; if blocking, wait until one is available. Async version.
+
+        Returns:
+            True if a token was acquired, False otherwise.
+        """
+        # _consume() can wait up to BUSY_TIMEOUT for the database lock; not on the event loop
+        if not blocking:
+            return await asyncio.to_thread(self._consume)
+        while not await asyncio.to_thread(self._consume):
+            await asyncio.sleep(self.check_every_n_seconds)
+        return True
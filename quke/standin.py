@@ -0,0 +1,327 @@
+"""Local stand-ins for embedding and chat model providers, for load tests without API costs.
+
+StandInEmbeddings and StandInChatModel behave like provider backed models: every request
+takes time, drawn from a log-normal distribution around a median latency, a chat answer is
+generated at a configured number of tokens per second, and a configurable fraction of the
+requests fails with a StandInRateLimitError (the equivalent of an HTTP 429). They are
+configured like any other model through module_name/class_name, see conf/llm/standin.yaml
+and conf/embedding/standin.yaml.
+
+Embeddings are deterministic (the same text gives the same vector), so retrieval works as
+usual. Answers are filler text; token counts are reported as usage_metadata.
+
+The same models can be served as a local OpenAI compatible HTTP API (/v1/chat/completions and
+/v1/embeddings), to include an HTTP client in the test, see conf/llm/standin_openai.yaml:
+
+    python -m quke.standin --port 8010 --latency 0.5 --error-rate 0.01
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+
+WORDS = [
+    "the", "of", "revenue", "per", "share", "growth", "year",
+    "earnings", "capital", "bank", "net", "income", "report",
+]
+
+
+class StandInRateLimitError(Exception):
+    """Injected failure of a request, like an HTTP 429 (too many requests) of a provider."""
+
+    status_code = 429
+
+
+def _latency(rng: random.Random, median: float, sigma: float) -> float:
+    """Returns a log-normally distributed latency with the given median, in seconds."""
+    if median <= 0:
+        return 0
+    return median * math.exp(sigma * rng.gauss(0, 1)) if sigma > 0 else median
+
+
+class StandInEmbeddings(Embeddings):
+    """Embedding model taking provider like time per request, with deterministic vectors."""
+
+    def __init__(
+        self,
+        size: int = 384,
+        latency: float = 0.2,
+        latency_sigma: float = 0.3,
+        latency_per_text: float = 0.001,
+        error_rate: float = 0,
+        seed: int | None = None,
+    ) -> None:
+        """Configures the stand-in.
+
+        Args:
+            size: Number of dimensions of the vectors.
+            latency: Median latency of a request, in seconds.
+            latency_sigma: Spread of the (log-normal) latency; 0 for a constant latency.
+            latency_per_text: Additional seconds per text embedded in a request.
+            error_rate: Fraction of the requests failing with a StandInRateLimitError.
+            seed: Seed for latencies and failures; None for a random seed.
+        """
+        self.size = size
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.latency_per_text = latency_per_text
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Returns a vector per text, after the simulated latency."""
+        self._request(len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        """Returns the vector of a query, after the simulated latency."""
+        self._request(1)
+        return self._vector(text)
+
+    def _request(self, count: int) -> None:
+        time.sleep(
+            _latency(self._rng, self.latency, self.latency_sigma) + count * self.latency_per_text
+        )
+        if self._rng.random() < self.error_rate:
+            msg = "Stand-in embedding rate limit exceeded (429)."
+            raise StandInRateLimitError(msg)
+
+    def _vector(self, text: str) -> list[float]:
+        # the same fake vector for the same text
+        rng = random.Random(hashlib.sha256(text.encode()).digest())
+        vector = [rng.gauss(0, 1) for _ in range(self.size)]
+        norm = math.sqrt(sum(v * v for v in vector)) or 1
+        return [v / norm for v in vector]
+
+
+class StandInChatModel(BaseChatModel):
+    """Chat model taking provider like time to answer, generating filler text."""
+
+    latency: float = 0.5
+    """Median time to first token, in seconds."""
+    latency_sigma: float = 0.5
+    """Spread of the (log-normal) time to first token; 0 for a constant time."""
+    tokens_per_second: float = 50
+    """Speed at which the answer is generated; 0 for instant answers."""
+    answer_tokens: int = 60
+    """Number of tokens (words) in an answer."""
+    error_rate: float = 0
+    """Fraction of the requests failing with a StandInRateLimitError."""
+    seed: int | None = None
+    """Seed for latencies and failures; None for a random seed."""
+
+    _rng: random.Random = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs: object) -> None:
+        """Configures the stand-in; see the fields for the keyword arguments."""
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "quke-standin"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {
+            "latency": self.latency,
+            "tokens_per_second": self.tokens_per_second,
+            "answer_tokens": self.answer_tokens,
+        }
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,  # noqa: ARG002
+        run_manager: CallbackManagerForLLMRun | None = None,  # noqa: ARG002
+        **kwargs: object,  # noqa: ARG002
+    ) -> ChatResult:
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        answer, seconds = self.answer(input_tokens)
+        time.sleep(seconds)
+
+        message = AIMessage(
+            content=answer,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": self.answer_tokens,
+                "total_tokens": input_tokens + self.answer_tokens,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def answer(self, input_tokens: int) -> tuple[str, float]:
+        """Returns the filler answer and the seconds it takes; raises injected failures."""
+        if self._rng.random() < self.error_rate:
+            time.sleep(_latency(self._rng, self.latency, self.latency_sigma) / 10)
+            msg = "Stand-in chat model rate limit exceeded (429)."
+            raise StandInRateLimitError(msg)
+
+        seconds = _latency(self._rng, self.latency, self.latency_sigma)
+        if self.tokens_per_second > 0:
+            seconds += self.answer_tokens / self.tokens_per_second
+        words = [WORDS[(input_tokens + i) % len(WORDS)] for i in range(self.answer_tokens)]
+        return " ".join(words).capitalize() + ".", seconds
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI compatible API on top of the stand-in models."""
+
+    server: "StandInServer"
+
+    def do_POST(self) -> None:  # noqa: N802
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        try:
+            if self.path.endswith("/chat/completions"):
+                self._send(200, self._chat(request))
+            elif self.path.endswith("/embeddings"):
+                self._send(200, self._embeddings(request))
+            else:
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+        except StandInRateLimitError as e:
+            self._send(429, {"error": {"message": str(e), "type": "rate_limit_error"}})
+
+    def _chat(self, request: dict) -> dict:
+        input_tokens = sum(len(str(m.get("content", "")).split()) for m in request["messages"])
+        answer, seconds = self.server.chat_model.answer(input_tokens)
+        time.sleep(seconds)
+        output_tokens = self.server.chat_model.answer_tokens
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "standin"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": input_tokens,
+                "completion_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        }
+
+    def _embeddings(self, request: dict) -> dict:
+        texts = request["input"]
+        texts = [texts] if isinstance(texts, str) or (texts and isinstance(texts[0], int)) else texts
+        texts = [t if isinstance(t, str) else " ".join(map(str, t)) for t in texts]  # token ids
+        vectors = self.server.embeddings.embed_documents(texts)
+        tokens = sum(len(t.split()) for t in texts)
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": vector}
+                for i, vector in enumerate(vectors)
+            ],
+            "model": request.get("model", "standin"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _send(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        """Requests are not logged; the server is meant to take a lot of them."""
+
+
+class StandInServer(ThreadingHTTPServer):
+    """OpenAI compatible HTTP server answering with the stand-in models."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        chat_model: StandInChatModel,
+        embeddings: StandInEmbeddings,
+    ) -> None:
+        """Creates (but does not start) the server; port 0 picks a free port."""
+        super().__init__(address, _OpenAIHandler)
+        self.chat_model = chat_model
+        self.embeddings = embeddings
+
+
+def start_server(
+    host: str = "127.0.0.1",
+    port: int = 8010,
+    chat_kwargs: dict | None = None,
+    embedding_kwargs: dict | None = None,
+) -> StandInServer:
+    """Starts an OpenAI compatible stand-in server in a background thread and returns it.
+
+    Call shutdown() on the server to stop it.
+    """
+    server = StandInServer(
+        (host, port),
+        StandInChatModel(**(chat_kwargs or {})),
+        StandInEmbeddings(**(embedding_kwargs or {})),
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    """Runs the OpenAI compatible stand-in server until interrupted."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8010)
+    parser.add_argument("--latency", type=float, default=0.5, help="median chat latency (s)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of 429 answers")
+    parser.add_argument("--embedding-latency", type=float, default=0.2)
+    parser.add_argument("--embedding-size", type=int, default=384)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = StandInServer(
+        (args.host, args.port),
+        StandInChatModel(
+            latency=args.latency,
+            latency_sigma=args.latency_sigma,
+            tokens_per_second=args.tokens_per_second,
+            answer_tokens=args.answer_tokens,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        ),
+        StandInEmbeddings(
+            size=args.embedding_size,
+            latency=args.embedding_latency,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        ),
+    )
+    print(f"Stand-in OpenAI compatible API on http://{args.host}:{server.server_address[1]}/v1")  # noqa: T201
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
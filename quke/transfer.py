@@ -0,0 +1,408 @@
+"""Export and import of embedded chunks, to move them to another vector store without re-embedding.
+
+Export writes the id, text, metadata and embedding vector of every chunk in a vector store to a
+Parquet file, in batches. Vectors are stored as a fixed size list column of float32, written
+from and read into numpy arrays without copying. Import writes the stored ids and vectors of
+such a file into any configured vector store class (sharded or not), instead of calling the
+embedding model. Only the I/O and the vector store itself limit the speed of a migration.
+
+The vectors are only valid for the embedding model that created them. The export records
+the embedding class; import warns if the configured embedding class differs.
+
+Vector stores are opened (see open_vectordb) and written (see _write_batch) through their public
+LangChain API; only Chroma is written through its collection, which takes the numpy vectors as
+they are. Chunks keep their ids, so importing the same file again into a Chroma or in-memory
+store replaces them.
+
+Export requires a vector store with a Chroma style get() method (include, limit, offset), or
+with the chunks in a store dictionary like InMemoryVectorStore.
+"""
+import importlib
+import json
+import logging  # functionality managed by Hydra
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from quke import ClassImportDefinition, DatabaseAction
+from quke.embed import prepare_vectordb_location
+
+BATCH_SIZE = 5000
+"""Number of chunks read from the vector store, or written to it, at once."""
+
+VECTORDB_FILE = "vectorstore.json"
+"""File (within the vector store folder) of vector stores saved with dump(), like InMemoryVectorStore."""
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Embedding function of imported vector stores.
+
+    While a batch is imported (see precomputed) the stored vectors of the batch are handed
+    back, in batch order, instead of embedding its documents. Otherwise documents and queries
+    are embedded with the configured embedding model, which is created on first use.
+    """
+
+    def __init__(
+        self, embedding_import: ClassImportDefinition, embedding_kwargs: dict | None = None
+    ) -> None:
+        """Initializes with the definition of the configured embedding model."""
+        self.embedding_import = embedding_import
+        self.embedding_kwargs = embedding_kwargs or {}
+        self._embedding: Embeddings | None = None
+        self._vectors: np.ndarray | None = None
+
+    @property
+    def embedding(self) -> Embeddings:
+        """The configured embedding model."""
+        if self._embedding is None:
+            module = importlib.import_module(self.embedding_import.module_name)
+            class_ = getattr(module, self.embedding_import.class_name)
+            self._embedding = class_(**self.embedding_kwargs)
+        return self._embedding
+
+    @contextmanager
+    def precomputed(self, vectors: np.ndarray) -> Iterator[None]:
+        """Hands back these vectors for the next documents embedded, instead of embedding them."""
+        self._vectors = vectors
+        try:
+            yield
+        finally:
+            self._vectors = None
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Returns the precomputed vectors of the texts, or embeds them with the configured model."""
+        if self._vectors is None:
+            return self.embedding.embed_documents(texts)
+
+        vectors, self._vectors = self._vectors, None
+        if len(vectors) != len(texts):
+            msg = f"{len(vectors)} precomputed vectors for {len(texts)} documents."
+            raise ValueError(msg)
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embeds a query with the configured embedding model."""
+        return self.embedding.embed_query(text)
+
+
+def open_vectordb(class_: type, location: str, embedding: Embeddings) -> VectorStore | None:
+    """Opens the vector store in a folder.
+
+    Stores with save_local/load_local (like FAISS) and dump/load (like InMemoryVectorStore)
+    are loaded from the folder, if saved there before. Other stores are created Chroma style,
+    with the folder as persist_directory.
+
+    Returns:
+        The vector store; None if it is created with the first chunks, see _write_batch.
+    """
+    folder = Path(location)
+    if hasattr(class_, "load_local"):
+        if not folder.is_dir() or not any(folder.iterdir()):
+            return None
+        # only files quke saved itself are loaded; they are pickled
+        return class_.load_local(location, embedding, allow_dangerous_deserialization=True)
+    if hasattr(class_, "load") and hasattr(class_, "dump"):
+        if (folder / VECTORDB_FILE).is_file():
+            return class_.load(str(folder / VECTORDB_FILE), embedding)
+        return class_(embedding=embedding)
+    return class_(persist_directory=location, embedding_function=embedding)
+
+
+def save_vectordb(vectordb: VectorStore, location: str) -> None:
+    """Saves a vector store opened with open_vectordb, if it does not persist itself."""
+    if hasattr(vectordb, "save_local"):
+        vectordb.save_local(location)
+    elif hasattr(vectordb, "dump"):
+        Path(location).mkdir(parents=True, exist_ok=True)
+        vectordb.dump(str(Path(location) / VECTORDB_FILE))
+
+
+def export_vectordb(
+    vectordb_location: str,
+    vectordb_import: ClassImportDefinition,
+    embedding_import: ClassImportDefinition,
+    transfer_file: str,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Writes all chunks in a vector store, with their vectors, to a Parquet file.
+
+    An empty vector store is written as a Parquet file without rows.
+
+    Args:
+        vectordb_location: Folder of vector store (or of its shards).
+        vectordb_import: Definition of vector store.
+        embedding_import: Definition of the embedding model which created the vectors.
+        transfer_file: Path of the Parquet file.
+        batch_size: Number of chunks read from the vector store at once.
+
+    Returns:
+        Number of chunks exported.
+    """
+    from quke.shards import read_manifest
+
+    module = importlib.import_module(vectordb_import.module_name)
+    class_ = getattr(module, vectordb_import.class_name)
+    embedding = PrecomputedEmbeddings(embedding_import)  # the model is never loaded
+
+    shards = read_manifest(vectordb_location)
+    locations = (
+        [str(Path(vectordb_location) / shard) for shard in shards]
+        if shards
+        else [vectordb_location]
+    )
+
+    Path(transfer_file).parent.mkdir(parents=True, exist_ok=True)
+    writer = None
+    count = 0
+    try:
+        for location in locations:
+            vectordb = open_vectordb(class_, location, embedding)
+            if vectordb is None:
+                continue
+            for batch in _read_batches(vectordb, batch_size):
+                if writer is None:
+                    writer = _parquet_writer(transfer_file, batch.schema, embedding_import)
+                writer.write_batch(batch)
+                count += batch.num_rows
+        if writer is None:  # an empty file, so that an import of it finds it
+            logging.warning(f"Vector store {vectordb_location} is empty; {transfer_file} has no chunks.")
+            empty = _record_batch([], [], [], np.empty((0, 1)))  # Arrow needs a list size > 0
+            writer = _parquet_writer(transfer_file, empty.schema, embedding_import)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    logging.info(f"{count} chunks exported from {vectordb_location} to {transfer_file}.")
+    return count
+
+
+def _parquet_writer(
+    transfer_file: str, schema: pa.Schema, embedding_import: ClassImportDefinition
+) -> pq.ParquetWriter:
+    schema = schema.with_metadata(
+        {
+            "quke.embedding": f"{embedding_import.module_name}.{embedding_import.class_name}",
+            "quke.dimensions": str(schema.field("vector").type.list_size),
+        }
+    )
+    return pq.ParquetWriter(transfer_file, schema, compression="zstd")
+
+
+def _read_batches(vectordb: VectorStore, batch_size: int) -> Iterator[pa.RecordBatch]:
+    if hasattr(vectordb, "get"):
+        yield from _read_batches_chroma(vectordb, batch_size)
+    elif isinstance(getattr(vectordb, "store", None), dict):
+        entries = list(vectordb.store.values())
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start : start + batch_size]
+            yield _record_batch(
+                [e["id"] for e in batch],
+                [e["text"] for e in batch],
+                [e["metadata"] for e in batch],
+                np.asarray([e["vector"] for e in batch], dtype=np.float32),
+            )
+    else:
+        msg = (
+            f"Export is not supported for {type(vectordb).__name__}; it has no get() method "
+            "and no store of chunks."
+        )
+        raise TypeError(msg)
+
+
+def _read_batches_chroma(vectordb: VectorStore, batch_size: int) -> Iterator[pa.RecordBatch]:
+    offset = 0
+    while True:
+        res = vectordb.get(
+            include=["embeddings", "documents", "metadatas"],
+            limit=batch_size,
+            offset=offset,
+        )
+        if not res["ids"]:
+            return
+
+        yield _record_batch(
+            res["ids"],
+            res["documents"],
+            res["metadatas"],
+            np.asarray(res["embeddings"], dtype=np.float32),
+        )
+        offset += len(res["ids"])
+
+
+def _record_batch(
+    ids: list[str], documents: list[str], metadatas: list[dict | None], vectors: np.ndarray
+) -> pa.RecordBatch:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    return pa.record_batch(
+        {
+            "id": pa.array(ids, pa.string()),
+            "document": pa.array(documents, pa.large_string()),
+            "metadata": pa.array([json.dumps(m or {}) for m in metadatas], pa.string()),
+            "vector": pa.FixedSizeListArray.from_arrays(
+                pa.array(vectors.reshape(-1)), vectors.shape[1]
+            ),
+        }
+    )
+
+
+def import_vectordb(
+    transfer_file: str,
+    vectordb_location: str,
+    vectordb_import: ClassImportDefinition,
+    embedding_import: ClassImportDefinition,
+    embedding_kwargs: dict | None = None,
+    write_mode: DatabaseAction = DatabaseAction.NO_OVERWRITE,
+    src_doc_folder: str = "",
+    shard_params: dict | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """Loads the chunks and vectors of an exported Parquet file into a vector store.
+
+    Args:
+        transfer_file: Path of the Parquet file.
+        vectordb_location: Folder of vector store.
+        vectordb_import: Definition of vector store.
+        embedding_import: Definition of the configured embedding model. Used to check that
+        the vectors were created by the same model, and to embed queries afterwards.
+        embedding_kwargs: **kwargs to be provided to embedding class.
+        write_mode: Wether to OVERWRITE, APPEND or NO_OVERWRITE the vector store.
+        src_doc_folder: Folder containing the source documents; used to shard by folder.
+        shard_params: Settings for a sharded vector store, see quke.embed.embed_shards.
+        batch_size: Number of chunks written to the vector store at once.
+
+    Returns:
+        Number of chunks imported.
+    """
+    from quke.shards import write_manifest
+
+    if not Path(transfer_file).is_file():
+        logging.error(
+            f"Nothing imported. Transfer file {transfer_file!r} does not exist; "
+            "configure transfer_file with the path of an exported vector store."
+        )
+        return 0
+
+    parquet_file = pq.ParquetFile(transfer_file)
+    _check_embedding(parquet_file, transfer_file, embedding_import)
+
+    logging.info(f"Starting to import {transfer_file} into VectorDB: {vectordb_location}")
+    if not prepare_vectordb_location(vectordb_location, write_mode):
+        return 0
+
+    module = importlib.import_module(vectordb_import.module_name)
+    class_ = getattr(module, vectordb_import.class_name)
+    embedding = PrecomputedEmbeddings(embedding_import, embedding_kwargs)
+    vectordbs: dict[str, VectorStore | None] = {}
+
+    count = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        ids = np.array(batch.column("id").to_pylist(), dtype=object)
+        documents = np.array(batch.column("document").to_pylist(), dtype=object)
+        metadatas = np.array(
+            [json.loads(m) for m in batch.column("metadata").to_pylist()], dtype=object
+        )
+        vector_column = batch.column("vector")
+        vectors = vector_column.values.to_numpy(zero_copy_only=True).reshape(
+            len(vector_column), vector_column.type.list_size
+        )
+
+        for name, rows in _rows_per_shard(metadatas, src_doc_folder, shard_params).items():
+            location = str(Path(vectordb_location) / name) if name else vectordb_location
+            if location not in vectordbs:
+                vectordbs[location] = open_vectordb(class_, location, embedding)
+            vectordbs[location] = _write_batch(
+                vectordbs[location],
+                class_,
+                embedding,
+                ids[rows].tolist(),
+                documents[rows].tolist(),
+                metadatas[rows].tolist(),
+                vectors[rows],
+            )
+        count += batch.num_rows
+
+    for location, vectordb in vectordbs.items():
+        save_vectordb(vectordb, location)
+    if shard_params:
+        write_manifest(
+            vectordb_location,
+            [Path(location).name for location in vectordbs],
+            shard_params.get("shard_by", "hash"),
+        )
+
+    logging.info(f"{count} chunks imported from {transfer_file} into {vectordb_location}.")
+    return count
+
+
+def _write_batch(
+    vectordb: VectorStore | None,
+    class_: type,
+    embedding: PrecomputedEmbeddings,
+    ids: list[str],
+    documents: list[str],
+    metadatas: list[dict],
+    vectors: np.ndarray,
+) -> VectorStore:
+    """Writes chunks with their stored ids and vectors to a vector store; returns the store.
+
+    Chroma collections take the vectors as they are. Stores with add_embeddings (like FAISS)
+    get (text, vector) pairs, and are created with from_embeddings. Other stores add the texts,
+    while the embedding function hands back the stored vectors.
+    """
+    if vectordb is not None and hasattr(vectordb, "_collection"):  # Chroma
+        vectordb._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            documents=documents,
+            metadatas=[m or None for m in metadatas],  # Chroma rejects empty metadata
+        )
+    elif hasattr(class_, "add_embeddings"):
+        text_embeddings = list(zip(documents, vectors.tolist(), strict=True))
+        if vectordb is None:
+            return class_.from_embeddings(text_embeddings, embedding, metadatas=metadatas, ids=ids)
+        vectordb.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    elif vectordb is None:
+        msg = f"Import is not supported for {class_.__name__}; it cannot be created from embeddings."
+        raise TypeError(msg)
+    else:
+        with embedding.precomputed(vectors):
+            vectordb.add_texts(documents, metadatas, ids=ids)
+    return vectordb
+
+
+def _check_embedding(
+    parquet_file: pq.ParquetFile, transfer_file: str, embedding_import: ClassImportDefinition
+) -> None:
+    exported_with = (parquet_file.schema_arrow.metadata or {}).get(b"quke.embedding", b"").decode()
+    configured = f"{embedding_import.module_name}.{embedding_import.class_name}"
+    if exported_with != configured:
+        logging.warning(
+            f"Vectors in {transfer_file} were created with {exported_with or 'unknown'}, "
+            f"but {configured} is configured. Queries will not match the imported vectors."
+        )
+
+
+def _rows_per_shard(metadatas: np.ndarray, src_doc_folder: str, shard_params: dict | None) -> dict:
+    """Returns the rows of a batch per shard name; all rows under '' without sharding."""
+    from quke.shards import shard_name
+
+    if not shard_params:
+        return {"": slice(None)}
+    shards = np.array(
+        [
+            shard_name(
+                str((metadata or {}).get("source", "")),
+                src_doc_folder,
+                shard_params.get("shard_by", "hash"),
+                shard_params.get("num_shards", 4),
+            )
+            for metadata in metadatas
+        ]
+    )
+    return {name: shards == name for name in np.unique(shards)}
@@ -104,10 +104,10 @@ def test_embed(GetConfigEmbedOnly: DictConfig):
 # @pytest.mark.skipif(not os.path.exists(os.path.dirname(OUTPUT_FILE)),
 # reason=f"Output folder {os.path.dirname(OUTPUT_FILE)} should exist before running test.")
 def test_chat(GetConfigLLMOnly: DictConfig):
-    from langchain.chains import ConversationalRetrievalChain
+    from quke.results import ChatResults
 
     chat_result = chat(**ConfigParser(GetConfigLLMOnly).get_chat_params())
-    assert isinstance(chat_result, ConversationalRetrievalChain)
+    assert isinstance(chat_result, ChatResults)
     assert (
         Path(ConfigParser(GetConfigLLMOnly).output_file).with_suffix(".html").is_file()
         or Path(ConfigParser(GetConfigLLMOnly).output_file).with_suffix(".md").is_file()
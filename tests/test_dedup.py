@@ -0,0 +1,71 @@
+import random
+
+import pytest
+from langchain_core.documents import Document
+
+from quke.dedup import DUPLICATES_KEY, deduplicate_chunks, expand_duplicates
+from quke.llm_chat import _dict_crosstab_for_jinja
+
+WORDS = [f"word{i}" for i in range(500)]
+
+
+def text(rng: random.Random, length: int = 400) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def chunk(content: str, source: str, page: int) -> Document:
+    return Document(page_content=content, metadata={"source": source, "page": page})
+
+
+@pytest.fixture()
+def Chunks() -> list:
+    rng = random.Random(5)
+    boilerplate = text(rng)
+    near_duplicate = boilerplate.replace(boilerplate.split()[75], "changed", 1)
+    return [
+        chunk(boilerplate, "2021.pdf", 1),
+        chunk(text(rng), "2021.pdf", 2),
+        chunk(boilerplate.upper(), "2022.pdf", 1),  # exact after normalization
+        chunk(near_duplicate, "2023.pdf", 1),
+        chunk(text(rng), "2023.pdf", 2),
+    ]
+
+
+def test_duplicates_removed(Chunks: list):
+    unique = deduplicate_chunks(Chunks)
+    assert [c.page_content for c in unique] == [
+        Chunks[0].page_content,
+        Chunks[1].page_content,
+        Chunks[4].page_content,
+    ]
+    assert DUPLICATES_KEY not in unique[1].metadata
+
+
+def test_exact_only(Chunks: list):
+    assert len(deduplicate_chunks(Chunks, threshold=1)) == 4
+
+
+def test_sources_kept(Chunks: list):
+    representative = deduplicate_chunks(Chunks)[0]
+    assert [m["source"] for m in expand_duplicates(representative.metadata)] == [
+        "2021.pdf",
+        "2022.pdf",
+        "2023.pdf",
+    ]
+    assert _dict_crosstab_for_jinja([representative]) == {
+        "2021.pdf": [1],
+        "2022.pdf": [1],
+        "2023.pdf": [1],
+    }
+
+
+def test_near_duplicates_not_chained():
+    # A~B and B~C (shingle Jaccard 0.9), but A and C are less similar (0.81)
+    a, b, c = (" ".join(WORDS[start : start + 100]) for start in (0, 5, 10))
+    unique = deduplicate_chunks(
+        [chunk(a, "a.pdf", 1), chunk(b, "b.pdf", 1), chunk(c, "c.pdf", 1)],
+        threshold=0.85,
+        num_perm=512,
+    )
+    assert [c.metadata["source"] for c in unique] == ["a.pdf", "c.pdf"]
+    assert [m["source"] for m in expand_duplicates(unique[0].metadata)] == ["a.pdf", "b.pdf"]
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+import pytest
+
+# Cumulative import time budget for the quke entry point, in microseconds.
+# Hydra accounts for most of it; heavy dependencies should not show up at all.
+IMPORT_TIME_BUDGET_US = 600_000
+HEAVY_MODULES = ["langchain", "langchain_core", "langchain_community", "jinja2", "rich"]
+
+
+def import_times(module: str) -> dict:
+    """Runs `python -X importtime` in a fresh interpreter; returns cumulative us per module."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],  # noqa: S603
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize(
+    "module", ["quke.quke", "quke.embed", "quke.llm_chat", "quke.rate_limiter"]
+)
+def test_no_heavy_imports(module):
+    imported = import_times(module)
+    assert [m for m in HEAVY_MODULES if m in imported] == []
+
+
+def test_import_time_budget():
+    cumulative = min(import_times("quke.quke")["quke.quke"] for _ in range(3))
+    assert cumulative < IMPORT_TIME_BUDGET_US
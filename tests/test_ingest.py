@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+from quke import ClassImportDefinition, ClassRateLimit
+from quke.dedup import deduplicate_chunks
+from quke.embed import DocumentLoaderDef, embed_in_batches
+from quke.ingest import Ingester
+
+TEXT_LOADER = DocumentLoaderDef(
+    ext="txt",
+    loader=ClassImportDefinition("langchain_community.document_loaders", "TextLoader"),
+)
+
+
+@pytest.fixture()
+def Folders(tmp_path: Path) -> dict:
+    src_doc_folder = tmp_path / "docs"
+    src_doc_folder.mkdir()
+    (src_doc_folder / "a.txt").write_text("first document")
+    return {
+        "src_doc_folder": str(src_doc_folder),
+        "vectordb_location": str(tmp_path / "vectordb"),
+        "state_file": str(tmp_path / "ingest_state.json"),
+    }
+
+
+def ingester(folders: dict) -> Ingester:
+    return Ingester(
+        **folders,
+        embedding_import=ClassImportDefinition(
+            "langchain_core.embeddings", "DeterministicFakeEmbedding"
+        ),
+        embedding_kwargs={"size": 16},
+        vectordb_import=ClassImportDefinition("langchain_chroma", "Chroma"),
+        rate_limit=ClassRateLimit(100, 0),
+        splitter_params={
+            "splitter_import": ClassImportDefinition(
+                "langchain_text_splitters", "RecursiveCharacterTextSplitter"
+            ),
+            "splitter_args": {"chunk_size": 100, "chunk_overlap": 0},
+        },
+        loader_params={"document_loaders": [TEXT_LOADER]},
+        debounce=0,
+        use_watchdog=False,
+    )
+
+
+def stored(folders: dict) -> list:
+    res = Chroma(persist_directory=folders["vectordb_location"]).get()
+    return sorted(res["documents"])
+
+
+def test_ingest_new_changed_deleted(Folders: dict):
+    src = Path(Folders["src_doc_folder"])
+    ing = ingester(Folders)
+
+    assert ing.ingest_changes() == 0  # new file must first be seen unchanged
+    assert ing.ingest_changes() == 1
+    assert ing.ingest_changes() == 0
+    assert stored(Folders) == ["first document"]
+
+    (src / "a.txt").write_text("first document, revised")
+    (src / "b.txt").write_text("second document")
+    ing.ingest_changes()
+    assert ing.ingest_changes() == 2
+    assert stored(Folders) == ["first document, revised", "second document"]
+
+    (src / "a.txt").unlink()
+    ing.ingest_changes()
+    assert stored(Folders) == ["second document"]
+
+
+def test_restart_uses_state(Folders: dict):
+    ing = ingester(Folders)
+    ing.ingest_changes()
+    ing.ingest_changes()
+
+    restarted = ingester(Folders)
+    restarted.ingest_changes()
+    assert restarted.ingest_changes() == 0
+    assert stored(Folders) == ["first document"]
+
+
+def test_run_and_stop(Folders: dict):
+    ing = ingester(Folders)
+    thread = threading.Thread(target=ing.run)
+    thread.start()
+    ing.stop()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+
+def test_failed_file_keeps_chunks_and_retries(Folders: dict):
+    src = Path(Folders["src_doc_folder"])
+    ing = ingester(Folders)
+    ing.poll_interval = 0
+    ing.ingest_changes()
+    ing.ingest_changes()
+
+    (src / "a.txt").write_bytes(b"\xff\xfe not utf8")
+    ing.ingest_changes()
+    assert ing.ingest_changes() == 0
+    assert stored(Folders) == ["first document"]
+    assert "a.txt" in str(ing._failures)
+
+    (src / "a.txt").write_text("first document, revised")
+    add_chunks = ing._add_chunks
+    ing._add_chunks = Mock(side_effect=RuntimeError("Too many requests (429)."))
+    ing.ingest_changes()
+    assert ing.ingest_changes() == 0
+    assert stored(Folders) == ["first document"]
+
+    ing._add_chunks = add_chunks
+    assert ing.ingest_changes() == 1
+    assert stored(Folders) == ["first document, revised"]
+    assert not ing._failures
+
+
+def test_unchanged_text_not_duplicated(Folders: dict):
+    src = Path(Folders["src_doc_folder"])
+    ing = ingester(Folders)
+    ing.ingest_changes()
+    ing.ingest_changes()
+
+    os.utime(src / "a.txt", ns=(0, 0))
+    ing.ingest_changes()
+    assert ing.ingest_changes() == 1
+    assert stored(Folders) == ["first document"]
+
+
+def test_deleted_representative_promotes_duplicate(Folders: dict):
+    src = Path(Folders["src_doc_folder"])
+    (src / "b.txt").write_text("first document")
+    chunks = deduplicate_chunks(
+        [
+            Document(page_content="first document", metadata={"source": str(src / name)})
+            for name in ("a.txt", "b.txt")
+        ]
+    )
+    embed_in_batches(
+        chunks,
+        Folders["vectordb_location"],
+        ClassImportDefinition("langchain_core.embeddings", "DeterministicFakeEmbedding"),
+        {"size": 16},
+        ClassImportDefinition("langchain_chroma", "Chroma"),
+        ClassRateLimit(100, 0),
+    )
+
+    ing = ingester(Folders)
+    (src / "a.txt").unlink()
+    ing.ingest_changes()
+    res = Chroma(persist_directory=Folders["vectordb_location"]).get()
+    assert res["documents"] == ["first document"]
+    assert res["metadatas"] == [{"source": str(src / "b.txt")}]
+
+
+def test_no_state_bootstraps_from_vectordb(Folders: dict):
+    src = Path(Folders["src_doc_folder"])
+    embed_in_batches(
+        [Document(page_content="first document", metadata={"source": str(src / "a.txt")})],
+        Folders["vectordb_location"],
+        ClassImportDefinition("langchain_core.embeddings", "DeterministicFakeEmbedding"),
+        {"size": 16},
+        ClassImportDefinition("langchain_chroma", "Chroma"),
+        ClassRateLimit(100, 0),
+    )
+    (src / "b.txt").write_text("second document")  # not embedded yet
+
+    ing = ingester(Folders)
+    assert list(ing.state) == [str(src / "a.txt")]
+    ing.ingest_changes()
+    assert ing.ingest_changes() == 1
+    assert stored(Folders) == ["first document", "second document"]
+
+
+def test_stop_interrupts_rate_limit_delay(Folders: dict):
+    src = Path(Folders["src_doc_folder"])
+    (src / "a.txt").write_text("first part\n\nsecond part " + "x" * 100)
+    ing = ingester(Folders)
+    ing.rate_limit = ClassRateLimit(1, 60)
+    ing.ingest_changes()
+    threading.Timer(0.1, ing.stop).start()
+    started = time.monotonic()
+    assert ing.ingest_changes() == 1
+    assert time.monotonic() - started < 10
+    assert ing.state == {}  # ingested again after a restart
+
+
+def test_run_survives_errors(Folders: dict):
+    ing = ingester(Folders)
+    ing.poll_interval = 0.01
+    scan = ing._scan
+    ing._scan = Mock(side_effect=[OSError("folder unavailable"), *[scan()] * 1000])
+    thread = threading.Thread(target=ing.run)
+    thread.start()
+    for _ in range(1000):
+        if ing._scan.call_count >= 3:
+            break
+        time.sleep(0.01)
+    ing.stop()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert stored(Folders) == ["first document"]
@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import pytest
+
+from quke import ClassImportDefinition
+from quke.embed import DocumentLoaderDef, get_pages_from_document, scan_source_files
+from quke.loaders import ChunkedCSVLoader
+
+TEXT_LOADER = ClassImportDefinition(
+    "langchain_community.document_loaders", "TextLoader"
+)
+
+
+@pytest.fixture()
+def SrcFolder(tmp_path: Path) -> Path:
+    for name, content in {
+        "a.txt": "alpha",
+        "b.TXT": "bravo " * 100,
+        "c.md": "# charlie",
+        "notes/d.txt": "delta",
+        "drafts/e.txt": "echo",
+        "f.bin": "foxtrot",
+    }.items():
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(content)
+    return tmp_path
+
+
+def scanned(src_folder: Path, loaders: list, **kwargs) -> list:
+    return [
+        path.relative_to(src_folder).as_posix()
+        for path, _ in scan_source_files(str(src_folder), loaders, **kwargs)
+    ]
+
+
+def test_scan_single_pass(SrcFolder: Path):
+    loaders = [
+        DocumentLoaderDef(ext="txt", loader=TEXT_LOADER),
+        DocumentLoaderDef(ext="md", loader=TEXT_LOADER),
+    ]
+    assert scanned(SrcFolder, loaders) == [
+        "a.txt",
+        "b.TXT",
+        "c.md",
+        "drafts/e.txt",
+        "notes/d.txt",
+    ]
+
+
+def test_scan_filters(SrcFolder: Path):
+    loaders = [DocumentLoaderDef(ext="txt", loader=TEXT_LOADER)]
+    assert scanned(SrcFolder, loaders, exclude=["drafts"]) == [
+        "a.txt",
+        "b.TXT",
+        "notes/d.txt",
+    ]
+    assert scanned(SrcFolder, loaders, include=["notes/*"]) == ["notes/d.txt"]
+    assert "b.TXT" not in scanned(SrcFolder, loaders, max_file_size=100)
+
+
+def test_loader_by_file_size(SrcFolder: Path):
+    small = DocumentLoaderDef(ext="txt", loader=TEXT_LOADER, max_file_size=100)
+    large = DocumentLoaderDef(ext="txt", loader=TEXT_LOADER, kwargs={"x": 1})
+    chosen = {
+        path.name: loader
+        for path, loader in scan_source_files(str(SrcFolder), [small, large])
+    }
+    assert chosen["a.txt"] is small
+    assert chosen["b.TXT"] is large
+
+
+def test_parallel_pages_in_order(SrcFolder: Path):
+    loader = DocumentLoaderDef(
+        ext="txt", loader=TEXT_LOADER, kwargs={"encoding": "utf8"}, parallel="thread"
+    )
+    pages = get_pages_from_document(
+        str(SrcFolder), loader_params={"document_loaders": [loader], "workers": 2}
+    )
+    assert [page.page_content for page in pages] == [
+        "alpha",
+        "bravo " * 100,
+        "echo",
+        "delta",
+    ]
+
+
+def test_chunked_csv(tmp_path: Path):
+    csv_file = tmp_path / "large.csv"
+    csv_file.write_text("name,value\n" + "".join(f"n{i},{i}\n" for i in range(25)))
+
+    docs = list(ChunkedCSVLoader(str(csv_file), rows_per_document=10).lazy_load())
+    assert [doc.metadata["rows"] for doc in docs] == [10, 10, 5]
+    assert [doc.metadata["row"] for doc in docs] == [0, 10, 20]
+    assert docs[2].page_content.startswith("name: n20\nvalue: 20\n\nname: n21")
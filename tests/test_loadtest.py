@@ -0,0 +1,96 @@
+import http.client
+import json
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+from quke import ClassImportDefinition, ClassRateLimit
+from quke.embed import embed_in_batches
+from quke.loadtest import run_loadtest
+from quke.standin import StandInChatModel, StandInEmbeddings, StandInRateLimitError, start_server
+
+EMBEDDING_IMPORT = ClassImportDefinition("quke.standin", "StandInEmbeddings")
+EMBEDDING_KWARGS = {"size": 16, "latency": 0, "latency_per_text": 0}
+
+
+def test_standin_models():
+    embeddings = StandInEmbeddings(**EMBEDDING_KWARGS)
+    assert embeddings.embed_query("a") == embeddings.embed_documents(["a"])[0]
+    assert embeddings.embed_query("a") != embeddings.embed_query("b")
+
+    message = StandInChatModel(latency=0, tokens_per_second=0, answer_tokens=5).invoke("hi")
+    assert len(message.content.split()) == 5
+    assert message.usage_metadata["output_tokens"] == 5
+
+    with pytest.raises(StandInRateLimitError):
+        StandInChatModel(latency=0, error_rate=1).invoke("hi")
+
+
+def test_openai_compatible_server():
+    server = start_server(
+        port=0,
+        chat_kwargs={"latency": 0, "tokens_per_second": 0, "answer_tokens": 3},
+        embedding_kwargs=EMBEDDING_KWARGS,
+    )
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+        conn.request(
+            "POST",
+            "/v1/chat/completions",
+            body=json.dumps({"model": "m", "messages": [{"role": "user", "content": "hi"}]}),
+        )
+        completion = json.loads(conn.getresponse().read())
+        assert completion["usage"]["completion_tokens"] == 3
+
+        conn.request("POST", "/v1/embeddings", body=json.dumps({"input": ["a", "b"]}))
+        embeddings = json.loads(conn.getresponse().read())
+        assert [len(d["embedding"]) for d in embeddings["data"]] == [16, 16]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_loadtest_chat(tmp_path: Path):
+    location = str(tmp_path / "vectordb")
+    embed_in_batches(
+        [Document(page_content=f"chunk {i}", metadata={"source": "a.pdf"}) for i in range(5)],
+        location,
+        EMBEDDING_IMPORT,
+        EMBEDDING_KWARGS,
+        ClassImportDefinition("langchain_chroma", "Chroma"),
+        ClassRateLimit(100, 0),
+    )
+
+    report = run_loadtest(
+        embed_params={},
+        chain_params={
+            "vectordb_location": location,
+            "embedding_import": EMBEDDING_IMPORT,
+            "embedding_kwargs": EMBEDDING_KWARGS,
+            "vectordb_import": ClassImportDefinition("langchain_chroma", "Chroma"),
+            "llm_import": ClassImportDefinition("quke.standin", "StandInChatModel"),
+            "llm_parameters": {
+                "latency": 0.01,
+                "tokens_per_second": 0,
+                "error_rate": 0.5,
+                "seed": 3,
+                "rate_limiter": InMemoryRateLimiter(
+                    requests_per_second=1000, check_every_n_seconds=0.001
+                ),
+            },
+        },
+        questions=["What is EPS?", "What is CIBC?"],
+        num_questions=30,
+        max_concurrency=8,
+        embed=False,
+        report_file=str(tmp_path / "loadtest.json"),
+    )
+
+    chat = report["chat"]
+    assert chat["answers"] + chat["errors"].get("StandInRateLimitError", 0) == 30
+    assert chat["errors"]
+    assert chat["latency"]["count"] == chat["answers"]
+    assert chat["rate_limiter_wait"]["count"] == 30
+    assert json.loads((tmp_path / "loadtest.json").read_text()) == report
@@ -0,0 +1,67 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+
+from quke import embed
+from quke.page_cache import PageCache
+
+SRC_DATA_FOLDER = "./tests/data/src_doc/"
+LOADER = "langchain_community.document_loaders.TextLoader"
+
+
+@pytest.fixture()
+def SrcFile(tmp_path: Path) -> Path:
+    src_file = tmp_path / "src" / "test.txt"
+    src_file.parent.mkdir()
+    shutil.copy(Path(SRC_DATA_FOLDER) / "test.txt", src_file)
+    return src_file
+
+
+@pytest.fixture()
+def Pages() -> list:
+    return [
+        Document(page_content="page one", metadata={"source": "a.pdf", "page": 0}),
+        Document(page_content="page two", metadata={"source": "a.pdf", "page": 1}),
+    ]
+
+
+def test_roundtrip(tmp_path: Path, SrcFile: Path, Pages: list):
+    cache = PageCache(str(tmp_path / "cache"))
+    assert cache.get(str(SrcFile), LOADER) is None
+
+    cache.put(str(SrcFile), LOADER, Pages)
+    assert cache.get(str(SrcFile), LOADER) == Pages
+    assert cache.get(str(SrcFile), "other.Loader") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_touched_file_is_hit(tmp_path: Path, SrcFile: Path, Pages: list):
+    cache = PageCache(str(tmp_path / "cache"))
+    cache.put(str(SrcFile), LOADER, Pages)
+
+    stat = SrcFile.stat()
+    os.utime(SrcFile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(str(SrcFile), LOADER) == Pages
+
+
+def test_changed_file_is_miss(tmp_path: Path, SrcFile: Path, Pages: list):
+    cache = PageCache(str(tmp_path / "cache"))
+    cache.put(str(SrcFile), LOADER, Pages)
+
+    SrcFile.write_text(SrcFile.read_text().upper())
+    assert cache.get(str(SrcFile), LOADER) is None
+
+
+def test_pages_read_from_cache(tmp_path: Path, SrcFile: Path, monkeypatch):
+    cache_location = str(tmp_path / "cache")
+    pages = embed.get_pages_from_document(str(SrcFile.parent), cache_location)
+    assert len(pages) > 0
+
+    def fail(*args, **kwargs):
+        pytest.fail("source document parsed again")
+
+    monkeypatch.setattr(embed.importlib, "import_module", fail)
+    assert embed.get_pages_from_document(str(SrcFile.parent), cache_location) == pages
@@ -0,0 +1,41 @@
+import json
+import time
+from pathlib import Path
+
+from quke import profiling
+
+
+def test_stage_without_profiling():
+    assert profiling.stage("load") is profiling.stage("split")
+    with profiling.stage("load"):
+        pass
+
+
+def test_profile(tmp_path: Path):
+    with profiling.profile(True, str(tmp_path), interval=0.001, top=5) as profiler:
+        with profiling.stage("embed"), profiling.stage("load"):
+            data = [list(range(100)) for _ in range(1000)]
+            time.sleep(0.05)
+        with profiling.stage("chat"):
+            time.sleep(0.05)
+    assert profiling._profiler is None
+    assert data
+
+    assert set(profiler.timings) == {"embed", "embed/load", "chat"}
+    assert profiler.timings["embed"] >= profiler.timings["embed/load"] >= 0.05
+    assert profiler.peaks["embed"] >= profiler.peaks["embed/load"] > 0
+    assert profiler.growth["embed/load"] > 0
+    assert len(profiler.allocations) <= 5
+
+    speedscope = json.loads((tmp_path / "profile.speedscope.json").read_text())
+    assert {"embed/load", "chat"} <= {p["name"] for p in speedscope["profiles"]}
+    folded = (tmp_path / "profile.folded.txt").read_text()
+    assert any(line.startswith("chat;MainThread;") for line in folded.splitlines())
+    assert "| embed/load |" in (tmp_path / "profile_memory.md").read_text()
+
+
+def test_profile_disabled(tmp_path: Path):
+    with profiling.profile(False, str(tmp_path)) as profiler:
+        pass
+    assert profiler is None
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from quke import rate_limiter as qrate_limiter
+from quke.sqlite_rate_limiter import SQLiteRateLimiter
+
+REQUESTS_PER_SECOND = 20
+
+
+def acquire_tokens(database: str, count: int) -> float:
+    limiter = SQLiteRateLimiter(
+        name="shared",
+        database=database,
+        requests_per_second=REQUESTS_PER_SECOND,
+        check_every_n_seconds=0.01,
+    )
+    for _ in range(count):
+        limiter.acquire()
+    return time.time()
+
+
+def test_limit_shared_between_processes(tmp_path: Path):
+    database = str(tmp_path / "rate_limiters.sqlite")
+    acquire_tokens(database, 1)  # create the bucket before timing
+
+    start = time.time()
+    with ProcessPoolExecutor(2) as executor:
+        finished = list(executor.map(acquire_tokens, [database] * 2, [5, 5]))
+
+    # 10 tokens from one bucket take at least 10 refills; separate buckets would take half
+    assert max(finished) - start >= 9 / REQUESTS_PER_SECOND
+
+
+def test_non_blocking(tmp_path: Path):
+    limiter = SQLiteRateLimiter(
+        name="slow", database=str(tmp_path / "db.sqlite"), requests_per_second=0.01
+    )
+    assert limiter.acquire(blocking=False) is False
+
+
+def test_backend_selection(tmp_path: Path):
+    limiter = qrate_limiter.get_rate_limiter(
+        "test_sqlite_backend",
+        backend="sqlite",
+        database=str(tmp_path / "db.sqlite"),
+        requests_per_second=5,
+    )
+    assert isinstance(limiter, SQLiteRateLimiter)
+    assert limiter.requests_per_second == 5
+    assert qrate_limiter.get_rate_limiter("test_sqlite_backend") is limiter
+
+
+def test_async_acquire(tmp_path: Path):
+    limiter = SQLiteRateLimiter(
+        name="async",
+        database=str(tmp_path / "db.sqlite"),
+        requests_per_second=REQUESTS_PER_SECOND,
+        check_every_n_seconds=0.01,
+    )
+
+    async def acquire_with_ticks() -> tuple:
+        ticks = 0
+
+        async def tick() -> None:
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.001)
+
+        ticker = asyncio.create_task(tick())
+        acquired = await limiter.aacquire()
+        ticker.cancel()
+        return acquired, ticks
+
+    acquired, ticks = asyncio.run(acquire_with_ticks())
+    assert acquired is True
+    assert ticks > 1  # the event loop kept running while waiting for a token
+    assert asyncio.run(limiter.aacquire(blocking=False)) is False
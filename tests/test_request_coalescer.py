@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from quke.chat_metrics import QuestionMetrics
+from quke.request_coalescer import RequestCoalescer
+from quke.standin import StandInChatModel
+
+RESPONSES = ["first", "second", "third", "fourth"]
+
+
+class SlowListChatModel(FakeListChatModel):
+    def _call(self, *args, **kwargs) -> str:
+        time.sleep(self.sleep or 0)
+        return super()._call(*args, **kwargs)
+
+
+def ask_concurrently(models: list, question: str) -> list:
+    with ThreadPoolExecutor(len(models)) as executor:
+        return [
+            r.content for r in executor.map(lambda m: m.invoke(question), models)
+        ]
+
+
+def test_concurrent_requests_share_one_call():
+    coalescer = RequestCoalescer()
+    llm = SlowListChatModel(responses=RESPONSES, sleep=0.3, cache=coalescer)
+
+    assert ask_concurrently([llm] * 4, "What is EPS?") == ["first"] * 4
+    assert coalescer.coalesced == 3
+    assert llm.i == 1
+
+
+def test_completed_requests_are_not_cached():
+    llm = FakeListChatModel(responses=RESPONSES, cache=RequestCoalescer())
+
+    assert llm.invoke("What is EPS?").content == "first"
+    assert llm.invoke("What is EPS?").content == "second"
+
+
+def test_different_prompts_not_shared():
+    llm = SlowListChatModel(responses=RESPONSES, sleep=0.2, cache=RequestCoalescer())
+
+    with ThreadPoolExecutor(2) as executor:
+        answers = list(executor.map(llm.invoke, ["What is EPS?", "What is CIBC?"]))
+    assert sorted(a.content for a in answers) == ["first", "second"]
+
+
+def test_requests_shared_across_processes(tmp_path: Path):
+    # separate coalescers (as in separate processes) coordinate through the lock folder
+    lock_folder = str(tmp_path / "locks")
+    llms = [
+        SlowListChatModel(
+            responses=RESPONSES, sleep=0.3, cache=RequestCoalescer(lock_folder)
+        )
+        for _ in range(2)
+    ]
+
+    assert ask_concurrently(llms, "What is EPS?") == ["first", "first"]
+    assert sum(llm.i for llm in llms) == 1
+
+
+class FailingOnceChatModel(SlowListChatModel):
+    failed: bool = False
+
+    def _call(self, *args, **kwargs) -> str:
+        time.sleep(self.sleep or 0)
+        if not self.failed:
+            self.failed = True
+            msg = "Too many requests (429)."
+            raise RuntimeError(msg)
+        return super()._call(*args, **kwargs)
+
+
+def test_failed_request_wakes_waiters(tmp_path: Path):
+    coalescer = RequestCoalescer(str(tmp_path / "locks"), timeout=30)
+    llm = FailingOnceChatModel(
+        responses=RESPONSES,
+        sleep=0.2,
+        cache=coalescer,
+        callbacks=[coalescer.failure_handler],
+    )
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(llm.invoke, "What is EPS?") for _ in range(3)]
+    outcomes = [f.exception() or f.result().content for f in futures]
+
+    assert time.perf_counter() - started < 5
+    assert sum(isinstance(o, RuntimeError) for o in outcomes) == 1
+    assert [o for o in outcomes if isinstance(o, str)] == ["first", "first"]
+    assert llm.i == 1
+    assert not list((tmp_path / "locks").glob("*.lock"))
+
+
+def test_coalesced_answers_not_counted():
+    coalescer = RequestCoalescer()
+    llm = StandInChatModel(latency=0.3, latency_sigma=0, tokens_per_second=0, cache=coalescer)
+    metrics = [QuestionMetrics() for _ in range(3)]
+
+    with ThreadPoolExecutor(3) as executor:
+        list(
+            executor.map(
+                lambda m: llm.invoke("What is EPS?", config={"callbacks": [m]}), metrics
+            )
+        )
+    assert coalescer.coalesced == 2
+    assert sum(m.output_tokens is not None for m in metrics) == 1
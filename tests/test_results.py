@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+
+from quke.llm_chat import chat_output_to_html
+from quke.results import ChatResults
+
+
+def chunk(source: str, page: int) -> Document:
+    return Document(page_content=f"{source} {page}", metadata={"source": source, "page": page})
+
+
+@pytest.fixture()
+def Results() -> ChatResults:
+    results = ChatResults()
+    for question in ["first question", "second question", "third question"]:
+        # new, but equal, Document objects for every question - as returned by a vector store
+        context = [chunk("a.pdf", 1), chunk("a.pdf", 2), chunk("b.pdf", 7)]
+        results.add(question, f"answer to {question}", results.add_context(context))
+    return results
+
+
+def test_chunks_interned(Results: ChatResults):
+    assert len(Results) == 3
+    assert len(Results.chunks) == 3
+    assert [r.chunk_ids for r in Results] == [(0, 1, 2)] * 3
+    assert Results.context(Results[1])[2].metadata == {"source": "b.pdf", "page": 7}
+
+
+def test_slots(Results: ChatResults):
+    with pytest.raises(AttributeError):
+        Results[0].context = []
+
+
+def test_report_resolves_chunks(tmp_path: Path, Results: ChatResults):
+    output_file = {"path": str(tmp_path / "chat_session.md"), "conf_yaml": ""}
+    chat_output_to_html(Results, output_file, output_extension=".md")
+
+    report = (tmp_path / "chat_session.md").read_text()
+    assert "Q: second question" in report
+    assert "A: answer to second question" in report
+    assert report.count("b.pdf, pages: [7]") == 3
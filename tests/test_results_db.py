@@ -0,0 +1,102 @@
+from pathlib import Path
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from quke.chat_metrics import QuestionMetrics
+from quke.results import ChatResults
+from quke.results_db import compare, connect, write_run
+
+QUESTIONS = ["What is EPS?", "What is CIBC?"]
+
+
+def run_results(answer_prefix: str, latency: float) -> ChatResults:
+    results = ChatResults()
+    chunk_ids = results.add_context(
+        [Document(page_content="text", metadata={"source": "a.pdf", "page": 3})]
+    )
+    for question in QUESTIONS:
+        results.add(
+            question,
+            f"{answer_prefix}: {question}",
+            chunk_ids,
+            latency=latency,
+            input_tokens=100,
+            output_tokens=10,
+        )
+    return results
+
+
+def run_info(llm_model: str, embedding_class: str = "HuggingFaceEmbeddings") -> dict:
+    return {
+        "llm_class": "langchain_cohere.ChatCohere",
+        "llm_model": llm_model,
+        "embedding_class": embedding_class,
+        "splitter_class": "RecursiveCharacterTextSplitter",
+        "splitter_args": {"chunk_size": 1000, "chunk_overlap": 100, "length_function": len},
+    }
+
+
+def test_write_and_compare(tmp_path: Path):
+    database = str(tmp_path / "results.sqlite")
+    write_run(database, run_info("command-r"), run_results("old", 1))
+    write_run(database, run_info("command-r"), run_results("new", 2))
+    run_id = write_run(database, run_info("command-r-plus"), run_results("plus", 4))
+    assert run_id == 3
+
+    with connect(database) as conn:
+        assert conn.execute(
+            "SELECT chunk_size, chunk_overlap, splitter_args FROM runs WHERE run_id = 1"
+        ).fetchone() == (1000, 100, '{"length_function": "len"}')
+        assert conn.execute("SELECT count(*) FROM sources").fetchone() == (6,)
+
+    comparison = compare(database)
+    config = ("HuggingFaceEmbeddings", None, "RecursiveCharacterTextSplitter", 1000, 100)
+    assert comparison["summary"]["rows"] == [
+        ("langchain_cohere.ChatCohere", "command-r", *config, 2, 4, 1.5, 2.0, 100.0, 10.0),
+        ("langchain_cohere.ChatCohere", "command-r-plus", *config, 1, 2, 4.0, 4.0, 100.0, 10.0),
+    ]
+    assert comparison["answers"]["columns"] == [
+        "Question",
+        "langchain_cohere.ChatCohere (command-r)",
+        "langchain_cohere.ChatCohere (command-r-plus)",
+    ]
+    assert comparison["answers"]["rows"][0] == (
+        "What is CIBC?",
+        "new: What is CIBC?",
+        "plus: What is CIBC?",
+    )
+
+    assert len(compare(database, question="eps")["answers"]["rows"]) == 1
+
+
+def test_compare_per_config(tmp_path: Path):
+    database = str(tmp_path / "results.sqlite")
+    write_run(database, run_info("command-r"), run_results("hf", 1))
+    write_run(database, run_info("command-r", "CohereEmbeddings"), run_results("cohere", 3))
+
+    comparison = compare(database)
+    # same LLM, different embeddings: not averaged together
+    assert [row[2] for row in comparison["summary"]["rows"]] == [
+        "CohereEmbeddings",
+        "HuggingFaceEmbeddings",
+    ]
+    assert [row[-4] for row in comparison["summary"]["rows"]] == [3.0, 1.0]
+    assert comparison["answers"]["columns"] == [
+        "Question",
+        "langchain_cohere.ChatCohere (command-r): embedding_class=CohereEmbeddings",
+        "langchain_cohere.ChatCohere (command-r): embedding_class=HuggingFaceEmbeddings",
+    ]
+    assert comparison["answers"]["rows"][0] == ("What is CIBC?", "cohere: What is CIBC?", "hf: What is CIBC?")
+
+
+def test_question_metrics():
+    metrics = QuestionMetrics()
+    message = AIMessage(
+        content="answer",
+        usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15},
+    )
+    for _ in range(2):
+        metrics.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+    assert metrics.metrics() == {"latency": None, "input_tokens": 24, "output_tokens": 6}
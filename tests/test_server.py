@@ -0,0 +1,146 @@
+import http.client
+import json
+import threading
+from pathlib import Path
+
+import pytest
+from hydra import compose, initialize_config_module
+from langchain_core.documents import Document
+
+from quke import ClassImportDefinition, ClassRateLimit
+from quke.embed import embed_in_batches
+from quke.llm_chat import build_chain
+from quke.server import ChainPool, LatencyStats, create_server
+
+EMBEDDING_IMPORT = ClassImportDefinition(
+    "langchain_core.embeddings", "DeterministicFakeEmbedding"
+)
+VECTORDB_IMPORT = ClassImportDefinition("langchain_chroma", "Chroma")
+
+
+class FakePool:
+    """Pool with a single prebuilt chain; builds are counted."""
+
+    def __init__(self, chain: object) -> None:
+        self.chains = {"fake": chain}
+        self.requests = 0
+        self.overrides = []
+
+    def get(self, overrides: tuple[str, ...] = ()) -> tuple:
+        self.requests += 1
+        self.overrides.append(overrides)
+        return "fake", self.chains["fake"], 2
+
+
+@pytest.fixture()
+def Server(tmp_path: Path):
+    location = str(tmp_path / "vectordb")
+    chunks = [
+        Document(page_content=f"chunk {i}", metadata={"source": "a.pdf", "page": i})
+        for i in range(5)
+    ]
+    embed_in_batches(
+        chunks, location, EMBEDDING_IMPORT, {"size": 16}, VECTORDB_IMPORT, ClassRateLimit(100, 0)
+    )
+    chain = build_chain(
+        location,
+        EMBEDDING_IMPORT,
+        VECTORDB_IMPORT,
+        ClassImportDefinition("langchain_core.language_models", "FakeListChatModel"),
+        {"responses": ["the answer"]},
+        {"size": 16},
+    )
+
+    server = create_server(FakePool(chain), port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def request(
+    server: object,
+    method: str,
+    path: str,
+    body: dict | None = None,
+    content_type: str = "application/json",
+) -> tuple:
+    conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+    conn.request(
+        method, path, body=json.dumps(body) if body else None, headers={"Content-Type": content_type}
+    )
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_ask_concurrently(Server: object):
+    responses = []
+    threads = [
+        threading.Thread(
+            target=lambda: responses.append(
+                request(Server, "POST", "/ask", {"questions": ["chunk 1", "chunk 2"]})
+            )
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [status for status, _ in responses] == [200] * 4
+    answers = responses[0][1]["answers"]
+    assert [a["answer"] for a in answers] == ["the answer"] * 2
+    assert answers[0]["sources"]["a.pdf"]
+    assert Server.pool.requests == 4
+
+    status, metrics = request(Server, "GET", "/metrics")
+    assert status == 200
+    assert metrics["fake"]["requests"]["count"] == 4
+    assert metrics["fake"]["questions"]["count"] == 8
+
+
+def test_bad_request(Server: object):
+    assert request(Server, "POST", "/ask", {"no": "question"})[0] == 400
+    assert request(Server, "GET", "/unknown")[0] == 404
+    # a plain text post, as any web page can send to localhost
+    assert request(Server, "POST", "/ask", {"question": "q"}, content_type="text/plain")[0] == 415
+
+
+def test_only_group_choices_allowed(Server: object):
+    assert request(Server, "POST", "/ask", {"question": "q", "overrides": ["llm=gpt4o"]})[0] == 200
+    assert Server.pool.overrides == [("llm=gpt4o",)]
+
+    for overrides in (
+        ["embedding.embedding.module_name=subprocess"],
+        ["+embedding.embedding.kwargs={args:[touch,/tmp/pwned]}"],
+        ["llm=../config"],
+        ["llm=unknown"],
+        ["serve=anything"],
+        "llm=gpt4o",
+    ):
+        status, body = request(Server, "POST", "/ask", {"question": "q", "overrides": overrides})
+        assert status == 400
+        assert "not allowed" in body["error"] or "must be a list" in body["error"]
+    assert Server.pool.requests == 1
+
+
+def test_latency_stats():
+    stats = LatencyStats(window=100)
+    for i in range(1, 201):
+        stats.add(i / 100)
+    summary = stats.summary()
+    assert summary["count"] == 200
+    assert summary["p50"] == 1.51
+    assert summary["max"] == 2.0
+
+
+def test_config_composed_once():
+    with initialize_config_module(version_base=None, config_module="quke.conf"):
+        pool = ChainPool(compose(config_name="config"))
+        config = pool.config(("llm=gpt4o",))
+        assert config.llm.name == "gpt-4o-mini"
+        assert pool.config(("llm=gpt4o",)) is config
+        assert pool.config(()) is pool.cfg
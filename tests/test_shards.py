@@ -0,0 +1,73 @@
+import warnings
+from pathlib import Path
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from quke import ClassImportDefinition, ClassRateLimit
+from quke.embed import embed_shards
+from quke.shards import ShardedRetriever, get_retriever, partition_chunks, read_manifest
+
+SRC_DOC_FOLDER = "docs"
+EMBEDDING_IMPORT = ClassImportDefinition(
+    "langchain_core.embeddings", "DeterministicFakeEmbedding"
+)
+VECTORDB_IMPORT = ClassImportDefinition("langchain_chroma", "Chroma")
+
+
+@pytest.fixture()
+def Chunks() -> list:
+    return [
+        Document(
+            page_content=f"chunk {i} of {source}",
+            metadata={"source": f"{SRC_DOC_FOLDER}/{source}", "page": i},
+        )
+        for source in ["a.pdf", "2021/b.pdf", "2022/c.pdf", "2022/d.pdf"]
+        for i in range(3)
+    ]
+
+
+def test_partition_by_folder(Chunks: list):
+    partitions = partition_chunks(Chunks, SRC_DOC_FOLDER, shard_by="folder")
+    assert {name: len(chunks) for name, chunks in partitions.items()} == {
+        "shard_2021": 3,
+        "shard_2022": 6,
+        "shard_root": 3,
+    }
+
+
+def test_partition_by_hash(Chunks: list):
+    partitions = partition_chunks(Chunks, SRC_DOC_FOLDER, num_shards=2)
+    assert set(partitions) <= {"shard_00", "shard_01"}
+    assert sum(len(chunks) for chunks in partitions.values()) == len(Chunks)
+    # a source document is not split over shards
+    assert all(len(chunks) % 3 == 0 for chunks in partitions.values())
+
+
+def test_build_and_query_shards(tmp_path: Path, Chunks: list):
+    vectordb_location = str(tmp_path / "vectordb")
+    embedded = embed_shards(
+        Chunks,
+        SRC_DOC_FOLDER,
+        vectordb_location,
+        EMBEDDING_IMPORT,
+        {"size": 16},
+        VECTORDB_IMPORT,
+        ClassRateLimit(100, 0),
+        {"shard_by": "folder", "workers": 3},
+    )
+    assert embedded == len(Chunks)
+    assert read_manifest(vectordb_location) == ["shard_2021", "shard_2022", "shard_root"]
+
+    retriever = get_retriever(
+        vectordb_location, VECTORDB_IMPORT, DeterministicFakeEmbedding(size=16)
+    )
+    assert isinstance(retriever, ShardedRetriever)
+
+    query = "chunk 1 of 2022/c.pdf"
+    with warnings.catch_warnings():
+        warnings.filterwarnings("error", message="Relevance scores must be between 0 and 1")
+        docs = retriever.invoke(query)
+    assert len(docs) == 4
+    assert docs[0].page_content == query  # identical text, identical fake embedding
@@ -0,0 +1,163 @@
+from pathlib import Path
+
+import pyarrow.parquet as pq
+import pytest
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from quke import ClassImportDefinition, ClassRateLimit, DatabaseAction
+from quke.embed import embed_in_batches
+from quke.transfer import PrecomputedEmbeddings, export_vectordb, import_vectordb, open_vectordb
+
+EMBEDDING_IMPORT = ClassImportDefinition(
+    "langchain_core.embeddings", "DeterministicFakeEmbedding"
+)
+VECTORDB_IMPORT = ClassImportDefinition("langchain_chroma", "Chroma")
+
+
+@pytest.fixture()
+def Vectordb(tmp_path: Path) -> str:
+    location = str(tmp_path / "vectordb")
+    chunks = [
+        Document(page_content=f"chunk {i}", metadata={"source": "a.pdf", "page": i})
+        for i in range(6)
+    ]
+    # the same text in another document
+    chunks.append(Document(page_content="chunk 0", metadata={"source": "b.pdf", "page": 0}))
+    embed_in_batches(
+        chunks, location, EMBEDDING_IMPORT, {"size": 16}, VECTORDB_IMPORT, ClassRateLimit(100, 0)
+    )
+    return location
+
+
+def contents(location: str) -> dict:
+    res = Chroma(persist_directory=location).get(include=["embeddings", "metadatas", "documents"])
+    return {
+        id_: (doc, meta, [round(v, 5) for v in vector])
+        for id_, doc, meta, vector in zip(
+            res["ids"], res["documents"], res["metadatas"], res["embeddings"], strict=True
+        )
+    }
+
+
+def test_export_import_roundtrip(tmp_path: Path, Vectordb: str):
+    transfer_file = str(tmp_path / "exports" / "vectordb.parquet")
+    assert export_vectordb(Vectordb, VECTORDB_IMPORT, EMBEDDING_IMPORT, transfer_file, batch_size=3) == 7
+
+    parquet_file = pq.ParquetFile(transfer_file)
+    assert parquet_file.schema_arrow.field("vector").type.list_size == 16
+    assert parquet_file.schema_arrow.metadata[b"quke.embedding"] == (
+        b"langchain_core.embeddings.DeterministicFakeEmbedding"
+    )
+
+    target = str(tmp_path / "imported")
+    assert import_vectordb(transfer_file, target, VECTORDB_IMPORT, EMBEDDING_IMPORT, batch_size=3) == 7
+    assert contents(target) == contents(Vectordb)
+
+
+def test_import_sharded(tmp_path: Path, Vectordb: str):
+    transfer_file = str(tmp_path / "vectordb.parquet")
+    export_vectordb(Vectordb, VECTORDB_IMPORT, EMBEDDING_IMPORT, transfer_file)
+
+    target = str(tmp_path / "sharded")
+    import_vectordb(
+        transfer_file,
+        target,
+        VECTORDB_IMPORT,
+        EMBEDDING_IMPORT,
+        shard_params={"num_shards": 2},
+    )
+
+    # exporting the sharded store collects the chunks of all shards
+    assert export_vectordb(target, VECTORDB_IMPORT, EMBEDDING_IMPORT, transfer_file) == 7
+
+
+def test_reimport_replaces_chunks(tmp_path: Path, Vectordb: str):
+    transfer_file = str(tmp_path / "vectordb.parquet")
+    export_vectordb(Vectordb, VECTORDB_IMPORT, EMBEDDING_IMPORT, transfer_file)
+
+    target = str(tmp_path / "imported")
+    for _ in range(2):
+        import_vectordb(
+            transfer_file,
+            target,
+            VECTORDB_IMPORT,
+            EMBEDDING_IMPORT,
+            {"size": 16},
+            write_mode=DatabaseAction.APPEND,
+        )
+    assert contents(target) == contents(Vectordb)
+
+    embedding = PrecomputedEmbeddings(EMBEDDING_IMPORT, {"size": 16})
+    assert embedding.embed_query("chunk 3") == DeterministicFakeEmbedding(size=16).embed_query("chunk 3")
+    vectordb = Chroma(persist_directory=target, embedding_function=embedding)
+    assert vectordb.similarity_search("chunk 3", k=1)[0].metadata == {"source": "a.pdf", "page": 3}
+
+
+class EmbeddingsVectorStore(InMemoryVectorStore):
+    """In-memory store written like FAISS: from_embeddings, add_embeddings, save_local and load_local."""
+
+    @classmethod
+    def from_embeddings(cls, text_embeddings, embedding, metadatas, ids):
+        vectordb = cls(embedding=embedding)
+        vectordb.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        return vectordb
+
+    def add_embeddings(self, text_embeddings, metadatas, ids):
+        for id_, (text, vector), metadata in zip(ids, text_embeddings, metadatas, strict=True):
+            self.store[id_] = {"id": id_, "vector": vector, "text": text, "metadata": metadata}
+
+    def save_local(self, folder_path):
+        Path(folder_path).mkdir(parents=True, exist_ok=True)
+        self.dump(str(Path(folder_path) / "store.json"))
+
+    @classmethod
+    def load_local(cls, folder_path, embeddings, **kwargs):
+        return cls.load(str(Path(folder_path) / "store.json"), embeddings)
+
+
+def in_memory_contents(vectordb: InMemoryVectorStore) -> dict:
+    return {
+        e["id"]: (e["text"], e["metadata"], [round(v, 5) for v in e["vector"]])
+        for e in vectordb.store.values()
+    }
+
+
+@pytest.mark.parametrize("class_name", ["InMemoryVectorStore", "EmbeddingsVectorStore"])
+def test_roundtrip_other_vectorstore(tmp_path: Path, Vectordb: str, class_name: str):
+    module_name = "langchain_core.vectorstores" if class_name == "InMemoryVectorStore" else __name__
+    vectordb_import = ClassImportDefinition(module_name, class_name)
+    transfer_file = str(tmp_path / "vectordb.parquet")
+    export_vectordb(Vectordb, VECTORDB_IMPORT, EMBEDDING_IMPORT, transfer_file)
+
+    target = str(tmp_path / "other")
+    for _ in range(2):  # importing again replaces the chunks
+        assert import_vectordb(
+            transfer_file,
+            target,
+            vectordb_import,
+            EMBEDDING_IMPORT,
+            {"size": 16},
+            write_mode=DatabaseAction.APPEND,
+            batch_size=3,
+        ) == 7
+    embedding = PrecomputedEmbeddings(EMBEDDING_IMPORT, {"size": 16})
+    vectordb = open_vectordb(globals().get(class_name, InMemoryVectorStore), target, embedding)
+    assert in_memory_contents(vectordb) == contents(Vectordb)
+    assert vectordb.similarity_search("chunk 3", k=1)[0].metadata == {"source": "a.pdf", "page": 3}
+
+    # and back into Chroma
+    reexported = str(tmp_path / "other.parquet")
+    assert export_vectordb(target, vectordb_import, EMBEDDING_IMPORT, reexported, batch_size=3) == 7
+    chroma = str(tmp_path / "chroma")
+    import_vectordb(reexported, chroma, VECTORDB_IMPORT, EMBEDDING_IMPORT)
+    assert contents(chroma) == contents(Vectordb)
+
+
+def test_export_empty(tmp_path: Path):
+    transfer_file = str(tmp_path / "empty.parquet")
+    assert export_vectordb(str(tmp_path / "none"), VECTORDB_IMPORT, EMBEDDING_IMPORT, transfer_file) == 0
+    assert Path(transfer_file).is_file()
+    assert import_vectordb(transfer_file, str(tmp_path / "target"), VECTORDB_IMPORT, EMBEDDING_IMPORT) == 0